@@ -0,0 +1,20 @@
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+# Mesmas variáveis mínimas de tests/conftest.py, para importar o código de src/.
+os.environ.setdefault("BASE_URL", "http://testserver")
+os.environ.setdefault("STATIC_DIR", "static")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+os.environ.setdefault("AWS_REGION", "us-east-1")
+os.environ.setdefault("S3_BUCKET", "dummy-bucket")
+os.environ.setdefault("COMFYUI_API_SERVER1", "http://localhost")
+os.environ.setdefault("COMFYUI_API_SERVER2", "http://localhost")
+os.environ.setdefault("COMFYUI_API_SERVER3", "http://localhost")
+os.environ.setdefault("COMFYUI_API_SERVER4", "http://localhost")
+os.environ.setdefault("TIMER_TERMS", "20")
+os.environ.setdefault("CONFIG_INDEX", "6")
+os.environ.setdefault("WORKFLOW_PATH", os.path.join(ROOT, "src", "workflows", "mamulengo_v21_api.json"))
+os.environ.setdefault("WORKFLOW_NODE_ID_IMAGE_LOAD", "3023")
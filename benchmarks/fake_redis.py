@@ -0,0 +1,36 @@
+from collections import Counter
+
+from core.memory_store import MemoryPipeline, MemoryRedis
+
+
+class InMemoryRedis(MemoryRedis):
+    """
+    Backend em memória do job store (`core.memory_store`) contando cada
+    comando e cada ida ao Redis. Serve para rodar o load test sem um Redis
+    externo e comparar o número de comandos por job entre versões.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.ops = Counter()
+        self.round_trips = 0
+
+    def _count(self, name):
+        self.ops[name] += 1
+        self.round_trips += 1
+
+    def pipeline(self, transaction=True):
+        return InMemoryPipeline(self)
+
+
+class InMemoryPipeline(MemoryPipeline):
+    """
+    Enfileira comandos e os executa de uma vez, contando uma ida ao Redis.
+    """
+
+    async def execute(self):
+        calls = len(self.calls)
+        results = await super().execute()
+        # os comandos já contaram uma ida cada; o pipeline inteiro é uma só
+        self.redis.round_trips -= max(calls - 1, 0)
+        return results
@@ -0,0 +1,433 @@
+"""
+Load test ponta a ponta do backend.
+
+Sobe N instâncias de `src/dummy_comfyui_server.py`, um S3 local
+(`benchmarks/s3_stub.py`) e roda a API e o worker no mesmo processo, com um
+Redis em memória (ou um Redis real via --redis-url). Envia fotos para
+/api/upload numa taxa de chegada configurável, acompanha /api/result até o fim
+e grava um relatório JSON com vazão, percentis de latência e comandos Redis
+por job, para comparar mudanças de scheduler entre commits.
+
+    python benchmarks/loadtest.py --servers 4 --rate 0.5 --jobs 40 \\
+        --processing-ms 5000 --output bench_output.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from collections import Counter
+from datetime import datetime, timezone
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+BENCH = os.path.join(ROOT, "benchmarks")
+SAMPLE_IMAGE = os.path.join(SRC, "static", "sample.jpg")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 20.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f"porta {port} não respondeu em {timeout}s")
+
+
+def start_uvicorn(app: str, app_dir: str, port: int, env: dict) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "uvicorn", app, "--app-dir", app_dir,
+           "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, env={**os.environ, **env})
+    wait_for_port(port)
+    return proc
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)
+    return round(ordered[index], 3)
+
+
+def distribution(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 3),
+        "p50": percentile(values, 0.50),
+        "p90": percentile(values, 0.90),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": round(max(values), 3),
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def configure_environment(args, s3_url: str, server_urls: list):
+    """
+    Define as variáveis lidas por `core.config.Settings` antes de importar a API.
+    """
+    env = {
+        "BASE_URL": "http://127.0.0.1",
+        "STATIC_DIR": os.path.join(SRC, "static"),
+        "REDIS_URL": args.redis_url or "redis://127.0.0.1:6379/15",
+        "AWS_REGION": "us-east-1",
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "AWS_REQUEST_CHECKSUM_CALCULATION": "when_required",
+        "AWS_RESPONSE_CHECKSUM_VALIDATION": "when_required",
+        "S3_BUCKET": "bench",
+        "S3_ENDPOINT_URL": s3_url,
+        "TIMER_TERMS": "20",
+        "CONFIG_INDEX": "6",
+        "WORKFLOW_PATH": args.workflow,
+        "WORKFLOW_NODE_ID_IMAGE_LOAD": args.image_node,
+        "TRACE_EXPORTERS": "redis",
+    }
+    for i in range(4):
+        env[f"COMFYUI_API_SERVER{i + 1}"] = server_urls[i] if i < len(server_urls) else ""
+    env["COMFYUI_API_SERVERS"] = ",".join(server_urls[4:])
+    os.environ.update(env)
+    # o load test sai de um IP só: sem admissão, salvo se a variável vier do ambiente
+    os.environ.setdefault("ADMISSION_MAX_WAIT", "0")
+    os.environ.setdefault("ADMISSION_CLIENT_RATE", "0")
+    sys.path.insert(0, SRC)
+    sys.path.insert(0, BENCH)
+
+
+def patch_redis(client):
+    """
+    Aponta todos os módulos que importaram `redis` de core.redis para o cliente do benchmark.
+    """
+    for name in ("core.redis", "routes.routes", "routes.admin", "worker", "main"):
+        module = sys.modules.get(name)
+        if module is not None and hasattr(module, "redis"):
+            module.redis = client
+
+
+async def redis_command_stats(client) -> Counter:
+    info = await client.info("commandstats")
+    return Counter({k.replace("cmdstat_", ""): v["calls"] for k, v in info.items()})
+
+
+async def submit_and_wait(session, api_url: str, image: bytes, args, index: int, cancel: bool = False,
+                          lane: str = None) -> dict:
+    from aiohttp import FormData
+
+    result = {"index": index, "submitted_at": time.time(), "lane": lane or "default"}
+    form = FormData()
+    form.add_field("image", image, filename="sample.jpg", content_type="image/jpeg")
+    headers = {}
+    if lane:
+        form.add_field("lane", lane)
+        # faixas de prioridade (LANE_PRIORITY) só valem com o token
+        if os.environ.get("LANE_PRIORITY_TOKEN"):
+            headers["X-Lane-Token"] = os.environ["LANE_PRIORITY_TOKEN"]
+    async with session.post(f"{api_url}/api/upload", data=form, headers=headers) as resp:
+        result["upload_status"] = resp.status
+        if resp.status != 200:
+            result["status"] = "rejected"
+            return result
+        body = await resp.json()
+    result["request_id"] = body["request_id"]
+    result["accepted_at"] = time.time()
+    result["estimated_wait_seconds"] = body.get("estimated_wait_seconds")
+
+    deadline = result["submitted_at"] + args.timeout
+    cancel_at = result["accepted_at"] + args.cancel_after if cancel else None
+    while time.time() < deadline:
+        await asyncio.sleep(args.poll_interval)
+        if cancel_at and time.time() >= cancel_at:
+            # visitante que desistiu no meio da espera
+            async with session.post(f"{api_url}/api/cancel", data={"request_id": result["request_id"]}) as resp:
+                result["cancel_status"] = resp.status
+            cancel_at = None
+        async with session.get(f"{api_url}/api/result", params={"request_id": result["request_id"]}) as resp:
+            status = (await resp.json()).get("status")
+        if status in ("done", "error", "cancelled"):
+            result["status"] = status
+            result["finished_at"] = time.time()
+            return result
+    result["status"] = "timeout"
+    return result
+
+
+def parse_lanes(text: str) -> dict:
+    """
+    "booth=0.8,vip=0.2" -> {"booth": 0.8, "vip": 0.2}: fração dos uploads de cada faixa.
+    """
+    lanes = {}
+    for item in (text or "").split(","):
+        name, sep, share = item.strip().partition("=")
+        if name:
+            lanes[name.strip()] = float(share) if sep else 1.0
+    return lanes
+
+
+async def drive(args, api_url: str) -> list:
+    import aiohttp
+
+    with open(SAMPLE_IMAGE, "rb") as f:
+        image = f.read()
+
+    rng = random.Random(args.seed)
+    lanes = parse_lanes(args.lanes)
+    tasks = []
+    async with aiohttp.ClientSession() as session:
+        for i in range(args.jobs):
+            cancel = rng.random() < args.cancel_fraction
+            lane = rng.choices(list(lanes), weights=list(lanes.values()))[0] if lanes else None
+            tasks.append(asyncio.create_task(submit_and_wait(session, api_url, image, args, i, cancel, lane)))
+            gap = rng.expovariate(args.rate) if args.arrival == "poisson" else 1.0 / args.rate
+            await asyncio.sleep(gap)
+        return await asyncio.gather(*tasks)
+
+
+async def queue_waits(client, results: list) -> list:
+    waits = []
+    for r in results:
+        if r.get("status") != "done":
+            continue
+        job = await client.hgetall(f"job:{r['request_id']}")
+        enqueued_at, proc_start = job.get("enqueued_at"), job.get("ts_proc_start")
+        if enqueued_at and proc_start:
+            enqueued = datetime.fromisoformat(enqueued_at).replace(tzinfo=timezone.utc).timestamp()
+            waits.append(max(float(proc_start) - enqueued, 0.0))
+    return waits
+
+
+async def cold_starts(client, results: list) -> int:
+    count = 0
+    for r in results:
+        if r.get("status") == "done":
+            count += int(await client.hget(f"job:{r['request_id']}", "cold_start") or 0)
+    return count
+
+
+async def jobs_by_server(client, results: list) -> dict:
+    servers = Counter()
+    for r in results:
+        if r.get("status") == "done":
+            servers[await client.hget(f"job:{r['request_id']}", "server") or "unknown"] += 1
+    return dict(servers)
+
+
+async def scale_out(client, count: int, dummy_env: dict, procs: list, delay: float):
+    """
+    Simula a chegada de GPUs no meio da carga: sobe `count` servidores dummy
+    e os registra no registro dinâmico, como faria o agente de cada nó.
+    """
+    from core import servers
+
+    await asyncio.sleep(delay)
+    for _ in range(count):
+        port = free_port()
+        procs.append(start_uvicorn("dummy_comfyui_server:app", SRC, port, dummy_env))
+        await servers.register(client, f"http://127.0.0.1:{port}", {"source": "loadtest"})
+
+
+async def crash_and_restart(state: dict, worker_module, server_urls, delay: float):
+    """
+    Simula a queda do worker no meio da carga: cancela o loop e as tarefas
+    em andamento (os jobs ficam em processing) e sobe um worker novo, que
+    precisa retomá-los.
+    """
+    await asyncio.sleep(delay)
+    old, old_task = state["worker"], state["task"]
+    old_task.cancel()
+    for task in list(old.tasks):
+        task.cancel()
+    await asyncio.gather(old_task, *old.tasks, return_exceptions=True)
+    state["worker"] = worker_module.Worker(server_urls)
+    state["task"] = asyncio.create_task(state["worker"].worker_loop())
+    state["restarts"] += 1
+
+
+async def run(args) -> dict:
+    procs = []
+    try:
+        s3_port = free_port()
+        procs.append(start_uvicorn("s3_stub:app", BENCH, s3_port, {}))
+
+        server_urls = []
+        dummy_env = {"DEFAULT_PROCESSING_TIME": str(args.processing_ms)}
+        dummy_env.update(dict(item.split("=", 1) for item in args.dummy_env))
+        for _ in range(args.servers):
+            port = free_port()
+            procs.append(start_uvicorn("dummy_comfyui_server:app", SRC, port, dummy_env))
+            server_urls.append(f"http://127.0.0.1:{port}")
+
+        configure_environment(args, f"http://127.0.0.1:{s3_port}", server_urls)
+
+        import uvicorn
+        import main
+        import worker as worker_module
+        from fake_redis import InMemoryRedis
+
+        logging.getLogger().setLevel(logging.WARNING)
+
+        if args.redis_url:
+            from core.redis import redis as client
+            before = await redis_command_stats(client)
+        else:
+            client = InMemoryRedis()
+            patch_redis(client)
+            before = Counter()
+
+        api_port = free_port()
+        server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=api_port, log_level="warning"))
+        api_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.05)
+
+        worker = worker_module.Worker(server_urls)
+        state = {"worker": worker, "task": asyncio.create_task(worker.worker_loop()), "restarts": 0}
+        restart_task = scale_task = None
+        if args.scale_after is not None:
+            scale_task = asyncio.create_task(scale_out(client, args.scale_servers, dummy_env, procs, args.scale_after))
+        if args.restart_after:
+            restart_task = asyncio.create_task(crash_and_restart(state, worker_module, server_urls,
+                                                                 args.restart_after))
+
+        started = time.time()
+        results = await drive(args, f"http://127.0.0.1:{api_port}")
+        elapsed = time.time() - started
+        if restart_task:
+            restart_task.cancel()
+        if scale_task:
+            scale_task.cancel()
+
+        if args.redis_url:
+            ops = await redis_command_stats(client) - before
+            round_trips = None
+        else:
+            ops = client.ops
+            round_trips = client.round_trips
+
+        waits = await queue_waits(client, results)
+        cold = await cold_starts(client, results)
+        by_server = await jobs_by_server(client, results)
+
+        state["task"].cancel()
+        server.should_exit = True
+        await api_task
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                # conexões WebSocket abertas seguram o shutdown gracioso do uvicorn
+                proc.kill()
+                proc.wait()
+
+    done = [r for r in results if r.get("status") == "done"]
+    statuses = Counter(r.get("status") for r in results)
+    total_ops = sum(ops.values())
+    return {
+        "revision": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "servers": args.servers,
+            "jobs": args.jobs,
+            "rate": args.rate,
+            "arrival": args.arrival,
+            "processing_ms": args.processing_ms,
+            "workflow": os.path.basename(args.workflow),
+            "redis": "external" if args.redis_url else "in-memory",
+            "dummy_env": args.dummy_env,
+            "cancel_fraction": args.cancel_fraction,
+            "restart_after": args.restart_after,
+            "scale_after": args.scale_after,
+            "scale_servers": args.scale_servers if args.scale_after is not None else 0,
+            "lanes": args.lanes,
+        },
+        "results": {
+            "elapsed_seconds": round(elapsed, 3),
+            "statuses": dict(statuses),
+            "upload_statuses": dict(Counter(r.get("upload_status") for r in results)),
+            "worker_restarts": state["restarts"],
+            "throughput_jobs_per_second": round(len(done) / elapsed, 4) if elapsed else 0,
+            "end_to_end_seconds": distribution([r["finished_at"] - r["submitted_at"] for r in done]),
+            "end_to_end_seconds_by_lane": {
+                lane: distribution([r["finished_at"] - r["submitted_at"] for r in done if r["lane"] == lane])
+                for lane in sorted({r["lane"] for r in done})
+            },
+            "queue_wait_seconds": distribution(waits),
+            "cold_start_jobs": cold,
+            "jobs_by_server": by_server,
+            "redis": {
+                "commands_total": total_ops,
+                "commands_per_job": round(total_ops / len(done), 2) if done else None,
+                "round_trips_total": round_trips,
+                "by_command": dict(ops.most_common()),
+            },
+        },
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", type=int, default=4, help="instâncias do dummy ComfyUI")
+    parser.add_argument("--jobs", type=int, default=20, help="total de uploads")
+    parser.add_argument("--rate", type=float, default=1.0, help="chegadas por segundo")
+    parser.add_argument("--arrival", choices=("poisson", "uniform"), default="poisson")
+    parser.add_argument("--processing-ms", type=int, default=2000, help="DEFAULT_PROCESSING_TIME do dummy")
+    parser.add_argument("--dummy-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="variável extra para os servidores dummy (repetível)")
+    parser.add_argument("--workflow", default=os.path.join(SRC, "workflows", "comfyui_basic_input.json"))
+    parser.add_argument("--image-node", default="8", help="node id do LoadImage no workflow")
+    parser.add_argument("--redis-url", default=None, help="usa um Redis real em vez do fake em memória")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=600, help="limite por job, em segundos")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--cancel-fraction", type=float, default=0.0,
+                        help="fração dos jobs cancelados via /api/cancel")
+    parser.add_argument("--cancel-after", type=float, default=1.0,
+                        help="segundos entre o upload e o cancelamento")
+    parser.add_argument("--lanes", default=None, metavar="FAIXA=FRAÇÃO,...",
+                        help="distribui os uploads entre faixas, ex.: booth=0.8,vip=0.2")
+    parser.add_argument("--restart-after", type=float, default=None,
+                        help="derruba e sobe de novo o worker após N segundos")
+    parser.add_argument("--scale-after", type=float, default=None,
+                        help="registra servidores novos no registro dinâmico após N segundos")
+    parser.add_argument("--scale-servers", type=int, default=2, help="quantos servidores o --scale-after sobe")
+    parser.add_argument("--output", default=None, help="arquivo JSON de saída (padrão: stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
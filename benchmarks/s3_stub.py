@@ -0,0 +1,60 @@
+"""
+S3 mínimo em memória para o load test: atende PutObject, GetObject e
+HeadObject com endereçamento path-style (/{bucket}/{key}).
+
+    uvicorn s3_stub:app --app-dir benchmarks --port 9000
+"""
+import hashlib
+
+from typing import Dict, Tuple
+
+from fastapi import FastAPI, Request, Response
+
+
+app = FastAPI()
+
+objects: Dict[Tuple[str, str], Tuple[bytes, str]] = {}
+
+
+def _decode_aws_chunked(body: bytes) -> bytes:
+    # corpo no formato aws-chunked: "<tamanho hex>[;ext]\r\n<dados>\r\n ... 0\r\n<trailers>"
+    out, pos = bytearray(), 0
+    while True:
+        end = body.index(b"\r\n", pos)
+        size = int(body[pos:end].split(b";")[0], 16)
+        if size == 0:
+            return bytes(out)
+        start = end + 2
+        out += body[start:start + size]
+        pos = start + size + 2
+
+
+@app.put("/{bucket}/{key:path}")
+async def put_object(bucket: str, key: str, request: Request):
+    body = await request.body()
+    if "aws-chunked" in request.headers.get("content-encoding", ""):
+        body = _decode_aws_chunked(body)
+    content_type = request.headers.get("content-type", "application/octet-stream")
+    objects[(bucket, key)] = (body, content_type)
+    return Response(status_code=200, headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+
+@app.get("/{bucket}/{key:path}")
+async def get_object(bucket: str, key: str):
+    item = objects.get((bucket, key))
+    if item is None:
+        return Response(status_code=404, content=b"<Error><Code>NoSuchKey</Code></Error>",
+                        media_type="application/xml")
+    body, content_type = item
+    return Response(content=body, media_type=content_type,
+                    headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+
+@app.head("/{bucket}/{key:path}")
+async def head_object(bucket: str, key: str):
+    item = objects.get((bucket, key))
+    if item is None:
+        return Response(status_code=404)
+    body, content_type = item
+    return Response(status_code=200, media_type=content_type,
+                    headers={"Content-Length": str(len(body))})
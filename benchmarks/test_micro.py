@@ -0,0 +1,155 @@
+"""
+Micro-benchmarks dos caminhos quentes do worker (pytest-benchmark).
+
+    pip install -r requirements-bench.txt
+    pytest benchmarks/test_micro.py --benchmark-storage=benchmarks/baselines --benchmark-autosave
+    pytest benchmarks/test_micro.py --benchmark-storage=benchmarks/baselines --benchmark-compare \\
+        --benchmark-compare-fail=mean:15%
+"""
+import asyncio
+import copy
+import glob
+import io
+import json
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from PIL import Image
+
+from fake_redis import InMemoryRedis
+
+
+WORKFLOWS_DIR = os.path.join(os.path.dirname(__file__), "..", "src", "workflows")
+WORKFLOWS = sorted(glob.glob(os.path.join(WORKFLOWS_DIR, "mamulengo_v*_api.json")))
+
+
+def load_workflow(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def synthetic_png(width: int, height: int) -> bytes:
+    # ruído + gradiente: comprime de forma parecida com uma foto gerada
+    noise = Image.effect_noise((width, height), 40).convert("RGB")
+    gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    img = Image.blend(noise, gradient, 0.6)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize("path", WORKFLOWS, ids=lambda p: os.path.basename(p)[:-5])
+def test_workflow_deepcopy(benchmark, path):
+    template = load_workflow(path)
+    benchmark(copy.deepcopy, template)
+
+
+@pytest.mark.parametrize("path", WORKFLOWS, ids=lambda p: os.path.basename(p)[:-5])
+def test_prompt_json_serialization(benchmark, path):
+    payload = {"prompt": load_workflow(path), "client_id": str(uuid.uuid4())}
+    benchmark(lambda: json.dumps(payload).encode("utf-8"))
+
+
+@pytest.mark.parametrize("size", [(960, 1704), (1472, 1472)], ids=lambda s: f"{s[0]}x{s[1]}")
+def test_save_image_buffer(benchmark, size):
+    # save_image_buffer não decodifica mais; a regravação em PNG que ele fazia
+    # agora é o encode_image do core.imaging, medido aqui para manter a série
+    from core.imaging import encode_image
+
+    benchmark.pedantic(encode_image, args=(synthetic_png(*size), "png", 85), rounds=5, iterations=1)
+
+
+@pytest.mark.parametrize("fmt", ["png", "webp", "jpeg", "avif"])
+@pytest.mark.parametrize("size", [(960, 1704), (1472, 1472)], ids=lambda s: f"{s[0]}x{s[1]}")
+def test_encode_image(benchmark, size, fmt):
+    from core.imaging import encode_image, format_supported
+
+    if not format_supported(fmt):
+        pytest.skip(f"Pillow sem suporte a {fmt}")
+    data = synthetic_png(*size)
+    out = benchmark.pedantic(encode_image, args=(data, fmt, 85), rounds=3, iterations=1)
+    benchmark.extra_info["bytes_in"] = len(data)
+    benchmark.extra_info["bytes_out"] = len(out)
+
+
+def test_postprocess_frame(benchmark, tmp_path):
+    from core.imaging import postprocess
+
+    frame = Image.new("RGBA", (1080, 1920), (200, 30, 30, 255))
+    frame.paste((0, 0, 0, 0), (60, 60, 1020, 1860))
+    frame.save(tmp_path / "frame.png")
+    img = Image.open(io.BytesIO(synthetic_png(960, 1704)))
+    img.load()
+    benchmark(postprocess, img, str(tmp_path / "frame.png"))
+
+
+def test_generate_qr_code(benchmark):
+    from utils.qrcode import generate_qr_code
+
+    benchmark(generate_qr_code, "https://apostenaquinadesaojoao.com.br/meumamulengo.html?image_id="
+              + str(uuid.uuid4()))
+
+
+def test_format_to_e164(benchmark):
+    from utils.sms import format_to_e164
+
+    benchmark(format_to_e164, "(81) 99876-5432")
+
+
+def build_job_hashes(count: int, seed: int = 7) -> dict:
+    """
+    Hashes de job parecidos com os de um dia de evento: a maioria já
+    finalizada, alguns na fila, processando ou com falha.
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    data = {}
+    for i in range(count):
+        rid = str(uuid.UUID(int=rng.getrandbits(128)))
+        roll = rng.random()
+        job = {
+            "input": f"input/{rid}/x.png",
+            "output": "",
+            "attempt": "1",
+            "enqueued_at": (now - timedelta(seconds=rng.randint(0, 36000))).isoformat(),
+        }
+        if roll < 0.90:
+            job.update(status="done", output=f"https://bucket/output/{rid}.png")
+        elif roll < 0.95:
+            job.update(status="queued")
+        elif roll < 0.98:
+            job.update(status="processing", server="http://gpu1",
+                       proc_start_at=(now - timedelta(seconds=rng.randint(0, 120))).isoformat())
+        else:
+            job.update(status="failed", error="boom")
+        data[f"job:{rid}"] = job
+    return data
+
+
+def test_process_jobs_tick_10k(benchmark, monkeypatch):
+    import worker as worker_module
+
+    fake = InMemoryRedis()
+    monkeypatch.setattr(worker_module, "redis", fake)
+    worker = worker_module.Worker(server_list=[])
+    template = build_job_hashes(10_000)
+    loop = asyncio.new_event_loop()
+
+    def setup():
+        fake.data = {key: dict(job) for key, job in template.items()}
+        worker.queued_jobs = {}
+
+    benchmark.pedantic(lambda: loop.run_until_complete(worker.process_jobs()),
+                       setup=setup, rounds=10, iterations=1)
+    loop.close()
+
+
+@pytest.mark.parametrize("path", WORKFLOWS, ids=lambda p: os.path.basename(p)[:-5])
+def test_compiled_workflow_render(benchmark, path):
+    from core.workflow import CompiledWorkflow
+
+    compiled = CompiledWorkflow(load_workflow(path), {"image": (os.environ["WORKFLOW_NODE_ID_IMAGE_LOAD"], "image")})
+    benchmark(compiled.render, str(uuid.uuid4()), image="mamulengos/input.png")
@@ -0,0 +1,161 @@
+import hmac
+import ipaddress
+import math
+import time
+
+import structlog
+
+from core.config import settings
+from core import stats
+from core.jobstore import SUBMISSIONS_QUEUE
+
+
+log = structlog.get_logger()
+
+BUCKET_PREFIX = "admission:bucket:"
+# jobs na fila em memória do worker, gravado por ele a cada mudança (o gauge só sai a cada flush)
+BACKLOG_KEY = "admission:backlog"
+
+OVERLOADED = "overloaded"
+RATE_LIMITED = "rate_limited"
+
+
+KIOSK_TOKEN_HEADER = "X-Kiosk-Token"
+
+
+def _pairs(text: str) -> dict:
+    # "totem-1=abc,totem-2=def" -> {"totem-1": "abc", "totem-2": "def"}
+    pairs = (item.partition("=") for item in (text or "").split(","))
+    return {k.strip(): v.strip() for k, sep, v in pairs if sep and k.strip() and v.strip()}
+
+
+def kiosk_id(request):
+    """
+    Id do totem do header ADMISSION_CLIENT_HEADER, só quando vem com o token
+    daquele totem (ADMISSION_KIOSK_TOKENS) no X-Kiosk-Token: o header sozinho
+    qualquer cliente troca a cada envio.
+    """
+    if not settings.ADMISSION_CLIENT_HEADER:
+        return None
+    kiosk = (request.headers.get(settings.ADMISSION_CLIENT_HEADER) or "").strip()[:64]
+    expected = _pairs(settings.ADMISSION_KIOSK_TOKENS).get(kiosk)
+    token = request.headers.get(KIOSK_TOKEN_HEADER) or ""
+    if not kiosk or not expected or not hmac.compare_digest(token.encode(), expected.encode()):
+        return None
+    return kiosk
+
+
+def _trusted(address: str, proxies: list) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in proxies)
+
+
+def client_ip(request) -> str:
+    """
+    IP de quem envia. O X-Forwarded-For só vale quando a conexão vem de um
+    proxy de ADMISSION_TRUSTED_PROXIES: aí o cliente é o primeiro endereço,
+    da direita para a esquerda, que não é um desses proxies.
+    """
+    peer = request.client.host if request.client else "unknown"
+    proxies = [ipaddress.ip_network(p.strip(), strict=False)
+               for p in (settings.ADMISSION_TRUSTED_PROXIES or "").split(",") if p.strip()]
+    if not proxies or not _trusted(peer, proxies):
+        return peer
+    forwarded = [a.strip() for a in (request.headers.get("x-forwarded-for") or "").split(",") if a.strip()]
+    for address in reversed(forwarded):
+        if not _trusted(address, proxies):
+            return address
+    return forwarded[0] if forwarded else peer
+
+
+def client_key(request) -> str:
+    """
+    Identifica quem envia: o totem autenticado (ver `kiosk_id`) ou o IP.
+    """
+    kiosk = kiosk_id(request)
+    if kiosk:
+        return f"kiosk:{kiosk}"
+    return f"ip:{client_ip(request)}"
+
+
+async def queue_state(redis) -> dict:
+    """
+    Espera prevista para um upload feito agora (fila + a própria geração) e
+    se ela cabe em ADMISSION_MAX_WAIT. `retry_after_seconds` é quanto a fila
+    leva para voltar ao limite.
+    """
+    pending = int(await redis.llen(SUBMISSIONS_QUEUE) or 0)
+    backlog = pending + int(await redis.get(BACKLOG_KEY) or 0)
+    wait = await stats.estimate_wait(redis, backlog + 1)
+    max_wait = settings.ADMISSION_MAX_WAIT
+    accepting = not max_wait or wait <= max_wait
+    return {
+        "accepting": accepting,
+        "queue_depth": backlog,
+        "estimated_wait_seconds": round(wait, 1),
+        "max_wait_seconds": max_wait,
+        "retry_after_seconds": 0 if accepting else max(math.ceil(wait - max_wait), 1),
+    }
+
+
+def _refill(state: dict, burst: int, rate: float, now: float) -> float:
+    tokens = float(state.get("tokens", burst))
+    return min(burst, tokens + max(now - float(state.get("ts", now)), 0.0) * rate)
+
+
+async def bucket(redis, client: str, consume: bool = True, now: float = None) -> dict:
+    """
+    Token bucket do cliente, guardado no Redis para valer entre os processos
+    da API: ADMISSION_CLIENT_BURST fichas, repostas a ADMISSION_CLIENT_RATE
+    por minuto. Com `consume`, gasta uma ficha se houver, numa transação
+    (WATCH/MULTI): dois uploads simultâneos do mesmo cliente não leem o
+    mesmo saldo.
+    """
+    rate = settings.ADMISSION_CLIENT_RATE / 60.0
+    burst = settings.ADMISSION_CLIENT_BURST
+    if rate <= 0:
+        return {"allowed": True, "tokens": None, "retry_after_seconds": 0}
+
+    now = time.time() if now is None else now
+    key = f"{BUCKET_PREFIX}{client}"
+
+    async def spend(pipe):
+        # depois do WATCH o pipeline executa na hora; o MULTI passa a enfileirar
+        tokens = _refill(await pipe.hgetall(key), burst, rate, now)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        pipe.multi()
+        pipe.hset(key, mapping={"tokens": round(tokens, 4), "ts": round(now, 3)})
+        pipe.expire(key, math.ceil(burst / rate) + 60)
+        return allowed, tokens
+
+    if consume:
+        allowed, tokens = await redis.transaction(spend, key, value_from_callable=True)
+    else:
+        tokens = _refill(await redis.hgetall(key), burst, rate, now)
+        allowed = tokens >= 1
+    return {
+        "allowed": allowed,
+        "tokens": math.floor(tokens),
+        "retry_after_seconds": 0 if allowed else max(math.ceil((1 - tokens) / rate), 1),
+    }
+
+
+async def admit(redis, client: str, priority: bool = False):
+    """
+    Decide se o upload entra. Retorna None ou (status HTTP, motivo, segundos
+    para tentar de novo, estado da fila). Fila cheia recusa com 503 sem
+    gastar ficha, exceto nas faixas de prioridade estrita (`priority`), que
+    furam a fila; excesso de um mesmo cliente recusa com 429.
+    """
+    state = await queue_state(redis)
+    if not state["accepting"] and not priority:
+        return 503, OVERLOADED, state["retry_after_seconds"], state
+    limit = await bucket(redis, client)
+    if not limit["allowed"]:
+        return 429, RATE_LIMITED, limit["retry_after_seconds"], state
+    return None
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+
+import structlog
+
+from core.config import settings
+
+
+log = structlog.get_logger()
+
+# zset request_id -> instante (epoch) em que o job chegou a um status final
+FINISHED_KEY = "jobs:finished"
+TERMINAL_STATUSES = ("done", "error", "cancelled")
+
+# campos que só servem enquanto o job está vivo
+TRANSIENT_FIELDS = ("deadline_at", "retry_at", "avoid_servers", "cancel_requested_at", "batch_index")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    request_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    lane TEXT,
+    workflow TEXT,
+    created_at TEXT,
+    finished_at REAL,
+    data TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at);
+"""
+
+
+class JobArchive:
+    """
+    Arquivo dos jobs finalizados num SQLite em disco: uma linha por job, com
+    as colunas usadas em consultas e o hash completo em JSON. O worker grava
+    em lote; a API consulta quando o hash já saiu do Redis. API e worker
+    precisam enxergar o mesmo arquivo (volume compartilhado).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._ready = False
+
+    def _connect(self, readonly: bool = False) -> sqlite3.Connection:
+        if readonly:
+            return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        if not self._ready:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        if not self._ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._ready = True
+        return conn
+
+    def write(self, jobs: dict):
+        """
+        Grava {request_id: hash do job} numa única transação.
+        """
+        rows = []
+        for request_id, job in jobs.items():
+            data = {k: v for k, v in job.items() if k not in TRANSIENT_FIELDS and v not in ("", None)}
+            rows.append((request_id, job.get("status"), job.get("lane"), job.get("workflow"),
+                         job.get("created_at") or job.get("enqueued_at"), float(job.get("finished_at") or 0) or None,
+                         json.dumps(data, separators=(",", ":"), ensure_ascii=False)))
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        finally:
+            conn.close()
+
+    def get(self, request_id: str):
+        """
+        Hash arquivado do job, ou None.
+        """
+        if not os.path.exists(self.path):
+            return None
+        conn = self._connect(readonly=True)
+        try:
+            row = conn.execute("SELECT data FROM jobs WHERE request_id = ?", (request_id,)).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row else None
+
+
+    def delete(self, request_id: str) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        conn = self._connect()
+        try:
+            with conn:
+                return conn.execute("DELETE FROM jobs WHERE request_id = ?", (request_id,)).rowcount > 0
+        finally:
+            conn.close()
+
+
+job_archive = JobArchive(settings.ARCHIVE_PATH) if settings.ARCHIVE_PATH else None
+
+
+async def mark_finished(redis, request_id: str, ts: float = None):
+    """
+    Registra o fim do job; o arquivamento começa a contar a partir daqui.
+    """
+    ts = time.time() if ts is None else ts
+    await redis.hset(f"job:{request_id}", "finished_at", round(ts, 3))
+    await redis.zadd(FINISHED_KEY, {request_id: ts})
+
+
+async def archive_finished(redis, archive: JobArchive, grace: float, ttl: int, batch: int = 500,
+                           now: float = None) -> int:
+    """
+    Copia para o arquivo, em lote, os jobs finalizados há mais de `grace`
+    segundos e põe um TTL de `ttl` segundos no hash do Redis. Jobs que
+    voltaram a rodar (replay da dead-letter) só saem do índice.
+    """
+    now = time.time() if now is None else now
+    ids = await redis.zrangebyscore(FINISHED_KEY, "-inf", now - grace)
+    archived = 0
+    for start in range(0, len(ids), batch):
+        chunk = ids[start:start + batch]
+        pipe = redis.pipeline()
+        for request_id in chunk:
+            pipe.hgetall(f"job:{request_id}")
+        jobs = {request_id: job for request_id, job in zip(chunk, await pipe.execute())
+                if job and job.get("status") in TERMINAL_STATUSES}
+        if jobs:
+            await asyncio.to_thread(archive.write, jobs)
+
+        pipe = redis.pipeline()
+        for request_id in jobs:
+            pipe.expire(f"job:{request_id}", ttl)
+        pipe.zrem(FINISHED_KEY, *chunk)
+        await pipe.execute()
+        archived += len(jobs)
+    if archived:
+        log.info("archive.jobs_archived", count=archived, path=archive.path)
+    return archived
+
+
+async def reopen(redis, archive: JobArchive, request_id: str):
+    """
+    Job finalizado que volta a rodar (replay da dead-letter): tira o TTL que
+    o arquivamento pôs no hash, o fim do índice e a linha do arquivo, para o
+    job não expirar no meio do caminho nem ser lido do arquivo com o status
+    antigo.
+    """
+    pipe = redis.pipeline()
+    pipe.persist(f"job:{request_id}")
+    pipe.hdel(f"job:{request_id}", "finished_at")
+    pipe.zrem(FINISHED_KEY, request_id)
+    await pipe.execute()
+    if archive is not None:
+        await asyncio.to_thread(archive.delete, request_id)
+
+
+async def load_job(redis, archive: JobArchive, request_id: str) -> dict:
+    """
+    Hash do job no Redis ou, se já expirou, no arquivo (com "archived"
+    marcado). Dicionário vazio se o job não existe.
+    """
+    job = await redis.hgetall(f"job:{request_id}")
+    if job or archive is None:
+        return job
+    archived = await asyncio.to_thread(archive.get, request_id)
+    if archived:
+        archived["archived"] = True
+        return archived
+    return {}
@@ -14,6 +14,7 @@ import structlog
 from PIL import Image
 
 from core.config import settings
+from core.imaging import postprocess
 from utils.files import generate_timestamped_filename
 
 log = structlog.get_logger()
@@ -235,24 +236,10 @@ class ComfyUiAPI:
         Adiciona marca d'água à imagem gerada pelo ComfyUI.
         Insere o watermark no centro inferior da imagem.
         """
-        base_image = Image.open(base_image_path).convert("RGBA")
-        watermark = Image.open(watermark_path).convert("RGBA")
-
-        if watermark.width > base_image.width:
-            ratio = (base_image.width / watermark.width) * 0.5
-            new_size = (int(watermark.width * ratio), int(watermark.height * ratio))
-            watermark = watermark.resize(new_size, Image.Resampling.LANCZOS)
-
-        position = (
-            (base_image.width - watermark.width) // 2,
-            base_image.height - watermark.height - 10,
-        )
-
-        composite = Image.new("RGBA", base_image.size)
-        composite = Image.alpha_composite(composite, base_image)
-        composite.paste(watermark, position, watermark)
-
-        composite.convert("RGB").save(base_image_path, "PNG")
+        # a marca d'água decodificada e escalada fica em cache por tamanho de imagem
+        with Image.open(base_image_path) as base_image:
+            composite = postprocess(base_image, watermark=watermark_path)
+        composite.save(base_image_path, "PNG")
 
     def save_image_buffer(self, images: dict) -> io.BytesIO:
         """
@@ -12,13 +12,23 @@ class Settings(BaseSettings):
     COMFYUI_API_SERVER2: str = Field(default=None, env="COMFYUI_API_SERVER2")
     COMFYUI_API_SERVER3: str = Field(default=None, env="COMFYUI_API_SERVER3")
     COMFYUI_API_SERVER4: str = Field(default=None, env="COMFYUI_API_SERVER4")
+    COMFYUI_API_SERVERS: Optional[str] = Field(default=None, env="COMFYUI_API_SERVERS")
+    SERVER_HEARTBEAT_TTL: float = Field(default=30.0, env="SERVER_HEARTBEAT_TTL")
+    SERVER_REFRESH_INTERVAL: float = Field(default=2.0, env="SERVER_REFRESH_INTERVAL")
+    SERVER_REAP_SECONDS: float = Field(default=3600.0, env="SERVER_REAP_SECONDS")
     IMAGE_TEMP_FOLDER: str = Field(default="static/outputs", env="IMAGE_TEMP_FOLDER")
-    REDIS_URL: str = Field(..., env="REDIS_URL")
+    REDIS_URL: Optional[str] = Field(default=None, env="REDIS_URL")
     SENTRY_DSN: Optional[str] = Field(default=None, env="SENTRY_DSN")
     WORKFLOW_PATH: str = Field(default="workflows/comfyui_basic.json", env="WORKFLOW_PATH")
     WORKFLOW_NODE_ID_KSAMPLER: str = Field(default="3", env="WORKFLOW_NODE_ID_KSAMPLER")
     WORKFLOW_NODE_ID_IMAGE_LOAD: str = Field(default="15", env="WORKFLOW_NODE_ID_IMAGE_LOAD")
     WORKFLOW_NODE_ID_TEXT_INPUT: str = Field(default="18", env="WORKFLOW_NODE_ID_TEXT_INPUT")
+    WORKFLOW_PRUNE: bool = Field(default=True, env="WORKFLOW_PRUNE")
+    WORKFLOW_OUTPUT_NODES: Optional[str] = Field(default=None, env="WORKFLOW_OUTPUT_NODES")
+    WORKFLOW_DIR: Optional[str] = Field(default=None, env="WORKFLOW_DIR")
+    WORKFLOW_GLOB: str = Field(default="*.json", env="WORKFLOW_GLOB")
+    WORKFLOW_WEIGHTS: Optional[str] = Field(default=None, env="WORKFLOW_WEIGHTS")
+    WORKFLOW_RELOAD_INTERVAL: float = Field(default=5.0, env="WORKFLOW_RELOAD_INTERVAL")
     CONFIG_INDEX: str = Field(default=6, env="CONFIG_INDEX")
     LOG_API: Optional[str] = Field(default=None, env="LOG_API")
     LOG_PROJECT_ID: Optional[str] = Field(default=None, env="LOG_PROJECT_ID")
@@ -27,6 +37,49 @@ class Settings(BaseSettings):
     DEFAULT_PROCESSING_TIME: int = Field(8000, env="DEFAULT_PROCESSING_TIME")
     AWS_REGION: str = Field(..., env="AWS_REGION")
     S3_BUCKET: str = Field(..., env="S3_BUCKET")
+    S3_ENDPOINT_URL: Optional[str] = Field(default=None, env="S3_ENDPOINT_URL")
+    TRACE_EXPORTERS: str = Field(default="redis", env="TRACE_EXPORTERS")
+    TRACE_FILE_PATH: str = Field(default="logs/traces.jsonl", env="TRACE_FILE_PATH")
+    TRACE_TTL_SECONDS: int = Field(default=7 * 24 * 3600, env="TRACE_TTL_SECONDS")
+    ADMIN_TOKEN: Optional[str] = Field(default=None, env="ADMIN_TOKEN")
+    COMFYUI_OUTPUT_MODE: str = Field(default="http", env="COMFYUI_OUTPUT_MODE")
+    JOB_TIMEOUT: int = Field(default=300, env="JOB_TIMEOUT")
+    RETRY_MAX_ATTEMPTS: int = Field(default=3, env="RETRY_MAX_ATTEMPTS")
+    RETRY_BASE_DELAY: float = Field(default=2.0, env="RETRY_BASE_DELAY")
+    RETRY_MAX_DELAY: float = Field(default=60.0, env="RETRY_MAX_DELAY")
+    SHUTDOWN_GRACE_SECONDS: float = Field(default=60.0, env="SHUTDOWN_GRACE_SECONDS")
+    ADMISSION_MAX_WAIT: float = Field(default=600.0, env="ADMISSION_MAX_WAIT")
+    ADMISSION_CLIENT_RATE: float = Field(default=6.0, env="ADMISSION_CLIENT_RATE")
+    ADMISSION_CLIENT_BURST: int = Field(default=6, env="ADMISSION_CLIENT_BURST")
+    ADMISSION_CLIENT_HEADER: Optional[str] = Field(default="X-Kiosk-Id", env="ADMISSION_CLIENT_HEADER")
+    ADMISSION_KIOSK_TOKENS: Optional[str] = Field(default=None, env="ADMISSION_KIOSK_TOKENS")
+    ADMISSION_TRUSTED_PROXIES: Optional[str] = Field(default=None, env="ADMISSION_TRUSTED_PROXIES")
+    LANE_WEIGHTS: Optional[str] = Field(default=None, env="LANE_WEIGHTS")
+    LANE_PRIORITY: Optional[str] = Field(default=None, env="LANE_PRIORITY")
+    LANE_PRIORITY_TOKEN: Optional[str] = Field(default=None, env="LANE_PRIORITY_TOKEN")
+    ARCHIVE_PATH: Optional[str] = Field(default="data/jobs_archive.sqlite3", env="ARCHIVE_PATH")
+    JOB_RETENTION_SECONDS: int = Field(default=86400, env="JOB_RETENTION_SECONDS")
+    ARCHIVED_JOB_TTL: int = Field(default=3600, env="ARCHIVED_JOB_TTL")
+    ARCHIVE_INTERVAL: float = Field(default=60.0, env="ARCHIVE_INTERVAL")
+    JOB_STORE: str = Field(default="redis", env="JOB_STORE")
+    JOB_STORE_PATH: Optional[str] = Field(default="data/job_store.sqlite3", env="JOB_STORE_PATH")
+    JOB_STORE_SNAPSHOT_INTERVAL: float = Field(default=10.0, env="JOB_STORE_SNAPSHOT_INTERVAL")
+    EMBEDDED_WORKER: bool = Field(default=False, env="EMBEDDED_WORKER")
+    BATCH_SIZE: int = Field(default=1, env="BATCH_SIZE")
+    BATCH_WORKFLOW_SIZES: Optional[str] = Field(default=None, env="BATCH_WORKFLOW_SIZES")
+    BATCH_SERVER_SIZES: Optional[str] = Field(default=None, env="BATCH_SERVER_SIZES")
+    WARMUP_ENABLED: bool = Field(default=True, env="WARMUP_ENABLED")
+    WARMUP_IDLE_SECONDS: int = Field(default=900, env="WARMUP_IDLE_SECONDS")
+    WARMUP_RETRY_SECONDS: int = Field(default=60, env="WARMUP_RETRY_SECONDS")
+    WARMUP_CHECK_INTERVAL: float = Field(default=10.0, env="WARMUP_CHECK_INTERVAL")
+    WARMUP_IMAGE_PATH: Optional[str] = Field(default=None, env="WARMUP_IMAGE_PATH")
+    OUTPUT_ENCODING: str = Field(default="passthrough", env="OUTPUT_ENCODING")
+    OUTPUT_QUALITY: int = Field(default=85, env="OUTPUT_QUALITY")
+    IMAGE_WORKERS: int = Field(default=2, env="IMAGE_WORKERS")
+    OUTPUT_RENDITIONS: str = Field(default="web=1080:webp,thumb=320:webp,share=1200x630:jpeg",
+                                   env="OUTPUT_RENDITIONS")
+    POSTPROCESS_ASSETS_DIR: Optional[str] = Field(default=None, env="POSTPROCESS_ASSETS_DIR")
+    POSTPROCESS_WATERMARK_PATH: Optional[str] = Field(default=None, env="POSTPROCESS_WATERMARK_PATH")
 
 
     class Config:
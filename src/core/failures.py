@@ -0,0 +1,127 @@
+import json
+import random
+import time
+import urllib.error
+
+from datetime import datetime
+
+import structlog
+from botocore.exceptions import BotoCoreError, ClientError
+
+from core import archive, jobstore
+
+
+log = structlog.get_logger()
+
+# de quem é a culpa de uma falha: decide se vale tentar de novo e onde
+SERVER = "server"    # servidor ComfyUI (queda, OOM, interrupção, prazo vencido)
+INPUT = "input"      # imagem de entrada (arquivo inválido, sem rosto, removida do S3)
+STORAGE = "storage"  # S3
+
+DEAD_LETTER_KEY = "jobs:dead_letter"
+RETRIES_KEY = "jobs:retries"
+
+# códigos de erro do S3 que não mudam numa nova tentativa
+S3_INPUT_CODES = ("NoSuchKey", "404", "NotFound")
+S3_PERMANENT_CODES = ("AccessDenied", "NoSuchBucket", "InvalidAccessKeyId", "SignatureDoesNotMatch")
+
+# trechos de mensagens de execution_error da ComfyUI causados pela foto enviada
+INPUT_ERROR_PATTERNS = ("cannot identify image", "image file is truncated", "no face", "face not detected",
+                        "invalid image")
+INPUT_NODE_TYPES = ("LoadImage", "LoadImageMask")
+
+
+class JobError(RuntimeError):
+    fault = SERVER
+    retryable = True
+
+
+class ServerError(JobError):
+    """
+    Falha do servidor ComfyUI: outro servidor (ou o mesmo, mais tarde) deve conseguir.
+    """
+
+
+class InputError(JobError):
+    """
+    Falha causada pela imagem de entrada: repetir só gastaria GPU.
+    """
+    fault = INPUT
+    retryable = False
+
+
+def execution_error(data: dict) -> JobError:
+    """
+    Converte a mensagem execution_error da ComfyUI na exceção da classe certa.
+    """
+    message = data.get("exception_message") or ""
+    text = f"Erro na execução ({data.get('node_type')}): {message.strip()}"
+    if data.get("node_type") in INPUT_NODE_TYPES or any(p in message.lower() for p in INPUT_ERROR_PATTERNS):
+        return InputError(text)
+    return ServerError(text)
+
+
+def classify(error: Exception) -> tuple:
+    """
+    Retorna (culpa, dá para tentar de novo) para uma exceção do processamento.
+    Na dúvida, trata como falha do servidor e tenta de novo, como antes.
+    """
+    if isinstance(error, JobError):
+        return error.fault, error.retryable
+    if isinstance(error, urllib.error.HTTPError):
+        # /prompt recusado (4xx: nó ou modelo que falta naquele servidor) ou
+        # com erro: outro servidor pode aceitar. A recusa da foto em si vem do
+        # /upload/image, que já levanta InputError.
+        return SERVER, True
+    if isinstance(error, ClientError):
+        code = str(error.response.get("Error", {}).get("Code", ""))
+        if code in S3_INPUT_CODES:
+            return INPUT, False
+        return STORAGE, code not in S3_PERMANENT_CODES
+    if isinstance(error, BotoCoreError):
+        return STORAGE, True
+    # conexão recusada/caída, WebSocket fechado, imagem de saída corrompida...
+    return SERVER, True
+
+
+def retry_delay(attempt: int, base: float, cap: float, rng=random) -> float:
+    """
+    Backoff exponencial com jitter: metade fixa e metade sorteada de
+    min(cap, base * 2^(attempt-1)), para os jobs de um servidor que caiu não
+    voltarem todos juntos.
+    """
+    delay = min(cap, base * 2 ** max(attempt - 1, 0))
+    return delay / 2 + rng.uniform(0, delay / 2)
+
+
+async def dead_letter(redis, request_id: str, **info):
+    entry = {"request_id": request_id, "at": datetime.utcnow().isoformat(), **info}
+    await redis.lpush(DEAD_LETTER_KEY, json.dumps(entry))
+
+
+async def dead_letters(redis, limit: int = 100) -> list:
+    """
+    Entradas da dead-letter queue, da mais recente para a mais antiga.
+    """
+    raw = await redis.lrange(DEAD_LETTER_KEY, 0, limit - 1 if limit else -1)
+    return [json.loads(item) for item in raw]
+
+
+async def replay(redis, request_id: str) -> bool:
+    """
+    Tira o job da dead-letter queue e o devolve à fila com as tentativas
+    zeradas. Retorna False se ele não estiver na lista ou o hash não existir.
+    """
+    found = [raw for raw in await redis.lrange(DEAD_LETTER_KEY, 0, -1)
+             if json.loads(raw).get("request_id") == request_id]
+    if not found or not await jobstore.exists(redis, request_id):
+        return False
+    for raw in found:
+        await redis.lrem(DEAD_LETTER_KEY, 1, raw)
+    await archive.reopen(redis, archive.job_archive, request_id)
+    await jobstore.transition(redis, request_id, "queued",
+                              {"attempt": 1, "enqueued_at": datetime.utcnow().isoformat(),
+                               "replayed_at": round(time.time(), 3)},
+                              clear=("error", "fault", "avoid_servers", "retry_at", "prompt_id"))
+    log.info("dead_letter.replayed", request_id=request_id)
+    return True
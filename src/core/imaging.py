@@ -0,0 +1,266 @@
+import asyncio
+import functools
+import io
+
+from concurrent.futures import ProcessPoolExecutor
+
+import structlog
+from PIL import Image, ImageFilter, ImageOps, features
+
+try:
+    # Pillow anterior à 11.3 só grava AVIF com o plugin externo
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+
+log = structlog.get_logger()
+
+PASSTHROUGH = "passthrough"
+
+# formato -> (formato do Pillow, extensão do arquivo, Content-Type)
+FORMATS = {
+    "png": ("PNG", "png", "image/png"),
+    "webp": ("WEBP", "webp", "image/webp"),
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+    "avif": ("AVIF", "avif", "image/avif"),
+}
+
+
+def format_supported(fmt: str) -> bool:
+    """
+    Diz se o Pillow instalado consegue gravar `fmt`.
+    """
+    if fmt in ("png", "jpeg"):
+        return True
+    try:
+        if features.check(fmt):
+            return True
+    except ValueError:
+        # versões antigas do Pillow não conhecem a feature "avif"
+        pass
+    Image.init()
+    return FORMATS[fmt][0] in Image.SAVE
+
+
+def parse_renditions(text: str) -> dict:
+    """
+    Converte "web=1080:webp,share=1200x630:jpeg" em
+    {"web": (1080, "webp"), "share": ((1200, 630), "jpeg")}. Um número é o
+    maior lado da rendição; LxA é um cartão de tamanho fixo.
+    """
+    renditions = {}
+    for item in (text or "").split(","):
+        if not item.strip():
+            continue
+        name, _, spec = item.partition("=")
+        size, _, fmt = spec.partition(":")
+        fmt = (fmt.strip() or "webp").lower()
+        if fmt not in FORMATS:
+            raise ValueError(f"formato inválido na rendição {name.strip()}: {fmt}")
+        if "x" in size:
+            width, height = size.lower().split("x")
+            renditions[name.strip()] = ((int(width), int(height)), fmt)
+        else:
+            renditions[name.strip()] = (int(size), fmt)
+    return renditions
+
+
+def _save(img: Image.Image, fmt: str, quality: int) -> bytes:
+    if fmt == "jpeg" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    if fmt == PASSTHROUGH:
+        # passthrough com pós-processamento: PNG sem a busca lenta do optimize
+        img.save(buf, format="PNG")
+    elif fmt == "png":
+        img.save(buf, format="PNG", optimize=True)
+    else:
+        img.save(buf, format=FORMATS[fmt][0], quality=quality)
+    return buf.getvalue()
+
+
+@functools.lru_cache(maxsize=16)
+def load_asset(path: str) -> Image.Image:
+    """
+    Moldura ou marca d'água decodificada em RGBA, uma vez por processo do pool.
+    """
+    with Image.open(path) as img:
+        return img.convert("RGBA")
+
+
+@functools.lru_cache(maxsize=32)
+def overlay_for(size: tuple, frame: str = None, watermark: str = None) -> Image.Image:
+    """
+    Camada RGBA do tamanho da saída com a moldura e a marca d'água já
+    escaladas e posicionadas, montada uma vez por tamanho de saída.
+    """
+    overlay = Image.new("RGBA", size, (0, 0, 0, 0))
+    if frame:
+        asset = load_asset(frame)
+        if asset.size != size:
+            asset = asset.resize(size, Image.LANCZOS)
+        overlay.alpha_composite(asset)
+    if watermark:
+        # mesmo posicionamento de ComfyUiAPI.add_watermark_image: centro inferior, reduzida se for mais larga
+        asset = load_asset(watermark)
+        if asset.width > size[0]:
+            ratio = (size[0] / asset.width) * 0.5
+            asset = asset.resize((int(asset.width * ratio), int(asset.height * ratio)), Image.LANCZOS)
+        overlay.alpha_composite(asset, ((size[0] - asset.width) // 2, max(size[1] - asset.height - 10, 0)))
+    return overlay
+
+
+def postprocess(img: Image.Image, frame: str = None, watermark: str = None) -> Image.Image:
+    """
+    Aplica moldura e marca d'água em memória. Como o ImageCompositeMasked
+    com resize_source, a imagem é esticada (bilinear) para o tamanho da
+    moldura antes da composição.
+    """
+    if frame:
+        size = load_asset(frame).size
+        if img.size != size:
+            img = img.resize(size, Image.BILINEAR)
+    overlay = overlay_for(img.size, frame, watermark)
+    return Image.alpha_composite(img.convert("RGBA"), overlay).convert("RGB")
+
+
+def share_card(img: Image.Image, size: tuple) -> Image.Image:
+    """
+    Cartão de compartilhamento: a imagem inteira centralizada sobre um fundo
+    feito dela mesma, recortada para preencher o cartão e desfocada.
+    """
+    img = img.convert("RGB")
+    background = ImageOps.fit(img, size, Image.LANCZOS).filter(ImageFilter.GaussianBlur(24))
+    foreground = ImageOps.contain(img, size, Image.LANCZOS)
+    background.paste(foreground, ((size[0] - foreground.width) // 2, (size[1] - foreground.height) // 2))
+    return background
+
+
+def _open(data: bytes, frame: str = None, watermark: str = None) -> Image.Image:
+    img = Image.open(io.BytesIO(data))
+    if frame or watermark:
+        img = postprocess(img, frame, watermark)
+    return img
+
+
+def encode_image(data: bytes, fmt: str, quality: int, frame: str = None, watermark: str = None) -> bytes:
+    """
+    Decodifica `data`, aplica moldura/marca d'água se houver e regrava em
+    `fmt`. Roda nos processos do pool, por isso é uma função de módulo que
+    recebe e devolve bytes.
+    """
+    return _save(_open(data, frame, watermark), fmt, quality)
+
+
+def make_rendition(img: Image.Image, size, fmt: str, quality: int) -> bytes:
+    """
+    Gera uma rendição de `img` (já pós-processada): reduzida até `size` no
+    maior lado ou, se `size` for (largura, altura), um cartão de
+    compartilhamento.
+    """
+    if isinstance(size, tuple):
+        img = share_card(img, size)
+    else:
+        img = img.copy()
+        img.thumbnail((size, size), Image.LANCZOS)
+    return _save(img, fmt, quality)
+
+
+def render_all(data: bytes, fmt: str, quality: int, renditions: list, frame: str = None,
+               watermark: str = None) -> tuple:
+    """
+    Decodifica e pós-processa `data` uma única vez e deriva dessa imagem a
+    versão completa em `fmt` (None mantém os bytes originais) e cada
+    rendição de `renditions` [(tamanho, formato), ...].
+    """
+    img = _open(data, frame, watermark)
+    img.load()
+    full = data if fmt is None else _save(img, fmt, quality)
+    return full, [make_rendition(img, size, rendition_fmt, quality) for size, rendition_fmt in renditions]
+
+
+class ImageEncoder:
+    """
+    Etapa que prepara a imagem gerada para o upload: pós-processamento
+    (moldura e marca d'água), a versão completa ("full") e as rendições
+    menores configuradas.
+
+    Em "passthrough" sem pós-processamento a versão completa segue com os
+    bytes da ComfyUI (PNG).
+    Nos demais formatos, e para cada rendição, o trabalho roda num
+    ProcessPoolExecutor de `workers` processos, fora do event loop e sem
+    disputar o GIL com o worker; com `workers=0` roda numa thread.
+    """
+
+    def __init__(self, fmt: str = PASSTHROUGH, quality: int = 85, workers: int = 2, renditions: dict = None,
+                 watermark: str = None):
+        fmt = (fmt or PASSTHROUGH).lower()
+        if fmt == "jpg":
+            fmt = "jpeg"
+        if fmt != PASSTHROUGH and fmt not in FORMATS:
+            raise ValueError(f"OUTPUT_ENCODING inválido: {fmt}")
+        if fmt != PASSTHROUGH and not format_supported(fmt):
+            log.warning("imaging.format_unsupported", format=fmt, fallback=PASSTHROUGH)
+            fmt = PASSTHROUGH
+        self.format = fmt
+        self.quality = quality
+        self.workers = workers
+        self.renditions = {}
+        for name, (size, rendition_fmt) in (renditions or {}).items():
+            if not format_supported(rendition_fmt):
+                log.warning("imaging.format_unsupported", format=rendition_fmt, rendition=name, fallback="jpeg")
+                rendition_fmt = "jpeg"
+            self.renditions[name] = (size, rendition_fmt)
+        self.watermark = watermark
+        self._pool = None
+
+    @property
+    def passthrough(self) -> bool:
+        return self.format == PASSTHROUGH
+
+    @property
+    def extension(self) -> str:
+        return FORMATS["png" if self.passthrough else self.format][1]
+
+    @property
+    def content_type(self) -> str:
+        return FORMATS["png" if self.passthrough else self.format][2]
+
+    def _executor(self):
+        if self._pool is None and self.workers > 0:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    async def _run(self, func, *args):
+        executor = self._executor()
+        if executor is None:
+            return await asyncio.to_thread(func, *args)
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+    async def encode(self, data: bytes, frame: str = None) -> bytes:
+        if self.passthrough and not (frame or self.watermark):
+            return data
+        return await self._run(encode_image, data, self.format, self.quality, frame, self.watermark)
+
+    async def render(self, data: bytes, frame: str = None) -> dict:
+        """
+        Retorna {nome: (bytes, extensão, content-type)} com "full" e cada
+        rendição. Tudo sai de uma única tarefa no pool, que decodifica a
+        imagem e aplica a moldura `frame` e a marca d'água uma vez só.
+        """
+        if not self.renditions:
+            return {"full": (await self.encode(data, frame), self.extension, self.content_type)}
+        fmt = None if self.passthrough and not (frame or self.watermark) else self.format
+        full, bodies = await self._run(render_all, data, fmt, self.quality, list(self.renditions.values()),
+                                       frame, self.watermark)
+        output = {"full": (full, self.extension, self.content_type)}
+        for name, body in zip(self.renditions, bodies):
+            rendition_fmt = self.renditions[name][1]
+            output[name] = (body, FORMATS[rendition_fmt][1], FORMATS[rendition_fmt][2])
+        return output
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
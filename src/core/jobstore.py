@@ -0,0 +1,110 @@
+import json
+
+from core import archive
+
+
+JOB_PREFIX = "job:"
+# uploads aceitos pela API, ainda não vistos pelo worker
+SUBMISSIONS_QUEUE = "submissions_queue"
+# pedidos de cancelamento (/api/cancel), consumidos pelo worker
+CANCEL_QUEUE = "cancel_queue"
+TERMINAL_STATUSES = archive.TERMINAL_STATUSES
+
+# Ciclo de vida do job sobre o job store. `redis` é o cliente de
+# core.redis: um Redis de verdade ou o backend em processo de
+# core.memory_store, que implementam os mesmos comandos.
+
+
+def job_key(request_id: str) -> str:
+    return f"{JOB_PREFIX}{request_id}"
+
+
+async def enqueue(redis, request_id: str, input_key: str, trace: dict = None):
+    """
+    Entrega ao worker um upload cujo hash já foi criado.
+    """
+    payload = {"id": request_id, "input": input_key}
+    if trace:
+        payload["trace"] = trace
+    await redis.lpush(SUBMISSIONS_QUEUE, json.dumps(payload))
+
+
+async def claim(redis):
+    """
+    Retira da fila o upload mais antigo ({"id", "input", "trace"}), ou None.
+    """
+    raw = await redis.rpop(SUBMISSIONS_QUEUE)
+    return json.loads(raw) if raw is not None else None
+
+
+async def update(redis, request_id: str, fields: dict, clear: tuple = ()):
+    """
+    Grava campos do job sem mexer no status (prompt_id, servidor, SMS...):
+    um cancelamento concorrente não é desfeito. `clear` apaga campos que
+    não valem mais.
+    """
+    if not clear:
+        await redis.hset(job_key(request_id), mapping=fields)
+        return
+    pipe = redis.pipeline()
+    pipe.hdel(job_key(request_id), *clear)
+    pipe.hset(job_key(request_id), mapping=fields)
+    await pipe.execute()
+
+
+async def transition(redis, request_id: str, status: str, fields: dict = None, ts: float = None,
+                     clear: tuple = ()):
+    """
+    Grava o novo status do job com os campos que mudam junto. Status finais
+    marcam o job para o arquivamento (core.archive), com `ts` como instante
+    de fim.
+    """
+    await update(redis, request_id, {"status": status, **(fields or {})}, clear)
+    if status in TERMINAL_STATUSES:
+        await archive.mark_finished(redis, request_id, ts)
+
+
+async def field(redis, request_id: str, name: str):
+    """
+    Um campo do job vivo (sem consultar o arquivo).
+    """
+    return await redis.hget(job_key(request_id), name)
+
+
+async def exists(redis, request_id: str) -> bool:
+    return bool(await redis.exists(job_key(request_id)))
+
+
+async def request_cancel(redis, request_id: str, ts: str):
+    """
+    Registra o pedido de cancelamento e o entrega ao worker.
+    """
+    pipe = redis.pipeline()
+    pipe.hset(job_key(request_id), "cancel_requested_at", ts)
+    pipe.lpush(CANCEL_QUEUE, request_id)
+    await pipe.execute()
+
+
+async def claim_cancel(redis):
+    """
+    Próximo request_id com cancelamento pedido, ou None.
+    """
+    return await redis.rpop(CANCEL_QUEUE)
+
+
+async def get(redis, request_id: str) -> dict:
+    """
+    Hash do job, buscado também no arquivo se já saiu do store.
+    """
+    return await archive.load_job(redis, archive.job_archive, request_id)
+
+
+async def query(redis, statuses=None):
+    """
+    Percorre os jobs vivos do store, filtrando pelos `statuses` se dados.
+    Gera pares (request_id, hash).
+    """
+    async for key in redis.scan_iter(f"{JOB_PREFIX}*"):
+        job = await redis.hgetall(key)
+        if job and (statuses is None or job.get("status") in statuses):
+            yield key[len(JOB_PREFIX):], job
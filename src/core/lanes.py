@@ -0,0 +1,121 @@
+import hashlib
+import hmac
+import re
+import unicodedata
+
+from core.config import settings
+from core.workflow import parse_weights
+
+
+DEFAULT_LANE = "default"
+LANE_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+def priority_lanes() -> list:
+    """
+    Faixas de LANE_PRIORITY, da mais para a menos prioritária.
+    """
+    return [lane.strip() for lane in (settings.LANE_PRIORITY or "").split(",") if lane.strip()]
+
+
+def authorized(token: str = None) -> bool:
+    """
+    Se o upload traz o LANE_PRIORITY_TOKEN. Sem token configurado, nenhum
+    upload pede faixa de prioridade.
+    """
+    expected = settings.LANE_PRIORITY_TOKEN
+    return bool(expected) and hmac.compare_digest((token or "").encode(), expected.encode())
+
+
+def kiosk_lane(kiosk: str) -> str:
+    """
+    Faixa de um totem: o id sem acentos e com os caracteres fora do padrão
+    trocados por "-" ("Totem 1" -> "Totem-1", "Praça" -> "Praca"). Se não
+    sobrar nada, um hash curto do id.
+    """
+    plain = unicodedata.normalize("NFKD", kiosk).encode("ascii", "ignore").decode()
+    lane = re.sub(r"[^A-Za-z0-9_.-]+", "-", plain).strip("-.")[:64]
+    return lane or f"kiosk-{hashlib.sha1(kiosk.encode()).hexdigest()[:12]}"
+
+
+def configured_lanes() -> set:
+    """
+    Faixas que um upload pode pedir pelo nome: as de LANE_WEIGHTS e
+    LANE_PRIORITY, além de "default".
+    """
+    return set(parse_weights(settings.LANE_WEIGHTS)) | set(priority_lanes()) | {DEFAULT_LANE}
+
+
+def resolve(lane: str = None, kiosk: str = None, authorized: bool = False) -> str:
+    """
+    Faixa de um upload: a informada no formulário, se estiver configurada,
+    senão o totem (cada totem é um tenant com a sua própria fila), senão
+    "default". Levanta ValueError para um nome inválido no formulário e
+    PermissionError para uma faixa de prioridade pedida sem `authorized`;
+    o id do totem nunca é recusado.
+    """
+    priority = priority_lanes()
+    lane = (lane or "").strip()
+    if lane:
+        if not LANE_PATTERN.match(lane):
+            raise ValueError(f"Faixa inválida: {lane[:64]}")
+        if lane in priority and not authorized:
+            raise PermissionError(f"Faixa {lane} exige o token de prioridade")
+        # nome livre daria a cada upload uma fatia própria (e uma série nova nas métricas)
+        if lane in configured_lanes():
+            return lane
+    kiosk = (kiosk or "").strip()
+    if not kiosk:
+        return DEFAULT_LANE
+    lane = kiosk_lane(kiosk)
+    # um totem com o nome de uma faixa de prioridade não ganha a prioridade
+    return DEFAULT_LANE if lane in priority and not authorized else lane
+
+
+class LaneScheduler:
+    """
+    Escolhe de qual faixa sai o próximo job. Faixas de prioridade estrita
+    (LANE_PRIORITY) são atendidas primeiro, na ordem configurada; as demais
+    dividem os servidores por peso (LANE_WEIGHTS, padrão 1) com stride
+    scheduling: cada job despachado avança o "passe" da faixa em 1/peso e
+    sai primeiro a faixa de menor passe. Uma faixa que fica vazia não
+    acumula crédito: ao voltar, entra no passe corrente.
+    """
+
+    def __init__(self, weights: dict = None, priority: list = None):
+        self.weights = {lane: float(w) for lane, w in (weights or {}).items() if float(w) > 0}
+        self.priority = list(priority or [])
+        self.passes = {}
+        self.virtual_time = 0.0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(parse_weights(settings.LANE_WEIGHTS), priority_lanes())
+
+    def weight(self, lane: str) -> float:
+        return self.weights.get(lane, 1.0)
+
+    def _pass(self, lane: str) -> float:
+        return max(self.passes.get(lane, 0.0), self.virtual_time)
+
+    def pick(self, heads: dict):
+        """
+        `heads` mapeia faixa -> chave de ordenação do job mais antigo dela
+        (desempate entre faixas com o mesmo passe). Retorna a faixa escolhida.
+        """
+        if not heads:
+            return None
+        for lane in self.priority:
+            if lane in heads:
+                return lane
+        return min(heads, key=lambda lane: (self._pass(lane), heads[lane]))
+
+    def charge(self, lane: str):
+        """
+        Registra um job despachado da faixa.
+        """
+        if lane in self.priority:
+            return
+        current = self._pass(lane)
+        self.virtual_time = current
+        self.passes[lane] = current + 1.0 / self.weight(lane)
@@ -0,0 +1,351 @@
+import fnmatch
+import inspect
+import json
+import os
+import sqlite3
+import time
+from collections import deque
+
+
+SNAPSHOT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS store (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL
+) WITHOUT ROWID;
+"""
+
+
+class MemoryRedis:
+    """
+    Backend em processo do job store: o subconjunto assíncrono do
+    `redis.asyncio.Redis` (com decode_responses=True) usado pela API e pelo
+    worker, com TTL e um snapshot opcional em SQLite. Só vale quando API e
+    worker rodam no mesmo processo (modo totem, testes e benchmarks).
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+
+    def _count(self, name):
+        """
+        Gancho chamado a cada comando (o load test conta as idas ao Redis).
+        """
+
+    def _live(self, key) -> bool:
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def _read(self, key, default=None):
+        return self.data[key] if self._live(key) else default
+
+    # --- strings ---------------------------------------------------------
+    async def get(self, key):
+        self._count("get")
+        value = self._read(key)
+        return None if value is None else str(value)
+
+    async def set(self, key, value):
+        self._count("set")
+        self.data[key] = str(value)
+        self.expires.pop(key, None)
+        return True
+
+    async def exists(self, *keys):
+        self._count("exists")
+        return sum(1 for k in keys if self._live(k))
+
+    async def delete(self, *keys):
+        self._count("delete")
+        removed = 0
+        for key in keys:
+            removed += self._live(key)
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return removed
+
+    async def expire(self, key, ttl):
+        self._count("expire")
+        if not self._live(key):
+            return False
+        self.expires[key] = time.time() + ttl
+        return True
+
+    async def persist(self, key):
+        self._count("persist")
+        return self._live(key) and self.expires.pop(key, None) is not None
+
+    # --- hashes ----------------------------------------------------------
+    def _hash(self, key):
+        if not self._live(key):
+            self.data[key] = {}
+        return self.data[key]
+
+    async def hset(self, key, field=None, value=None, mapping=None):
+        self._count("hset")
+        h = self._hash(key)
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        added = sum(1 for f in items if f not in h)
+        h.update({str(f): str(v) for f, v in items.items()})
+        return added
+
+    async def hget(self, key, field):
+        self._count("hget")
+        return self._read(key, {}).get(field)
+
+    async def hgetall(self, key):
+        self._count("hgetall")
+        return dict(self._read(key, {}))
+
+    async def hdel(self, key, *fields):
+        self._count("hdel")
+        h = self._read(key, {})
+        return sum(1 for f in fields if h.pop(f, None) is not None)
+
+    def _hincr(self, key, field, amount, cast):
+        h = self._hash(key)
+        value = cast(h.get(str(field), 0)) + amount
+        h[str(field)] = str(value)
+        return value
+
+    async def hincrby(self, key, field, amount=1):
+        self._count("hincrby")
+        return self._hincr(key, field, amount, int)
+
+    async def hincrbyfloat(self, key, field, amount=1.0):
+        self._count("hincrbyfloat")
+        return self._hincr(key, field, amount, float)
+
+    # --- listas ----------------------------------------------------------
+    def _list(self, key):
+        if not self._live(key):
+            self.data[key] = deque()
+        return self.data[key]
+
+    async def lpush(self, key, *values):
+        self._count("lpush")
+        lst = self._list(key)
+        for v in values:
+            lst.appendleft(str(v))
+        return len(lst)
+
+    async def rpush(self, key, *values):
+        self._count("rpush")
+        lst = self._list(key)
+        lst.extend(str(v) for v in values)
+        return len(lst)
+
+    async def rpop(self, key):
+        self._count("rpop")
+        lst = self._read(key)
+        return lst.pop() if lst else None
+
+    async def llen(self, key):
+        self._count("llen")
+        return len(self._read(key, ()))
+
+    async def lrange(self, key, start, end):
+        self._count("lrange")
+        items = list(self._read(key, ()))
+        return items[start:] if end == -1 else items[start:end + 1]
+
+    async def lrem(self, key, count, value):
+        self._count("lrem")
+        lst = self._read(key)
+        if not lst:
+            return 0
+        items = list(lst) if count >= 0 else list(reversed(lst))
+        kept, removed = [], 0
+        for item in items:
+            if item == str(value) and (count == 0 or removed < abs(count)):
+                removed += 1
+            else:
+                kept.append(item)
+        self.data[key] = deque(kept if count >= 0 else reversed(kept))
+        return removed
+
+    # --- sets ------------------------------------------------------------
+    async def sadd(self, key, *values):
+        self._count("sadd")
+        if not self._live(key):
+            self.data[key] = set()
+        s = self.data[key]
+        before = len(s)
+        s.update(str(v) for v in values)
+        return len(s) - before
+
+    async def smembers(self, key):
+        self._count("smembers")
+        return set(self._read(key, set()))
+
+    # --- sorted sets -----------------------------------------------------
+    def _zsorted(self, key):
+        return sorted(self._read(key, {}).items(), key=lambda item: (item[1], item[0]))
+
+    async def zadd(self, key, mapping):
+        self._count("zadd")
+        z = self._hash(key)
+        added = sum(1 for m in mapping if str(m) not in z)
+        z.update({str(m): float(score) for m, score in mapping.items()})
+        return added
+
+    async def zrem(self, key, *members):
+        self._count("zrem")
+        z = self._read(key, {})
+        return sum(1 for m in members if z.pop(str(m), None) is not None)
+
+    async def zscore(self, key, member):
+        self._count("zscore")
+        return self._read(key, {}).get(str(member))
+
+    async def zcard(self, key):
+        self._count("zcard")
+        return len(self._read(key, {}))
+
+    async def zrange(self, key, start, end, withscores=False):
+        self._count("zrange")
+        items = self._zsorted(key)
+        items = items[start:] if end == -1 else items[start:end + 1]
+        return items if withscores else [m for m, _ in items]
+
+    async def zrangebyscore(self, key, min, max, withscores=False):
+        self._count("zrangebyscore")
+        low, high = float(min), float(max)
+        items = [(m, score) for m, score in self._zsorted(key) if low <= score <= high]
+        return items if withscores else [m for m, _ in items]
+
+    # --- iteração / pipeline ---------------------------------------------
+    async def scan_iter(self, match="*", count=None):
+        self._count("scan")
+        for key in list(self.data.keys()):
+            if fnmatch.fnmatchcase(key, match) and self._live(key):
+                yield key
+
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+    async def transaction(self, func, *watches, value_from_callable=False, **kwargs):
+        """
+        Como o `Redis.transaction`: `func` lê pelo pipeline, chama `multi()` e
+        enfileira as escritas. Os comandos não cedem o event loop, então nada
+        se intercala entre a leitura e o `execute` e o WATCH é dispensável.
+        """
+        pipe = self.pipeline()
+        await pipe.watch(*watches)
+        value = func(pipe)
+        if inspect.isawaitable(value):
+            value = await value
+        results = await pipe.execute()
+        return value if value_from_callable else results
+
+    async def aclose(self):
+        pass
+
+    # --- snapshot --------------------------------------------------------
+    def save(self, path: str):
+        """
+        Grava o conteúdo num SQLite, substituindo o snapshot anterior.
+        """
+        self.write_snapshot(path, self.dump())
+
+    def dump(self) -> list:
+        """
+        Linhas do snapshot. Rápido o bastante para rodar no event loop; a
+        gravação (`write_snapshot`) pode ir para uma thread.
+        """
+        rows = []
+        for key in list(self.data):
+            if not self._live(key):
+                continue
+            value = self.data[key]
+            if isinstance(value, deque):
+                kind, value = "list", list(value)
+            elif isinstance(value, set):
+                kind, value = "set", sorted(value)
+            elif isinstance(value, dict):
+                # hash e sorted set só se distinguem pelo tipo dos valores
+                kind = "zset" if value and all(isinstance(v, float) for v in value.values()) else "hash"
+            else:
+                kind = "string"
+            rows.append((key, kind, json.dumps(value, ensure_ascii=False), self.expires.get(key)))
+        return rows
+
+    @staticmethod
+    def write_snapshot(path: str, rows: list):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(path)
+        try:
+            with conn:
+                conn.executescript(SNAPSHOT_SCHEMA)
+                conn.execute("DELETE FROM store")
+                conn.executemany("INSERT INTO store VALUES (?, ?, ?, ?)", rows)
+        finally:
+            conn.close()
+
+    def load(self, path: str) -> int:
+        """
+        Carrega um snapshot gravado por `save`; retorna o número de chaves.
+        """
+        if not os.path.exists(path):
+            return 0
+        conn = sqlite3.connect(path)
+        try:
+            conn.executescript(SNAPSHOT_SCHEMA)
+            rows = conn.execute("SELECT key, kind, value, expires_at FROM store").fetchall()
+        finally:
+            conn.close()
+        now = time.time()
+        for key, kind, value, expires_at in rows:
+            if expires_at is not None and expires_at <= now:
+                continue
+            value = json.loads(value)
+            if kind == "list":
+                value = deque(value)
+            elif kind == "set":
+                value = set(value)
+            self.data[key] = value
+            if expires_at is not None:
+                self.expires[key] = expires_at
+        return len(rows)
+
+
+class MemoryPipeline:
+    """
+    Enfileira comandos e os executa de uma vez, como o pipeline do Redis.
+    """
+
+    def __init__(self, redis: MemoryRedis):
+        self.redis = redis
+        self.calls = []
+        # depois de `watch` e até `multi`, os comandos executam na hora
+        self.immediate = False
+
+    async def watch(self, *keys):
+        self.immediate = True
+
+    def multi(self):
+        self.immediate = False
+
+    def __getattr__(self, name):
+        method = getattr(self.redis, name)
+        if self.immediate:
+            return method
+
+        def queue(*args, **kwargs):
+            self.calls.append((method, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        results = [await method(*args, **kwargs) for method, args, kwargs in self.calls]
+        self.calls = []
+        return results
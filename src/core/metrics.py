@@ -0,0 +1,172 @@
+import asyncio
+import threading
+import time
+import structlog
+
+from collections import defaultdict
+
+
+log = structlog.get_logger()
+
+COUNTERS_KEY = "metrics:counters"
+GAUGES_KEY = "metrics:gauges"
+
+# buckets em segundos, cobrindo desde chamadas HTTP até a geração completa
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300, 600)
+
+STAGE_SECONDS = "mamulengos_stage_seconds"
+JOBS_TOTAL = "mamulengos_jobs_total"
+SMS_TOTAL = "mamulengos_sms_total"
+QUEUE_DEPTH = "mamulengos_queue_depth"
+JOBS_IN_FLIGHT = "mamulengos_jobs_in_flight"
+HEALTHY_SERVERS = "mamulengos_healthy_servers"
+WORKFLOW_SECONDS = "mamulengos_workflow_seconds"
+COLD_STARTS_TOTAL = "mamulengos_cold_starts_total"
+WARM_SERVERS = "mamulengos_warm_servers"
+JOB_FAILURES_TOTAL = "mamulengos_job_failures_total"
+ADMISSION_REJECTED_TOTAL = "mamulengos_admission_rejected_total"
+LANE_QUEUE_DEPTH = "mamulengos_lane_queue_depth"
+LANE_WAIT_SECONDS = "mamulengos_lane_wait_seconds"
+
+# nome -> (tipo, descrição). Tanto a API quanto o worker importam este módulo,
+# então as definições valem para as séries gravadas por qualquer processo.
+DEFINITIONS = {
+    STAGE_SECONDS: ("histogram", "Duração de cada etapa do processamento de um job, em segundos."),
+    JOBS_TOTAL: ("counter", "Jobs finalizados, por status."),
+    SMS_TOTAL: ("counter", "SMS de download enviados, por resultado."),
+    QUEUE_DEPTH: ("gauge", "Jobs aguardando um servidor ComfyUI livre."),
+    JOBS_IN_FLIGHT: ("gauge", "Jobs em processamento nos servidores ComfyUI."),
+    HEALTHY_SERVERS: ("gauge", "Servidores ComfyUI respondendo ao health-check."),
+    WORKFLOW_SECONDS: ("histogram", "Duração da geração dos jobs concluídos, por versão de workflow."),
+    COLD_STARTS_TOTAL: ("counter", "Jobs que rodaram num servidor frio (modelos fora da GPU), por servidor."),
+    WARM_SERVERS: ("gauge", "Servidores ComfyUI saudáveis com os modelos carregados."),
+    JOB_FAILURES_TOTAL: ("counter", "Falhas de processamento, por culpa (server, input, storage) e se foram repetidas."),
+    ADMISSION_REJECTED_TOTAL: ("counter", "Uploads recusados pelo controle de admissão, por motivo."),
+    LANE_QUEUE_DEPTH: ("gauge", "Jobs aguardando um servidor ComfyUI livre, por faixa."),
+    LANE_WAIT_SECONDS: ("histogram", "Espera na fila até o início do processamento, por faixa."),
+}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def series_key(name: str, labels: dict) -> str:
+    """
+    Monta o identificador da série no formato de exposição do Prometheus,
+    ex.: mamulengos_stage_seconds_bucket{stage="execution",le="30"}.
+    """
+    if not labels:
+        return name
+    inner = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return f"{name}{{{inner}}}"
+
+
+def _format_le(bound) -> str:
+    return "+Inf" if bound == float("inf") else f"{bound:g}"
+
+
+class MetricsRegistry:
+    """
+    Acumula contadores e histogramas em memória e envia os incrementos ao Redis
+    em um único pipeline. O Redis soma os incrementos de todos os processos
+    (API e worker), e o endpoint /metrics lê o agregado de lá.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, flush_interval: float = 5.0):
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self.flush_interval = flush_interval
+        self._pending = defaultdict(float)
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        with self._lock:
+            self._pending[series_key(name, labels)] += amount
+
+    def observe(self, name: str, value: float, **labels):
+        with self._lock:
+            for bound in self.buckets:
+                if value <= bound:
+                    key = series_key(f"{name}_bucket", {**labels, "le": _format_le(bound)})
+                    self._pending[key] += 1
+            self._pending[series_key(f"{name}_sum", labels)] += value
+            self._pending[series_key(f"{name}_count", labels)] += 1
+
+    def observe_stage(self, stage: str, seconds: float):
+        self.observe(STAGE_SECONDS, seconds, stage=stage)
+
+    async def flush(self, redis):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(float)
+        self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            pipe = redis.pipeline(transaction=False)
+            for key, amount in pending.items():
+                pipe.hincrbyfloat(COUNTERS_KEY, key, amount)
+            await pipe.execute()
+        except Exception as e:
+            # devolve os incrementos para a próxima tentativa
+            with self._lock:
+                for key, amount in pending.items():
+                    self._pending[key] += amount
+            log.warning("metrics.flush_failed", error=str(e))
+
+    def flush_due(self) -> bool:
+        return time.monotonic() - self._last_flush >= self.flush_interval
+
+    async def flush_periodically(self, redis):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush(redis)
+
+    @staticmethod
+    async def set_gauges(redis, values: dict):
+        """
+        Grava gauges no Redis. `values` mapeia nome (ou chave de série) -> valor.
+        """
+        await redis.hset(GAUGES_KEY, mapping={k: float(v) for k, v in values.items()})
+
+    @staticmethod
+    def _sort_key(key: str):
+        # ordena os buckets pelo valor numérico de `le`, não pela string
+        base, _, le = key.partition('le="')
+        if le:
+            bound = le.split('"', 1)[0]
+            return base, float("inf") if bound == "+Inf" else float(bound)
+        return key, 0.0
+
+    async def render(self, redis) -> str:
+        """
+        Retorna todas as séries no formato texto de exposição do Prometheus.
+        """
+        await self.flush(redis)
+        series = {}
+        series.update(await redis.hgetall(COUNTERS_KEY) or {})
+        series.update(await redis.hgetall(GAUGES_KEY) or {})
+
+        families = defaultdict(list)
+        for key, value in series.items():
+            metric = key.split("{", 1)[0]
+            for suffix in ("_bucket", "_sum", "_count"):
+                if metric.endswith(suffix) and metric[:-len(suffix)] in DEFINITIONS:
+                    metric = metric[:-len(suffix)]
+                    break
+            families[metric].append((key, value))
+
+        lines = []
+        for metric in sorted(families):
+            kind, help_text = DEFINITIONS.get(metric, ("untyped", ""))
+            if help_text:
+                lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for key, value in sorted(families[metric], key=lambda kv: self._sort_key(kv[0])):
+                number = float(value)
+                text = str(int(number)) if number.is_integer() else repr(number)
+                lines.append(f"{key} {text}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
@@ -1,9 +1,11 @@
+import os
+import asyncio
 import uuid
 import json
 import random
 import datetime
 import io
-import copy
+import urllib.error
 import urllib.request
 import urllib.parse
 import requests
@@ -14,10 +16,18 @@ import aiohttp
 from PIL import Image
 
 from core.config import settings
+from core.failures import InputError, ServerError, execution_error
+from core.tracing import tracer
+from core.workflow import WorkflowRegistry, parse_weights
 from utils.files import generate_timestamped_filename
 
 log = structlog.get_logger()
 
+# respostas do /upload/image que dizem respeito ao arquivo, não ao servidor
+UPLOAD_INPUT_ERRORS = (400, 413, 415, 422)
+# sem mensagem no WebSocket por esse tempo, confere o prompt pelo /history e /queue
+WS_POLL_SECONDS = 10.0
+
 
 class MultiComfyUiAPI:
     def __init__(
@@ -35,15 +45,30 @@ class MultiComfyUiAPI:
         self.node_id_image_load = node_id_image_load
         self.node_id_text_input = node_id_text_input
         self.session = requests.Session()
-
-        with open(workflow_path, "r", encoding="utf-8") as f:
-            self.workflow_template = json.load(f)
+        self.healthy_servers = set()
+        self.server_status = {}
+        # saída por WebSocket (SaveImageWebsocket) ou por /history + /view
+        self.output_mode = settings.COMFYUI_OUTPUT_MODE.lower()
+        self.http_only_servers = set()
+
+        # todas as versões do diretório, podadas e compiladas; por job só a imagem de entrada muda
+        self.workflows = WorkflowRegistry(
+            settings.WORKFLOW_DIR or os.path.dirname(workflow_path) or ".",
+            workflow_path,
+            {"image": (node_id_image_load, "image")},
+            pattern=settings.WORKFLOW_GLOB,
+            prune=settings.WORKFLOW_PRUNE,
+            outputs=[n.strip() for n in (settings.WORKFLOW_OUTPUT_NODES or "").split(",") if n.strip()],
+            weights=parse_weights(settings.WORKFLOW_WEIGHTS),
+            reload_interval=settings.WORKFLOW_RELOAD_INTERVAL,
+            assets_dir=settings.POSTPROCESS_ASSETS_DIR,
+        )
+        self.workflow_name = self.workflows.default
 
     @staticmethod
-    async def is_comfyui_busy(server_url: str) -> bool:
+    async def get_server_status(server_url: str) -> str:
         """
-        Returns True if the ComfyUI server is currently processing a job,
-        False if it's idle.
+        Returns 'idle', 'busy' or 'down' for the given ComfyUI server.
 
         :param server_url: Base URL of the ComfyUI server, e.g. 'http://127.0.0.1:8188'
         """
@@ -54,13 +79,26 @@ class MultiComfyUiAPI:
                 async with session.get(status_url) as response:
                     if response.status == 200:
                         data = await response.json()
-                        return data.get("queue_running", False)
+                        # a ComfyUI devolve listas; qualquer item rodando ou pendente ocupa a GPU
+                        busy = data.get("queue_running", False) or data.get("queue_pending", False)
+                        return "busy" if busy else "idle"
                     else:
                         log.warning(f"Error: HTTP {response.status} from ComfyUI")
         except Exception as e:
             log.warning(f"Failed to connect to ComfyUI at {server_url}: {e}")
 
-        return True  # Assume busy or unreachable
+        return "down"
+
+    @staticmethod
+    async def is_comfyui_busy(server_url: str) -> bool:
+        """
+        Returns True if the ComfyUI server is currently processing a job,
+        False if it's idle.
+
+        :param server_url: Base URL of the ComfyUI server, e.g. 'http://127.0.0.1:8188'
+        """
+        status = await MultiComfyUiAPI.get_server_status(server_url)
+        return status != "idle"  # Assume busy or unreachable
 
     @staticmethod
     def strip_http_scheme(url: str) -> str:
@@ -78,13 +116,18 @@ class MultiComfyUiAPI:
             return "wss://" + url[len("https://"):]
         return "ws://" + url
 
-    def queue_prompt(self, server_address, prompt: dict, client_id: str) -> dict:
+    def queue_prompt(self, server_address, prompt, client_id: str) -> dict:
         """
         Envia o prompt para a ComfyUI via endpoint HTTP /prompt
         Retorna o JSON com o prompt_id.
+        `prompt` pode ser o dict do workflow ou o corpo já pronto em bytes
+        (gerado por `CompiledWorkflow.render`, que já inclui o client_id).
         """
-        payload = {"prompt": prompt, "client_id": client_id}
-        data = json.dumps(payload).encode("utf-8")
+        if isinstance(prompt, bytes):
+            data = prompt
+        else:
+            payload = {"prompt": prompt, "client_id": client_id}
+            data = json.dumps(payload).encode("utf-8")
         url = f"{server_address}/prompt"
         req = urllib.request.Request(url, data=data)
         with urllib.request.urlopen(req) as response:
@@ -111,49 +154,174 @@ class MultiComfyUiAPI:
         with urllib.request.urlopen(url) as response:
             return json.loads(response.read())
 
+    def queued_prompts(self, server_address) -> tuple:
+        """
+        Retorna (prompt_ids executando, prompt_ids aguardando) do GET /queue.
+        """
+        with urllib.request.urlopen(f"{server_address}/queue") as response:
+            queue = json.loads(response.read())
+
+        def prompt_ids(items):
+            # cada item é [número, prompt_id, prompt, extra_data, outputs]
+            return {item[1] for item in items if len(item) > 1} if isinstance(items, list) else set()
+
+        return prompt_ids(queue.get("queue_running")), prompt_ids(queue.get("queue_pending"))
+
+    def prompt_state(self, server_address, prompt_id: str) -> tuple:
+        """
+        Situação de um prompt enviado antes: ("done", entrada do /history),
+        ("error", entrada), ("running", None), ("pending", None) ou
+        ("lost", None) se a ComfyUI não o conhece mais (ex.: reiniciou).
+        """
+        entry = self.get_history(server_address, prompt_id).get(prompt_id)
+        if entry:
+            status = entry.get("status")
+            status_str = status.get("status_str") if isinstance(status, dict) else status
+            if status_str == "error":
+                return "error", entry
+            if entry.get("outputs") or status_str in ("success", "complete"):
+                return "done", entry
+        running, pending = self.queued_prompts(server_address)
+        if prompt_id in running:
+            return "running", None
+        if prompt_id in pending:
+            return "pending", None
+        return "lost", None
+
+    def collect_outputs(self, server_address, entry: dict, workflow: str = None, batch_index: int = 0,
+                        batch_size: int = 1) -> io.BytesIO:
+        """
+        Baixa a imagem de um prompt já concluído a partir da entrada do
+        /history. Num lote, fica só com as saídas da cópia `batch_index`.
+        Saídas SaveImageWebsocket não vão para o histórico; nesse caso levanta
+        RuntimeError e o job precisa rodar de novo.
+        """
+        outputs = entry.get("outputs", {})
+        if batch_size > 1:
+            nodes = self.workflows.get(workflow).batch(batch_size).outputs
+            outputs = {node_id: out for node_id, out in outputs.items() if nodes.get(node_id) == batch_index}
+        return self.save_image_buffer(self._history_images(server_address, outputs))
+
+    def _history_images(self, server_address, outputs: dict) -> dict:
+        images = {}
+        for node_id, node_output in outputs.items():
+            if node_output.get("images"):
+                images[node_id] = [self.get_image(server_address, img["filename"], img["subfolder"], img["type"])
+                                   for img in node_output["images"]]
+        return images
+
+    def cancel_prompt(self, server_address, prompt_id: str) -> str:
+        """
+        Tira o prompt da ComfyUI: remove da fila (POST /queue com "delete") e,
+        se estiver executando, chama /interrupt. Retorna "interrupted",
+        "deleted" ou "not_found".
+        """
+        running, pending = self.queued_prompts(server_address)
+
+        def post(path, payload):
+            req = urllib.request.Request(f"{server_address}{path}", data=json.dumps(payload).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"})
+            with urllib.request.urlopen(req) as response:
+                response.read()
+
+        post("/queue", {"delete": [prompt_id]})
+        if prompt_id in running:
+            # o /interrupt para o que estiver rodando; só chama se for este prompt
+            post("/interrupt", {"prompt_id": prompt_id})
+            return "interrupted"
+        return "deleted" if prompt_id in pending else "not_found"
+
+    @staticmethod
+    def _error_body(error: urllib.error.HTTPError) -> str:
+        try:
+            return error.read().decode("utf-8", errors="replace")
+        except Exception:
+            return ""
+
+    def use_websocket_output(self, server_address) -> bool:
+        return self.output_mode == "websocket" and server_address not in self.http_only_servers
+
     def get_images(
-        self, ws: websocket.WebSocket, server_address, prompt: dict, client_id: str
+        self, ws: websocket.WebSocket, server_address, prompt, client_id: str, timing: dict = None,
+        websocket_nodes=None, fallback_prompt=None, on_queued=None,
     ) -> dict:
         """
         Mantém o WebSocket aberto até a execução do workflow terminar.
         Retorna um dicionário {node_id: [bytes das imagens]}. 
+        Se `timing` for informado, registra em "execution_done" o fim da execução,
+        antes da busca das imagens.
+
+        Com `websocket_nodes` (nós SaveImageWebsocket do prompt), as imagens
+        chegam como frames binários enquanto esses nós executam e o /history
+        não é consultado. Se o servidor recusar o prompt com um HTTP 400 que
+        aponta o SaveImageWebsocket (nó desconhecido) e houver
+        `fallback_prompt`, ele passa a usar a saída por HTTP e o prompt
+        alternativo é enviado no lugar; qualquer outro 400 é erro do prompt.
+
+        `on_queued(prompt_id)` é chamado logo após o enfileiramento. Se a
+        execução for interrompida (/interrupt) ou falhar, levanta ServerError, ou
+        InputError quando a falha vem da imagem enviada (ver core.failures).
         """
-        queue_response = self.queue_prompt(server_address, prompt, client_id)
+        try:
+            queue_response = self.queue_prompt(server_address, prompt, client_id)
+        except urllib.error.HTTPError as e:
+            if fallback_prompt is None or e.code != 400 or "SaveImageWebsocket" not in self._error_body(e):
+                raise
+            log.warning("comfyui.websocket_output_rejected", server=server_address, error=str(e))
+            self.http_only_servers.add(server_address)
+            websocket_nodes = None
+            queue_response = self.queue_prompt(server_address, fallback_prompt, client_id)
         prompt_id = queue_response.get("prompt_id")
 
         if not prompt_id:
             raise RuntimeError("Não foi possível obter prompt_id ao enfileirar prompt.")
+        if on_queued is not None:
+            on_queued(prompt_id)
 
         output_images: dict = {}
+        current_node = None
+        # um prompt removido da fila (cancelamento) nunca manda o "executing" final
+        ws.settimeout(WS_POLL_SECONDS)
         while True:
-            message_raw = ws.recv()
+            try:
+                message_raw = ws.recv()
+            except websocket.WebSocketTimeoutException:
+                state, _ = self.prompt_state(server_address, prompt_id)
+                if state in ("running", "pending"):
+                    continue
+                if state == "done":
+                    break
+                raise ServerError(f"Prompt {prompt_id} saiu da ComfyUI sem concluir ({state})")
             if isinstance(message_raw, str):
                 message = json.loads(message_raw)
-                if (
-                    message.get("type") == "executing"
-                    and message.get("data", {}).get("node") is None
-                    and message.get("data", {}).get("prompt_id") == prompt_id
-                ):
-                    break
-            else:
-                continue
+                data = message.get("data", {})
+                if message.get("type") == "execution_interrupted" and data.get("prompt_id") == prompt_id:
+                    raise ServerError(f"Execução interrompida no nó {data.get('node_id')}")
+                if message.get("type") == "execution_error" and data.get("prompt_id") == prompt_id:
+                    raise execution_error(data)
+                if message.get("type") == "executing" and data.get("prompt_id") == prompt_id:
+                    if data.get("node") is None:
+                        break
+                    current_node = data.get("node")
+            elif websocket_nodes and current_node in websocket_nodes and len(message_raw) > 8:
+                # frame binário: 4 bytes do tipo de evento (1 = imagem), 4 do formato, depois a imagem
+                if int.from_bytes(message_raw[:4], "big") == 1:
+                    output_images.setdefault(current_node, []).append(message_raw[8:])
+
+        if timing is not None:
+            timing["execution_done"] = datetime.datetime.now()
+
+        if output_images:
+            return output_images
 
         history_data = self.get_history(server_address, prompt_id).get(prompt_id, {})
-        for node_id, node_output in history_data.get("outputs", {}).items():
-            if node_output.get("images"):
-                output_images[node_id] = []
-                for img in node_output["images"]:
-                    img_bytes = self.get_image(
-                        server_address, img["filename"], img["subfolder"], img["type"]
-                    )
-                    output_images[node_id].append(img_bytes)
-
-        return output_images
+        return self._history_images(server_address, history_data.get("outputs", {}))
 
     def upload_file(self, file_obj, server_address, subfolder: str = "", overwrite: bool = False) -> str:
         """
         Upload de arquivo (imagem) para o ComfyUI via endpoint /upload/image
         Retorna o path no servidor ComfyUI (subfolder/filename) ou None em caso de erro.
+        Se o servidor recusar o arquivo em si (400/413/415/422), levanta InputError.
         """
         try:
             files = {"image": file_obj}
@@ -169,6 +337,8 @@ class MultiComfyUiAPI:
                 if response_data.get("subfolder"):
                     path = f"{response_data['subfolder']}/{path}"
                 return path
+            elif response.status_code in UPLOAD_INPUT_ERRORS:
+                raise InputError(f"Imagem recusada pela ComfyUI: HTTP {response.status_code} {response.reason}")
             else:
                 log.info(
                     "[Upload Error]",
@@ -176,6 +346,8 @@ class MultiComfyUiAPI:
                     reason=response.reason,
                 )
                 return None
+        except InputError:
+            raise
         except Exception as e:
             log.info("[Upload Exception]", error=str(e))
             return None
@@ -198,39 +370,167 @@ class MultiComfyUiAPI:
 
     def save_image_buffer(self, images: dict) -> io.BytesIO:
         """
-        Recebe imagens em bytes e retorna um BytesIO com a primeira imagem em PNG.
+        Recebe imagens em bytes e retorna um BytesIO com a primeira imagem,
+        sem decodificar: o PNG da ComfyUI segue como veio. A recodificação,
+        quando configurada, é feita pelo worker (core.imaging).
         """
         for node_id, img_list in images.items():
             for img_bytes in img_list:
-                img = Image.open(io.BytesIO(img_bytes))
-                buf = io.BytesIO()
-                img.save(buf, format="PNG", optimize=True)
-                buf.seek(0)
-                return buf
+                return io.BytesIO(img_bytes)
         raise RuntimeError("Nenhuma imagem encontrada para salvar.")
 
     async def get_available_server_addresses(self):
         result = []
-        for server_address in self.server_address_list:
-            if not server_address or len(server_address) == 0:
-                continue
-            log.debug(f"checking server '{server_address}'")
-            busy = await self.is_comfyui_busy(server_address)
-            if not busy:
+        healthy = set()
+        addresses = [s for s in self.server_address_list if s]
+        # consulta a frota inteira em paralelo: o número de servidores não tem limite
+        statuses = await asyncio.gather(*(self.get_server_status(s) for s in addresses))
+        self.server_status = dict(zip(addresses, statuses))
+        for server_address, status in self.server_status.items():
+            if status != "down":
+                healthy.add(server_address)
+            if status == "idle":
                 log.debug(f"server '{server_address}' is not busy")
                 result.append(server_address)
             else:
                 log.debug(f"server '{server_address}' is busy or not running")
+        self.healthy_servers = healthy
         return result
 
-    def generate_image_buffer(self, server_address, file_obj) -> str:
+    def warm_up(self, server_address, image_path: str = None, workflow: str = None) -> float:
+        """
+        Roda um prompt sintético para carregar os modelos na GPU do servidor.
+        Usa a foto em `image_path` (com rosto, para o grafo rodar até o fim) ou,
+        sem ela, uma imagem cinza gerada em memória. Retorna a duração em segundos.
+        """
+        if image_path and os.path.exists(image_path):
+            with open(image_path, "rb") as f:
+                file_obj = io.BytesIO(f.read())
+        else:
+            file_obj = io.BytesIO()
+            Image.new("RGB", (1024, 1024), (128, 128, 128)).save(file_obj, format="PNG")
+            file_obj.seek(0)
+
+        start = datetime.datetime.now()
+        self.generate_image_buffer(server_address, file_obj, workflow=workflow)
+        return (datetime.datetime.now() - start).total_seconds()
+
+    def _report_timing(self, server_address, start_time, timing: dict, stages: dict = None,
+                       timestamps: dict = None, trace_parents: list = ()):
+        """
+        Loga as durações de cada etapa e preenche `stages`, `timestamps` e os
+        spans de cada contexto em `trace_parents` (um por job do lote).
+        """
+        log.info("[Timing Info]")
+        log.info("Upload time:        %ss", (timing["upload"] - start_time).total_seconds())
+        log.info("Execution wait:     %ss", (timing["start_execution"] - timing["upload"]).total_seconds())
+        log.info("Processing time:    %ss", (timing["execution_done"] - timing["start_execution"]).total_seconds())
+        log.info("Fetch time:         %ss", (timing["fetch_done"] - timing["execution_done"]).total_seconds())
+        log.info("Saving time:        %ss", (timing["save"] - timing["fetch_done"]).total_seconds())
+        log.info("Total:              %ss", (timing["save"] - start_time).total_seconds())
+
+        if stages is not None:
+            stages["comfyui_upload"] = (timing["upload"] - start_time).total_seconds()
+            stages["execution"] = (timing["execution_done"] - timing["start_execution"]).total_seconds()
+            stages["image_fetch"] = (timing["fetch_done"] - timing["execution_done"]).total_seconds()
+            stages["png_encode"] = (timing["save"] - timing["fetch_done"]).total_seconds()
+
+        if timestamps is not None:
+            timestamps["comfyui_uploaded"] = timing["upload"].timestamp()
+            timestamps["execution_start"] = timing["start_execution"].timestamp()
+            timestamps["execution_done"] = timing["execution_done"].timestamp()
+            timestamps["fetch_done"] = timing["fetch_done"].timestamp()
+            timestamps["encoded"] = timing["save"].timestamp()
+
+        spans = [
+            ("comfyui.upload", start_time, timing["upload"]),
+            ("comfyui.execution", timing["start_execution"], timing["execution_done"]),
+            ("comfyui.image_fetch", timing["execution_done"], timing["fetch_done"]),
+            ("encode.png", timing["fetch_done"], timing["save"]),
+        ]
+        for trace_parent in trace_parents:
+            for name, begin, end in spans:
+                tracer.record_span(name, trace_parent, start=begin.timestamp(), end=end.timestamp(),
+                                   server=server_address)
+
+    def generate_image_batch(self, server_address, file_objs: list, stages: dict = None,
+                             trace_parents: list = (), timestamps: dict = None, workflow: str = None,
+                             on_queued=None) -> list:
+        """
+        Gera as imagens de vários jobs num único prompt: o subgrafo por imagem
+        do workflow é replicado uma vez por job (ver `BatchWorkflow`), com os
+        loaders compartilhados. Retorna uma lista com um BytesIO (PNG) por job,
+        na mesma ordem de `file_objs`, ou a exceção daquele job se a saída dele
+        não veio. Falhas do lote inteiro (upload, WebSocket) são levantadas.
+        """
+        version = self.workflows.get(workflow)
+        use_ws = self.use_websocket_output(server_address)
+        batch = version.batch(len(file_objs), websocket=use_ws)
+        timing = {}
+        client_id = str(uuid.uuid4())
+        start_time = datetime.datetime.now()
+
+        paths = []
+        for file_obj in file_objs:
+            comfyui_path = self.upload_file(file_obj, server_address=server_address, subfolder="", overwrite=True)
+            if not comfyui_path:
+                raise ServerError("Falha ao fazer upload da imagem para ComfyUI.")
+            paths.append(comfyui_path)
+        timing["upload"] = datetime.datetime.now()
+
+        prompt = batch.render(client_id, image=paths)
+        fallback = version.batch(len(file_objs)).render(client_id, image=paths) if use_ws else None
+
+        ws_url = f"{self.http_scheme_to_ws(server_address)}/ws?clientId={client_id}"
+        ws = websocket.WebSocket()
+        ws.connect(ws_url)
+        timing["start_execution"] = datetime.datetime.now()
+
+        log.debug("wait for batch generation", size=batch.size)
+        try:
+            images = self.get_images(ws, server_address, prompt, client_id, timing=timing,
+                                     websocket_nodes=set(batch.outputs) if use_ws else None,
+                                     fallback_prompt=fallback, on_queued=on_queued)
+        finally:
+            ws.close()
+        timing["fetch_done"] = datetime.datetime.now()
+
+        # devolve a saída de cada cópia do subgrafo ao job correspondente
+        per_job = [{} for _ in file_objs]
+        for node_id, image_list in images.items():
+            index = batch.outputs.get(node_id)
+            if index is not None:
+                per_job[index][node_id] = image_list
+
+        results = []
+        for job_images in per_job:
+            try:
+                results.append(self.save_image_buffer(job_images))
+            except RuntimeError as e:
+                results.append(e)
+        timing["save"] = datetime.datetime.now()
+
+        self._report_timing(server_address, start_time, timing, stages, timestamps, list(trace_parents))
+        return results
+
+    def generate_image_buffer(self, server_address, file_obj, stages: dict = None, trace_parent: dict = None,
+                              timestamps: dict = None, workflow: str = None, on_queued=None) -> str:
         """
         Fluxo completo para gerar imagem a partir de um file-like:
         1. Faz upload da imagem de entrada (BytesIO ou similar)
         2. Constrói o prompt a partir do template
         3. Abre WebSocket e aguarda término da execução
         4. Salva a primeira imagem retornada e retorna o caminho salvo
+
+        Se `stages` for informado, é preenchido com a duração (em segundos) das
+        etapas comfyui_upload, execution, image_fetch e png_encode.
+        Com `trace_parent`, as mesmas etapas viram spans filhos desse contexto.
+        `timestamps` recebe o epoch do fim de cada etapa, para ser gravado no job.
+        `workflow` escolhe a versão do registro (padrão: a de WORKFLOW_PATH).
+        `on_queued` é chamado com o prompt_id assim que a ComfyUI aceita o prompt.
         """
+        version = self.workflows.get(workflow)
+        use_ws = self.use_websocket_output(server_address)
         timing = {}
         client_id = str(uuid.uuid4())
         start_time = datetime.datetime.now()
@@ -241,12 +541,11 @@ class MultiComfyUiAPI:
         timing["upload"] = datetime.datetime.now()
 
         if not comfyui_path:
-            raise RuntimeError("Falha ao fazer upload da imagem para ComfyUI.")
+            raise ServerError("Falha ao fazer upload da imagem para ComfyUI.")
 
         # monta o prompt
-        prompt = copy.deepcopy(self.workflow_template)
-        prompt[self.node_id_image_load]["inputs"]["image"] = comfyui_path
-        #prompt["3"]["inputs"]["seed"] = random.randint(0, 100000)
+        prompt = version.prompt(use_ws).render(client_id, image=comfyui_path)
+        fallback = version.compiled.render(client_id, image=comfyui_path) if use_ws else None
 
         # conecta WebSocket com o client_id correto
         ws_add = self.http_scheme_to_ws(server_address)
@@ -258,21 +557,20 @@ class MultiComfyUiAPI:
 
         # aguarda execução e coleta imagens
         log.debug("wait for image generation")
-        images = self.get_images(ws, server_address, prompt, client_id)
-        timing["execution_done"] = datetime.datetime.now()
-        ws.close()
+        try:
+            images = self.get_images(ws, server_address, prompt, client_id, timing=timing,
+                                     websocket_nodes=set(version.output_nodes) if use_ws else None,
+                                     fallback_prompt=fallback, on_queued=on_queued)
+        finally:
+            ws.close()
+        timing["fetch_done"] = datetime.datetime.now()
 
         # salva a imagem resultante em disco
         buf = self.save_image_buffer(images)
         timing["save"] = datetime.datetime.now()
 
-        # logs de timing
-        log.info("[Timing Info]")
-        log.info("Upload time:        %ss", (timing["upload"] - start_time).total_seconds())
-        log.info("Execution wait:     %ss", (timing["start_execution"] - timing["upload"]).total_seconds())
-        log.info("Processing time:    %ss", (timing["execution_done"] - timing["start_execution"]).total_seconds())
-        log.info("Saving time:        %ss", (timing["save"] - timing["execution_done"]).total_seconds())
-        log.info("Total:              %ss", (timing["save"] - start_time).total_seconds())
+        self._report_timing(server_address, start_time, timing, stages, timestamps,
+                            [trace_parent] if trace_parent is not None else [])
 
         log.info("[DEBUG] Saved image file buffering: %s", buf)
         if not buf:
@@ -1,9 +1,24 @@
 from .config import settings
+from .memory_store import MemoryRedis
 from redis.asyncio import Redis
 
 
-redis = Redis.from_url(
-    settings.REDIS_URL,
-    encoding="utf-8",
-    decode_responses=True
-)
\ No newline at end of file
+def connect():
+    """
+    Cliente do job store conforme JOB_STORE: "redis" (padrão, API e worker
+    em processos separados) ou "memory" (tudo num processo só, sem Redis).
+    """
+    if settings.JOB_STORE == "memory":
+        return MemoryRedis()
+    if settings.JOB_STORE != "redis":
+        raise ValueError(f"JOB_STORE desconhecido: {settings.JOB_STORE}")
+    if not settings.REDIS_URL:
+        raise ValueError("REDIS_URL é obrigatório com JOB_STORE=redis")
+    return Redis.from_url(
+        settings.REDIS_URL,
+        encoding="utf-8",
+        decode_responses=True
+    )
+
+
+redis = connect()
@@ -0,0 +1,166 @@
+import json
+import time
+
+import structlog
+
+
+log = structlog.get_logger()
+
+# url -> JSON com capacidades, origem e flag de drenagem
+REGISTRY_KEY = "servers:registry"
+# zset url -> último heartbeat (epoch)
+HEARTBEATS_KEY = "servers:heartbeats"
+# url -> jobs em andamento, publicado pelo worker
+IN_FLIGHT_KEY = "servers:in_flight"
+
+
+def normalize(url: str) -> str:
+    return (url or "").strip().rstrip("/")
+
+
+def parse_capabilities(items) -> dict:
+    """
+    Converte ["max_batch=4", "output=http", "gpu=L4"] em dict, com números
+    convertidos; um nome sem valor vira flag (True).
+    """
+    caps = {}
+    for item in items or []:
+        key, sep, value = item.partition("=")
+        if not key.strip():
+            continue
+        if not sep:
+            caps[key.strip()] = True
+            continue
+        value = value.strip()
+        try:
+            caps[key.strip()] = int(value)
+        except ValueError:
+            caps[key.strip()] = value
+    return caps
+
+
+async def register(redis, url: str, capabilities: dict = None, static: bool = False, ts: float = None) -> dict:
+    """
+    Registra (ou atualiza) um servidor ComfyUI e conta como heartbeat. Um
+    servidor em drenagem continua em drenagem até `set_draining(False)`.
+    """
+    url = normalize(url)
+    if not url:
+        raise ValueError("URL do servidor vazia")
+    ts = time.time() if ts is None else ts
+    current = json.loads(await redis.hget(REGISTRY_KEY, url) or "{}")
+    info = {
+        "capabilities": capabilities if capabilities is not None else current.get("capabilities", {}),
+        "static": static or current.get("static", False),
+        "draining": current.get("draining", False),
+        "registered_at": current.get("registered_at", round(ts, 3)),
+    }
+    pipe = redis.pipeline()
+    pipe.hset(REGISTRY_KEY, url, json.dumps(info))
+    pipe.zadd(HEARTBEATS_KEY, {url: ts})
+    await pipe.execute()
+    if not current:
+        log.info("servers.registered", server=url, capabilities=info["capabilities"], static=info["static"])
+    return info
+
+
+async def heartbeat(redis, url: str, ts: float = None) -> bool:
+    """
+    Renova o heartbeat. False se o servidor não está registrado (o agente
+    deve se registrar de novo).
+    """
+    url = normalize(url)
+    if await redis.hget(REGISTRY_KEY, url) is None:
+        return False
+    await redis.zadd(HEARTBEATS_KEY, {url: time.time() if ts is None else ts})
+    return True
+
+
+async def set_draining(redis, url: str, draining: bool = True) -> bool:
+    """
+    Tira (ou devolve) o servidor do despacho sem removê-lo: o worker deixa
+    de mandar jobs novos e espera os que estão rodando.
+    """
+    url = normalize(url)
+    raw = await redis.hget(REGISTRY_KEY, url)
+    if raw is None:
+        return False
+    info = json.loads(raw)
+    info["draining"] = draining
+    await redis.hset(REGISTRY_KEY, url, json.dumps(info))
+    log.info("servers.draining" if draining else "servers.resumed", server=url)
+    return True
+
+
+async def deregister(redis, url: str) -> bool:
+    url = normalize(url)
+    pipe = redis.pipeline()
+    pipe.hdel(REGISTRY_KEY, url)
+    pipe.zrem(HEARTBEATS_KEY, url)
+    pipe.hdel(IN_FLIGHT_KEY, url)
+    removed, _, _ = await pipe.execute()
+    if removed:
+        log.info("servers.deregistered", server=url)
+    return bool(removed)
+
+
+async def seed(redis, urls: list):
+    """
+    Registra os servidores da configuração (COMFYUI_API_SERVER1..4 e
+    COMFYUI_API_SERVERS) como estáticos: não dependem de heartbeat. Os que
+    saíram da configuração voltam a ser dinâmicos e expiram pelo heartbeat
+    (e depois pelo reaper) como qualquer nó que parou de responder.
+    """
+    configured = list(dict.fromkeys(normalize(u) for u in urls if normalize(u)))
+    for url, raw in (await redis.hgetall(REGISTRY_KEY) or {}).items():
+        info = json.loads(raw)
+        if info.get("static") and url not in configured:
+            info["static"] = False
+            await redis.hset(REGISTRY_KEY, url, json.dumps(info))
+            log.info("servers.unseeded", server=url)
+    for url in configured:
+        await register(redis, url, static=True)
+
+
+async def fleet(redis, ttl: float, now: float = None) -> dict:
+    """
+    url -> info do registro, com `heartbeat_at`, `alive` (estático ou com
+    heartbeat há menos de `ttl` segundos) e `in_flight`.
+    """
+    now = time.time() if now is None else now
+    pipe = redis.pipeline()
+    pipe.hgetall(REGISTRY_KEY)
+    pipe.zrange(HEARTBEATS_KEY, 0, -1, withscores=True)
+    pipe.hgetall(IN_FLIGHT_KEY)
+    registry, beats, in_flight = await pipe.execute()
+    beats = dict(beats)
+    servers = {}
+    for url, raw in (registry or {}).items():
+        info = json.loads(raw)
+        last = beats.get(url)
+        info["heartbeat_at"] = last
+        info["alive"] = info.get("static", False) or (last is not None and now - float(last) <= ttl)
+        info["in_flight"] = int((in_flight or {}).get(url) or 0)
+        servers[url] = info
+    return servers
+
+
+def dispatchable(servers: dict) -> list:
+    """
+    Servidores que podem receber jobs novos: vivos e fora de drenagem.
+    """
+    return sorted(url for url, info in servers.items() if info["alive"] and not info["draining"])
+
+
+async def reap(redis, servers: dict, max_age: float, now: float = None) -> list:
+    """
+    Remove do registro os servidores dinâmicos sem heartbeat há mais de
+    `max_age` segundos (nós desligados sem se desregistrar).
+    """
+    now = time.time() if now is None else now
+    stale = [url for url, info in servers.items()
+             if not info.get("static") and not info["in_flight"]
+             and now - float(info["heartbeat_at"] or 0) > max_age]
+    for url in stale:
+        await deregister(redis, url)
+    return stale
@@ -0,0 +1,132 @@
+import math
+import time
+import structlog
+
+from collections import Counter
+
+from core.metrics import GAUGES_KEY, HEALTHY_SERVERS
+
+
+log = structlog.get_logger()
+
+# buckets logarítmicos (estilo HDR): cada bucket cobre ~5% de erro relativo
+BUCKET_GROWTH = 1.05
+MIN_VALUE = 0.01
+MAX_VALUE = 3600.0
+
+WINDOW_SECONDS = 300
+RETENTION_WINDOWS = 288  # 24h de janelas de 5 minutos
+
+ALL = "all"
+
+
+def bucket_index(value: float) -> int:
+    value = min(max(value, MIN_VALUE), MAX_VALUE)
+    return int(math.floor(math.log(value / MIN_VALUE, BUCKET_GROWTH)))
+
+
+def bucket_value(index: int) -> float:
+    # ponto médio geométrico do bucket
+    return MIN_VALUE * BUCKET_GROWTH ** (index + 0.5)
+
+
+def window_start(ts: float, window: int = WINDOW_SECONDS) -> int:
+    return int(ts // window) * window
+
+
+def sketch_key(metric: str, dimension: str, window: int) -> str:
+    return f"stats:{metric}:{dimension}:{window}"
+
+
+def dimensions(server: str = None, workflow: str = None) -> list:
+    dims = [ALL]
+    if server:
+        dims.append(f"server:{server}")
+    if workflow:
+        dims.append(f"workflow:{workflow}")
+    return dims
+
+
+async def record(redis, values: dict, server: str = None, workflow: str = None, ts: float = None):
+    """
+    Registra as durações de um job (metric -> segundos) nos sketches da janela
+    corrente, para o agregado geral, por servidor e por workflow.
+    Tudo vai num único pipeline.
+    """
+    if not values:
+        return
+    window = window_start(ts or time.time())
+    ttl = WINDOW_SECONDS * RETENTION_WINDOWS
+    pipe = redis.pipeline(transaction=False)
+    for dim in dimensions(server, workflow):
+        for metric, seconds in values.items():
+            key = sketch_key(metric, dim, window)
+            pipe.hincrby(key, bucket_index(seconds), 1)
+            pipe.expire(key, ttl)
+        pipe.sadd("stats:dimensions", dim)
+    pipe.sadd("stats:metrics", *values.keys())
+    await pipe.execute()
+
+
+async def load_sketch(redis, metric: str, dimension: str = ALL, windows: int = 12, now: float = None) -> Counter:
+    """
+    Soma os buckets das últimas `windows` janelas (por padrão, 1 hora).
+    """
+    current = window_start(now or time.time())
+    pipe = redis.pipeline(transaction=False)
+    for i in range(windows):
+        pipe.hgetall(sketch_key(metric, dimension, current - i * WINDOW_SECONDS))
+    merged = Counter()
+    for buckets in await pipe.execute():
+        for index, count in (buckets or {}).items():
+            merged[int(index)] += int(count)
+    return merged
+
+
+def percentiles(sketch: Counter, quantiles=(0.5, 0.9, 0.95, 0.99)) -> dict:
+    total = sum(sketch.values())
+    result = {"count": total}
+    if not total:
+        return result
+    ordered = sorted(sketch.items())
+    for q in quantiles:
+        rank = q * total
+        seen = 0
+        for index, count in ordered:
+            seen += count
+            if seen >= rank:
+                result[f"p{int(q * 100)}"] = round(bucket_value(index), 3)
+                break
+    return result
+
+
+async def summary(redis, windows: int = 12) -> dict:
+    """
+    Percentis por métrica e dimensão (geral, por servidor, por workflow).
+    """
+    metric_names = sorted(await redis.smembers("stats:metrics") or [])
+    dims = sorted(await redis.smembers("stats:dimensions") or [])
+    result = {}
+    for dim in dims:
+        for metric in metric_names:
+            sketch = await load_sketch(redis, metric, dim, windows)
+            if sketch:
+                result.setdefault(dim, {})[metric] = percentiles(sketch)
+    return result
+
+
+async def estimate_wait(redis, position: int, default_seconds: float = 80, windows: int = 12) -> float:
+    """
+    Estima a espera de quem está na posição `position` da fila, usando a
+    mediana recente do tempo total de geração e o número de servidores
+    saudáveis. Sem amostras, recorre à média móvel antiga.
+    """
+    sketch = await load_sketch(redis, "total", ALL, windows)
+    if sketch:
+        per_job = percentiles(sketch, quantiles=(0.5,))["p50"]
+    else:
+        per_job = float(await redis.get("avg_processing_time") or default_seconds)
+
+    servers = await redis.hget(GAUGES_KEY, HEALTHY_SERVERS)
+    servers = max(int(float(servers)), 1) if servers else 1
+    return math.ceil(position / servers) * per_job
@@ -0,0 +1,275 @@
+import asyncio
+import json
+import sys
+import threading
+import time
+import uuid
+import structlog
+
+from typing import Optional, Union
+
+
+log = structlog.get_logger()
+
+
+def trace_key(trace_id: str) -> str:
+    return f"trace:{trace_id}"
+
+
+def _new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def _new_span_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class Span:
+    """
+    Um trecho cronometrado de um job. `start`/`end` são epoch em segundos,
+    para que spans criados em processos diferentes (API e worker) fiquem na
+    mesma escala de tempo.
+    """
+
+    def __init__(self, tracer, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 start: Optional[float] = None, attributes: Optional[dict] = None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_span_id()
+        self.parent_id = parent_id
+        self.start = start if start is not None else time.time()
+        self.end_time = None
+        self.status = "ok"
+        self.attributes = dict(attributes or {})
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def record_error(self, error: Exception):
+        self.status = "error"
+        self.attributes["error"] = str(error)
+
+    def context(self) -> dict:
+        return {"trace_id": self.trace_id, "span_id": self.span_id}
+
+    def end(self, end: Optional[float] = None):
+        if self.end_time is not None:
+            return
+        self.end_time = end if end is not None else time.time()
+        self.tracer._finish(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.record_error(exc)
+        self.end()
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end_time,
+            "duration": (self.end_time or self.start) - self.start,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class SpanExporter:
+    """
+    Interface dos backends de exportação. Recebe spans já finalizados, como dicts.
+    """
+
+    async def export(self, spans: list):
+        raise NotImplementedError
+
+
+class StdoutExporter(SpanExporter):
+    async def export(self, spans: list):
+        for span in spans:
+            sys.stdout.write(json.dumps(span, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
+
+class FileExporter(SpanExporter):
+    """
+    Grava um span por linha (JSON Lines), útil para testes e análise offline.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    async def export(self, spans: list):
+        with open(self.path, mode="a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(span, ensure_ascii=False) + "\n")
+
+
+class RedisExporter(SpanExporter):
+    """
+    Guarda os spans de cada trace em `trace:{trace_id}`, de onde o endpoint
+    administrativo monta o waterfall do job.
+    """
+
+    def __init__(self, client=None, ttl: int = 7 * 24 * 3600):
+        self.client = client
+        self.ttl = ttl
+
+    async def export(self, spans: list):
+        client = self.client
+        if client is None:
+            from core.redis import redis as client
+
+        pipe = client.pipeline(transaction=False)
+        for trace_id in {s["trace_id"] for s in spans}:
+            key = trace_key(trace_id)
+            pipe.rpush(key, *[json.dumps(s) for s in spans if s["trace_id"] == trace_id])
+            pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+
+class Tracer:
+    """
+    Cria spans e os acumula até `flush`, que entrega o lote a cada exporter.
+    `start_span` é thread-safe, então pode ser usado dentro de
+    `asyncio.to_thread` (ex.: em `MultiComfyUiAPI.generate_image_buffer`).
+    """
+
+    def __init__(self, exporters: Optional[list] = None):
+        self.exporters = exporters or []
+        self._finished = []
+        self._lock = threading.Lock()
+
+    def start_span(self, name: str, parent: Union[Span, dict, None] = None,
+                   start: Optional[float] = None, **attributes) -> Span:
+        """
+        Inicia um span. `parent` pode ser um Span ou um contexto
+        {"trace_id", "span_id"} vindo da fila ou do hash do job; sem parent,
+        inicia um novo trace.
+        """
+        if isinstance(parent, Span):
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        elif parent and parent.get("trace_id"):
+            trace_id, parent_id = parent["trace_id"], parent.get("span_id") or None
+        else:
+            trace_id, parent_id = _new_trace_id(), None
+        return Span(self, name, trace_id, parent_id, start=start, attributes=attributes)
+
+    def record_span(self, name: str, parent, start: float, end: float, **attributes) -> Span:
+        """
+        Registra um span já concluído a partir de timestamps medidos antes.
+        """
+        span = self.start_span(name, parent=parent, start=start, **attributes)
+        span.end(end)
+        return span
+
+    def _finish(self, span: Span):
+        with self._lock:
+            self._finished.append(span.to_dict())
+
+    async def flush(self):
+        with self._lock:
+            spans, self._finished = self._finished, []
+        if not spans:
+            return
+        for exporter in self.exporters:
+            try:
+                await exporter.export(spans)
+            except Exception as e:
+                log.warning("tracing.export_failed", exporter=type(exporter).__name__, error=str(e))
+
+    async def flush_periodically(self, interval: float = 5.0):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[dict]:
+    """
+    Converte um header W3C `traceparent` (00-<trace_id>-<span_id>-<flags>)
+    em contexto de span.
+    """
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return {"trace_id": parts[1], "span_id": parts[2]}
+
+
+def build_waterfall(spans: list) -> dict:
+    """
+    Ordena os spans de um trace e calcula o deslocamento de cada um em relação
+    ao início do trace, além da profundidade na árvore.
+    """
+    if not spans:
+        return {"trace_id": None, "duration_ms": 0, "spans": []}
+
+    by_id = {s["span_id"]: s for s in spans}
+
+    def depth(span):
+        level, parent = 0, span.get("parent_id")
+        while parent in by_id and level < len(spans):
+            level += 1
+            parent = by_id[parent].get("parent_id")
+        return level
+
+    origin = min(s["start"] for s in spans)
+    finish = max(s["end"] or s["start"] for s in spans)
+    rows = []
+    for span in sorted(spans, key=lambda s: (s["start"], depth(s))):
+        rows.append({
+            "name": span["name"],
+            "span_id": span["span_id"],
+            "parent_id": span["parent_id"],
+            "depth": depth(span),
+            "offset_ms": round((span["start"] - origin) * 1000, 1),
+            "duration_ms": round(span["duration"] * 1000, 1),
+            "status": span["status"],
+            "attributes": span["attributes"],
+        })
+    return {
+        "trace_id": spans[0]["trace_id"],
+        "duration_ms": round((finish - origin) * 1000, 1),
+        "spans": rows,
+    }
+
+
+EXPORTERS = {
+    "stdout": lambda settings: StdoutExporter(),
+    "file": lambda settings: FileExporter(settings.TRACE_FILE_PATH),
+    "redis": lambda settings: RedisExporter(ttl=settings.TRACE_TTL_SECONDS),
+}
+
+
+def build_exporters(settings) -> list:
+    """
+    Instancia os exporters listados em TRACE_EXPORTERS (separados por vírgula).
+    Novos backends são registrados adicionando uma fábrica em EXPORTERS.
+    """
+    exporters = []
+    for name in (settings.TRACE_EXPORTERS or "").split(","):
+        name = name.strip()
+        if not name:
+            continue
+        factory = EXPORTERS.get(name)
+        if factory is None:
+            log.warning("tracing.unknown_exporter", exporter=name)
+            continue
+        exporters.append(factory(settings))
+    return exporters
+
+
+def _build_tracer() -> Tracer:
+    from core.config import settings
+    return Tracer(build_exporters(settings))
+
+
+tracer = _build_tracer()
@@ -0,0 +1,83 @@
+import time
+import structlog
+
+
+log = structlog.get_logger()
+
+COLD = "cold"
+WARMING = "warming"
+WARM = "warm"
+
+
+def _now(now: float = None) -> float:
+    return time.monotonic() if now is None else now
+
+
+class WarmupTracker:
+    """
+    Estado quente/frio de cada servidor ComfyUI, mantido pelo worker.
+
+    Um servidor começa frio (worker recém-iniciado), volta a ficar frio quando
+    se recupera de uma queda (a ComfyUI reiniciou e descarregou os modelos) ou
+    depois de `idle_after` segundos sem rodar nada. Fica quente ao terminar um
+    job ou um prompt de aquecimento.
+    """
+
+    def __init__(self, idle_after: float = 900, retry_after: float = 60):
+        self.idle_after = idle_after
+        self.retry_after = retry_after
+        self.last_status = {}
+        self.last_used = {}
+        self.last_attempt = {}
+        self.warming = set()
+
+    def observe(self, server: str, status: str):
+        """
+        Registra o resultado do health-check. Servidor que volta de "down" é
+        tratado como frio.
+        """
+        previous = self.last_status.get(server)
+        self.last_status[server] = status
+        if previous == "down" and status != "down":
+            log.info("warmup.server_recovered", server=server)
+            self.last_used.pop(server, None)
+            self.last_attempt.pop(server, None)
+
+    def state(self, server: str, now: float = None) -> str:
+        if server in self.warming:
+            return WARMING
+        last = self.last_used.get(server)
+        if last is None or _now(now) - last > self.idle_after:
+            return COLD
+        return WARM
+
+    def is_warm(self, server: str, now: float = None) -> bool:
+        return self.state(server, now) == WARM
+
+    def mark_used(self, server: str, now: float = None):
+        self.last_used[server] = _now(now)
+
+    def start_warming(self, server: str, now: float = None):
+        self.warming.add(server)
+        self.last_attempt[server] = _now(now)
+
+    def finish_warming(self, server: str, ok: bool, now: float = None):
+        self.warming.discard(server)
+        if ok:
+            self.mark_used(server, now)
+
+    def needs_warmup(self, server: str, now: float = None) -> bool:
+        now = _now(now)
+        if self.state(server, now) != COLD:
+            return False
+        last_attempt = self.last_attempt.get(server)
+        return last_attempt is None or now - last_attempt >= self.retry_after
+
+    def order(self, servers: list, now: float = None) -> list:
+        """
+        Ordena os servidores livres com os quentes primeiro (estável).
+        """
+        return sorted(servers, key=lambda s: not self.is_warm(s, now))
+
+    def snapshot(self, servers, now: float = None) -> dict:
+        return {server: self.state(server, now) for server in servers}
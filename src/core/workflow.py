@@ -0,0 +1,475 @@
+import glob
+import json
+import os
+import random
+import time
+import uuid
+import structlog
+
+
+log = structlog.get_logger()
+
+# nós cuja saída é o resultado do job; o resto do grafo só existe para alimentá-los
+OUTPUT_CLASS_TYPES = ("SaveImage", "SaveImageWebsocket")
+
+# inputs que apontam para arquivos de modelo carregados na GPU
+MODEL_INPUTS = (
+    "ckpt_name", "unet_name", "vae_name", "clip_name", "lora_name", "control_net_name",
+    "upscale_model_name", "model_name", "ipadapter_file", "instantid_file",
+)
+
+
+def is_link(value) -> bool:
+    # no formato de API, uma ligação entre nós é ["<node_id>", <índice da saída>]
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int)
+
+
+def output_nodes(workflow: dict) -> list:
+    return [node_id for node_id, node in workflow.items() if node.get("class_type") in OUTPUT_CLASS_TYPES]
+
+
+def reachable_nodes(workflow: dict, outputs: list) -> set:
+    """
+    Conjunto de nós alcançáveis andando para trás, pelas ligações de input,
+    a partir dos nós de saída.
+    """
+    seen = set()
+    stack = list(outputs)
+    while stack:
+        node_id = stack.pop()
+        if node_id in seen or node_id not in workflow:
+            continue
+        seen.add(node_id)
+        for value in workflow[node_id].get("inputs", {}).values():
+            if is_link(value):
+                stack.append(value[0])
+    return seen
+
+
+def models_used(workflow: dict, node_ids=None) -> set:
+    models = set()
+    for node_id in workflow if node_ids is None else node_ids:
+        for name, value in workflow[node_id].get("inputs", {}).items():
+            if name in MODEL_INPUTS and isinstance(value, str):
+                models.add(value)
+    return models
+
+
+def prune_workflow(workflow: dict, outputs: list = None) -> tuple:
+    """
+    Remove os nós que não chegam a nenhuma saída (previews de depuração,
+    máscaras de clipspace soltas, ramos órfãos), que a ComfyUI ainda
+    carregaria e validaria a cada job.
+
+    Retorna (workflow podado, relatório). O relatório lista os nós removidos
+    (id -> class_type) e os modelos referenciados só por eles.
+    """
+    outputs = outputs or output_nodes(workflow)
+    missing = [node_id for node_id in outputs if node_id not in workflow]
+    if not outputs or missing:
+        raise ValueError(f"nós de saída inválidos para poda: {missing or 'nenhum encontrado'}")
+
+    keep = reachable_nodes(workflow, outputs)
+    pruned_ids = [node_id for node_id in workflow if node_id not in keep]
+    pruned = {node_id: node for node_id, node in workflow.items() if node_id in keep}
+    report = {
+        "outputs": list(outputs),
+        "kept": len(pruned),
+        "pruned_nodes": {node_id: workflow[node_id].get("class_type") for node_id in pruned_ids},
+        "pruned_models": sorted(models_used(workflow, pruned_ids) - models_used(pruned)),
+    }
+    return pruned, report
+
+
+def offload_frame_composite(workflow: dict, assets_dir: str) -> tuple:
+    """
+    Tira do grafo a moldura composta na GPU: um ImageCompositeMasked que
+    alimenta a saída com `destination` e `mask` vindos do mesmo LoadImage (a
+    moldura, transparente no miolo) e `source` redimensionado para o tamanho
+    dela. A saída passa a receber a imagem gerada e a moldura fica para o
+    worker aplicar na CPU (core.imaging.postprocess).
+
+    Só mexe no grafo se o arquivo da moldura existir em `assets_dir`.
+    Retorna (workflow, caminho local da moldura ou None).
+    """
+    for out_id in output_nodes(workflow):
+        link = workflow[out_id].get("inputs", {}).get("images")
+        if not is_link(link) or workflow.get(link[0], {}).get("class_type") != "ImageCompositeMasked":
+            continue
+        composite_id = link[0]
+        inputs = workflow[composite_id]["inputs"]
+        dest, mask, source = inputs.get("destination"), inputs.get("mask"), inputs.get("source")
+        if not (is_link(dest) and is_link(mask) and is_link(source)) or dest != [mask[0], 0] or mask[1] != 1:
+            continue
+        if inputs.get("x", 0) != 0 or inputs.get("y", 0) != 0 or not inputs.get("resize_source"):
+            continue
+        loader = workflow.get(dest[0], {})
+        if loader.get("class_type") != "LoadImage":
+            continue
+        frame = os.path.join(assets_dir, loader["inputs"]["image"])
+        if not os.path.isfile(frame):
+            log.warning("workflow.frame_not_found", node=dest[0], path=frame)
+            continue
+
+        graph = {node_id: dict(node, inputs=dict(node.get("inputs", {}))) for node_id, node in workflow.items()}
+        graph[out_id]["inputs"]["images"] = list(source)
+        # o composite e a moldura saem do grafo se ninguém mais os usa
+        for node_id in (composite_id, dest[0]):
+            used = any(is_link(v) and v[0] == node_id
+                       for other, node in graph.items() if other != node_id for v in node["inputs"].values())
+            if not used:
+                del graph[node_id]
+        return graph, frame
+    return workflow, None
+
+
+class CompiledWorkflow:
+    """
+    Workflow da ComfyUI pré-serializado uma única vez, com pontos de troca
+    (patch points) marcados. Cada job só troca poucos campos (ex.: a imagem do
+    LoadImage), então o corpo do POST /prompt é montado juntando os pedaços de
+    bytes em cache com os valores escapados, sem `deepcopy` nem `json.dumps`
+    do grafo inteiro.
+
+    `patch_points` mapeia nome -> (node_id, input), por exemplo
+    {"image": ("3023", "image")}. O `client_id` do payload é sempre um patch
+    point implícito.
+    """
+
+    CLIENT_ID = "client_id"
+
+    def __init__(self, workflow: dict, patch_points: dict):
+        self.validate(workflow, patch_points)
+        self.workflow = workflow
+        self.patch_points = dict(patch_points)
+
+        markers = {name: f"__patch_{name}_{uuid.uuid4().hex}__" for name in [*self.patch_points, self.CLIENT_ID]}
+        prompt = {node_id: dict(node, inputs=dict(node.get("inputs", {}))) for node_id, node in workflow.items()}
+        for name, (node_id, input_name) in self.patch_points.items():
+            prompt[node_id]["inputs"][input_name] = markers[name]
+
+        body = json.dumps({"prompt": prompt, "client_id": markers[self.CLIENT_ID]}).encode("utf-8")
+
+        # divide o corpo nos marcadores (com as aspas): segmentos fixos intercalados com nomes
+        self._segments = [body]
+        self._order = []
+        for name, marker in markers.items():
+            quoted = json.dumps(marker).encode("utf-8")
+            for i, segment in enumerate(self._segments):
+                if quoted in segment:
+                    before, after = segment.split(quoted, 1)
+                    self._segments[i:i + 1] = [before, after]
+                    self._order.insert(i, name)
+                    break
+
+    @staticmethod
+    def validate(workflow: dict, patch_points: dict):
+        """
+        Garante que cada patch point aponta para um nó e um input existentes.
+        Levanta ValueError no carregamento, em vez de KeyError no meio de um job.
+        """
+        for name, (node_id, input_name) in patch_points.items():
+            node = workflow.get(node_id)
+            if node is None:
+                raise ValueError(f"patch point '{name}': nó '{node_id}' não existe no workflow")
+            if input_name not in node.get("inputs", {}):
+                raise ValueError(
+                    f"patch point '{name}': nó '{node_id}' ({node.get('class_type')}) não tem o input '{input_name}'"
+                )
+
+    def render(self, client_id: str, **values) -> bytes:
+        """
+        Retorna o corpo JSON do POST /prompt com os valores informados.
+        Patch points omitidos mantêm o valor original do template.
+        """
+        values[self.CLIENT_ID] = client_id
+        parts = [self._segments[0]]
+        for name, segment in zip(self._order, self._segments[1:]):
+            if name in values:
+                value = values[name]
+            else:
+                node_id, input_name = self.patch_points[name]
+                value = self.workflow[node_id]["inputs"][input_name]
+            parts.append(json.dumps(value).encode("utf-8"))
+            parts.append(segment)
+        return b"".join(parts)
+
+    def build(self, **values) -> dict:
+        """
+        Cópia do prompt em dict com os valores aplicados (para depuração e testes).
+        """
+        return json.loads(self.render(client_id="", **values))["prompt"]
+
+
+def use_websocket_output(workflow: dict) -> dict:
+    """
+    Troca os nós SaveImage por SaveImageWebsocket: a ComfyUI passa a enviar a
+    imagem codificada como frame binário no WebSocket já aberto, sem gravar em
+    disco nem exigir /history + /view depois da execução.
+    """
+    result = dict(workflow)
+    for node_id, node in workflow.items():
+        if node.get("class_type") == "SaveImage":
+            result[node_id] = dict(node, class_type="SaveImageWebsocket",
+                                   inputs={"images": node["inputs"]["images"]})
+    return result
+
+
+def downstream_nodes(workflow: dict, sources) -> set:
+    """
+    Nós que dependem (direta ou indiretamente) de algum nó de `sources`,
+    incluindo os próprios.
+    """
+    consumers = {}
+    for node_id, node in workflow.items():
+        for value in node.get("inputs", {}).values():
+            if is_link(value):
+                consumers.setdefault(value[0], set()).add(node_id)
+    seen = set()
+    stack = [node_id for node_id in sources if node_id in workflow]
+    while stack:
+        node_id = stack.pop()
+        if node_id in seen:
+            continue
+        seen.add(node_id)
+        stack.extend(consumers.get(node_id, ()))
+    return seen
+
+
+def clone_for_batch(workflow: dict, patch_points: dict, size: int) -> tuple:
+    """
+    Replica `size` vezes o subgrafo que depende da imagem de entrada (os nós
+    abaixo dos patch points), mantendo uma única cópia dos nós compartilhados
+    (loaders de checkpoint, ControlNet, LoRA, molduras fixas).
+
+    A cópia 0 mantém os ids originais; a cópia i recebe ids deslocados
+    (ex.: 3040 -> 13040, 23040, ... quando todos os ids são numéricos, ou
+    "3040#1", "3040#2" nos demais casos). Retorna (grafo, patch points
+    "<nome>_<i>", {nó de saída: índice da cópia}).
+    """
+    per_image = downstream_nodes(workflow, [node_id for node_id, _ in patch_points.values()])
+    if all(node_id.isdigit() for node_id in workflow):
+        stride = 10 ** len(str(max(int(node_id) for node_id in workflow)))
+
+        def clone_id(node_id, i):
+            return node_id if i == 0 else str(int(node_id) + i * stride)
+    else:
+        def clone_id(node_id, i):
+            return node_id if i == 0 else f"{node_id}#{i}"
+
+    graph = {node_id: node for node_id, node in workflow.items() if node_id not in per_image}
+    points = {}
+    outputs = {}
+    for i in range(size):
+        for node_id in per_image:
+            node = workflow[node_id]
+            inputs = {
+                name: [clone_id(value[0], i), value[1]] if is_link(value) and value[0] in per_image else value
+                for name, value in node.get("inputs", {}).items()
+            }
+            new_id = clone_id(node_id, i)
+            graph[new_id] = dict(node, inputs=inputs)
+            if node.get("class_type") in OUTPUT_CLASS_TYPES:
+                outputs[new_id] = i
+        for name, (node_id, input_name) in patch_points.items():
+            points[f"{name}_{i}"] = (clone_id(node_id, i), input_name)
+    return graph, points, outputs
+
+
+class BatchWorkflow:
+    """
+    Grafo com N cópias do subgrafo por imagem, já compilado, e o mapa de
+    qual nó de saída pertence a qual job do lote.
+    """
+
+    def __init__(self, workflow: dict, patch_points: dict, size: int):
+        graph, points, self.outputs = clone_for_batch(workflow, patch_points, size)
+        self.size = size
+        self.compiled = CompiledWorkflow(graph, points)
+
+    def render(self, client_id: str, **values_per_job) -> bytes:
+        """
+        `values_per_job` mapeia patch point -> lista com um valor por job.
+        """
+        values = {}
+        for name, items in values_per_job.items():
+            for i, value in enumerate(items):
+                values[f"{name}_{i}"] = value
+        return self.compiled.render(client_id, **values)
+
+
+def parse_weights(text: str) -> dict:
+    """
+    Converte "mamulengo_v21_api=9,mamulengo_v20_api=1" em {nome: peso}.
+    """
+    weights = {}
+    for item in (text or "").split(","):
+        name, sep, value = item.strip().partition("=")
+        if name and sep:
+            weights[name.strip()] = float(value)
+    return weights
+
+
+class WorkflowVersion:
+    """
+    Uma versão carregada do workflow: template podado e compilado, com o
+    mtime do arquivo para detectar mudanças.
+    """
+
+    def __init__(self, name: str, path: str, mtime: float, template: dict, compiled: CompiledWorkflow,
+                 prune_report: dict = None, frame: str = None):
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        self.template = template
+        self.compiled = compiled
+        self.prune_report = prune_report
+        # moldura aplicada pelo worker em vez da GPU (offload_frame_composite)
+        self.frame = frame
+        self.output_nodes = output_nodes(template)
+        self.ws_template = use_websocket_output(template)
+        self.ws_compiled = CompiledWorkflow(self.ws_template, compiled.patch_points)
+        self.batches = {}
+
+    def prompt(self, websocket: bool = False) -> CompiledWorkflow:
+        """
+        Template compilado com saída por HTTP (SaveImage) ou por WebSocket.
+        """
+        return self.ws_compiled if websocket else self.compiled
+
+    def batch(self, size: int, websocket: bool = False) -> BatchWorkflow:
+        """
+        Versão em lote com `size` jobs, compilada na primeira vez e reaproveitada.
+        """
+        key = (size, websocket)
+        if key not in self.batches:
+            template = self.ws_template if websocket else self.template
+            self.batches[key] = BatchWorkflow(template, self.compiled.patch_points, size)
+        return self.batches[key]
+
+    def describe(self) -> dict:
+        report = self.prune_report or {}
+        return {
+            "path": self.path,
+            "mtime": self.mtime,
+            "nodes": len(self.template),
+            "pruned_nodes": len(report.get("pruned_nodes", {})),
+            "frame": self.frame,
+        }
+
+
+class WorkflowRegistry:
+    """
+    Carrega e compila todas as versões de workflow de um diretório (o nome da
+    versão é o nome do arquivo sem extensão), escolhe a versão de cada job por
+    sorteio ponderado (rollout A/B) e recarrega arquivos alterados sem
+    reiniciar o worker.
+
+    Arquivos que não passam na validação dos patch points são ignorados com
+    um aviso; se uma versão já carregada for alterada para algo inválido, a
+    versão anterior continua em uso. Só a versão padrão é obrigatória.
+    """
+
+    def __init__(self, directory: str, default_path: str, patch_points: dict, pattern: str = "*.json",
+                 prune: bool = True, outputs: list = None, weights: dict = None, reload_interval: float = 5.0,
+                 assets_dir: str = None):
+        self.directory = directory
+        self.default_path = default_path
+        self.default = os.path.splitext(os.path.basename(default_path))[0]
+        self.patch_points = patch_points
+        self.pattern = pattern
+        self.prune = prune
+        self.outputs = outputs or []
+        self.configured_weights = dict(weights or {})
+        self.weights = dict(self.configured_weights)
+        self.reload_interval = reload_interval
+        self.assets_dir = assets_dir
+        self.versions = {}
+        self._failed = {}
+        self._last_reload = 0.0
+
+        self.reload()
+        if self.default not in self.versions:
+            # mantém o comportamento antigo: workflow padrão inválido impede o worker de subir
+            self.versions[self.default] = self._load(self.default, default_path)
+
+    def _load(self, name: str, path: str) -> WorkflowVersion:
+        mtime = os.path.getmtime(path)
+        with open(path, "r", encoding="utf-8") as f:
+            template = json.load(f)
+        frame = None
+        if self.assets_dir:
+            template, frame = offload_frame_composite(template, self.assets_dir)
+        report = None
+        if self.prune:
+            template, report = prune_workflow(template, self.outputs)
+        compiled = CompiledWorkflow(template, self.patch_points)
+        return WorkflowVersion(name, path, mtime, template, compiled, report, frame)
+
+    def reload(self) -> dict:
+        """
+        Relê os arquivos novos ou alterados e descarta os removidos.
+        Retorna {"loaded": [...], "removed": [...]}.
+        """
+        self._last_reload = time.monotonic()
+        changes = {"loaded": [], "removed": []}
+        paths = {os.path.splitext(os.path.basename(p))[0]: p
+                 for p in glob.glob(os.path.join(self.directory, self.pattern))}
+        paths.setdefault(self.default, self.default_path)
+
+        for name, path in sorted(paths.items()):
+            current = self.versions.get(name)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            # arquivo sem mudança desde a última carga (ou desde a última falha)
+            if (current is not None and current.mtime == mtime) or self._failed.get(name) == mtime:
+                continue
+            try:
+                version = self._load(name, path)
+            except (OSError, ValueError) as e:
+                self._failed[name] = mtime
+                log.warning("workflow.load_failed", workflow=name, path=path, error=str(e))
+                continue
+            self._failed.pop(name, None)
+            self.versions[name] = version
+            changes["loaded"].append(name)
+            log.info("workflow.loaded", workflow=name, reloaded=current is not None,
+                     **(version.prune_report or {"kept": len(version.template)}))
+
+        for name in [n for n in self.versions if n not in paths and n != self.default]:
+            del self.versions[name]
+            changes["removed"].append(name)
+            log.info("workflow.removed", workflow=name)
+
+        return changes
+
+    def reload_due(self) -> bool:
+        return time.monotonic() - self._last_reload >= self.reload_interval
+
+    def names(self) -> list:
+        return sorted(self.versions)
+
+    def get(self, name: str = None) -> WorkflowVersion:
+        """
+        Retorna a versão pedida (ou a padrão). KeyError se ela não estiver carregada.
+        """
+        return self.versions[name or self.default]
+
+    def set_weights(self, weights: dict = None):
+        """
+        Troca os pesos do rollout; sem pesos, volta aos da configuração.
+        """
+        self.weights = dict(weights) if weights else dict(self.configured_weights)
+
+    def choose(self, rng=random) -> str:
+        """
+        Sorteia a versão de um job conforme os pesos. Versões sem peso ou não
+        carregadas ficam de fora; sem pesos válidos, usa a versão padrão.
+        """
+        candidates = [(name, w) for name, w in self.weights.items() if w > 0 and name in self.versions]
+        if not candidates:
+            return self.default
+        names, weights = zip(*candidates)
+        return rng.choices(names, weights=weights, k=1)[0]
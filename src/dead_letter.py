@@ -0,0 +1,48 @@
+import argparse
+import asyncio
+import json
+
+from core import failures
+from core.redis import redis
+
+
+async def list_entries(limit: int):
+    for entry in await failures.dead_letters(redis, limit):
+        print(json.dumps(entry, ensure_ascii=False))
+
+
+async def replay(request_ids: list, replay_all: bool):
+    if replay_all:
+        request_ids = [entry["request_id"] for entry in await failures.dead_letters(redis, 0)]
+    for request_id in dict.fromkeys(request_ids):
+        ok = await failures.replay(redis, request_id)
+        print(f"{request_id}: {'reenfileirado' if ok else 'não encontrado'}")
+
+
+def main():
+    """
+    Inspeciona e reprocessa a dead-letter queue:
+
+        python dead_letter.py list --limit 20
+        python dead_letter.py replay <request_id> [<request_id> ...]
+        python dead_letter.py replay --all
+    """
+    parser = argparse.ArgumentParser(description="Dead-letter queue dos jobs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    list_cmd = commands.add_parser("list", help="lista os jobs na dead-letter queue")
+    list_cmd.add_argument("--limit", type=int, default=100)
+    replay_cmd = commands.add_parser("replay", help="devolve jobs à fila com as tentativas zeradas")
+    replay_cmd.add_argument("request_ids", nargs="*")
+    replay_cmd.add_argument("--all", action="store_true", dest="replay_all")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        asyncio.run(list_entries(args.limit))
+    elif not args.request_ids and not args.replay_all:
+        parser.error("informe os request_ids ou --all")
+    else:
+        asyncio.run(replay(args.request_ids, args.replay_all))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,104 @@
 import os
 import io
+import json
+import math
+import time
+import random
+import struct
 import asyncio
+from collections import OrderedDict
 from uuid import uuid4
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
-from fastapi import FastAPI, UploadFile, File, Form, WebSocket, WebSocketDisconnect, Response
+from fastapi import FastAPI, UploadFile, File, Form, WebSocket, WebSocketDisconnect, Response, Request
+from fastapi.responses import JSONResponse
 from PIL import Image, ImageDraw
 
 PROCESSING_DELAY = float(os.getenv("DEFAULT_PROCESSING_TIME", "1000")) / 1000.0
 
+# Modo "realistic": fila de execução de um slot por instância, como uma GPU
+# rodando a ComfyUI. Sem ele, cada /prompt roda em paralelo (modo legado).
+SIMULATION_MODE = os.getenv("DUMMY_SIMULATION_MODE", "legacy").lower()
+# fixed | normal | lognormal
+LATENCY_DISTRIBUTION = os.getenv("DUMMY_LATENCY_DISTRIBUTION", "fixed").lower()
+LATENCY_STDDEV = float(os.getenv("DUMMY_LATENCY_STDDEV_MS", "0")) / 1000.0
+COLD_START_DELAY = float(os.getenv("DUMMY_COLD_START_MS", "0")) / 1000.0
+# tempo ocioso após o qual o próximo job volta a pagar o cold start (0 = nunca)
+IDLE_COLD_AFTER = float(os.getenv("DUMMY_IDLE_COLD_AFTER_S", "0"))
+FAILURE_RATE = float(os.getenv("DUMMY_FAILURE_RATE", "0"))
+TIMEOUT_RATE = float(os.getenv("DUMMY_TIMEOUT_RATE", "0"))
+# por quanto tempo um job "travado" fica preso (0 = até /interrupt)
+TIMEOUT_HANG = float(os.getenv("DUMMY_TIMEOUT_HANG_MS", "0")) / 1000.0
+PROGRESS_STEPS = int(os.getenv("DUMMY_PROGRESS_STEPS", "20"))
+MAX_STORED_IMAGES = int(os.getenv("DUMMY_MAX_STORED_IMAGES", "256"))
+MAX_HISTORY = int(os.getenv("DUMMY_MAX_HISTORY", "1000"))
+# custo de cada imagem extra num prompt em lote, como fração do tempo de uma imagem
+BATCH_MARGINAL = float(os.getenv("DUMMY_BATCH_MARGINAL", "0.35"))
+# 0 simula uma ComfyUI sem o nó SaveImageWebsocket (prompt recusado com 400)
+WEBSOCKET_OUTPUT = os.getenv("DUMMY_WEBSOCKET_OUTPUT", "1") == "1"
+
+OUTPUT_CLASS_TYPES = ("SaveImage", "SaveImageWebsocket")
+
+rng = random.Random(os.getenv("DUMMY_SEED"))
+
 app = FastAPI()
 
-uploaded_images: Dict[str, bytes] = {}
-jobs: Dict[str, Dict[str, Any]] = {}
-websockets: Dict[str, WebSocket] = {}
-queue_running: bool = False
 
+class BoundedStore(OrderedDict):
+    """
+    Dicionário LRU: ao passar de `limit` itens, descarta os mais antigos.
+    """
 
-@app.post("/upload/image")
-async def upload_image(image: UploadFile = File(...), subfolder: str = Form(""), overwrite: str = Form("false")):
-    content = await image.read()
-    filename = f"{uuid4().hex}.png"
-    uploaded_images[filename] = content
-    return {"name": filename, "subfolder": subfolder}
+    def __init__(self, limit: int):
+        super().__init__()
+        self.limit = limit
 
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.limit:
+            self.popitem(last=False)
 
-@app.post("/prompt")
-async def prompt_endpoint(payload: Dict[str, Any]):
-    prompt = payload.get("prompt", {})
-    client_id = payload.get("client_id")
-    prompt_id = uuid4().hex
 
-    image_path = None
-    for node in prompt.values():
-        if isinstance(node, dict) and "inputs" in node and "image" in node["inputs"]:
-            image_path = node["inputs"]["image"]
-            break
+uploaded_images: Dict[str, bytes] = BoundedStore(MAX_STORED_IMAGES)
+jobs: Dict[str, Dict[str, Any]] = BoundedStore(MAX_HISTORY)
+websockets: Dict[str, WebSocket] = {}
 
-    jobs[prompt_id] = {"status": "processing", "outputs": {}}
-    global queue_running
-    queue_running = True
+# modo legado: quantos jobs estão rodando agora
+running_jobs: int = 0
 
-    asyncio.create_task(process_job(prompt_id, client_id, image_path))
-    return {"prompt_id": prompt_id}
+# modo realistic
+pending: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+current: Optional[Dict[str, Any]] = None
+prompt_counter: int = 0
+last_finished_at: Optional[float] = None
+work_available = asyncio.Event()
+interrupt_event = asyncio.Event()
+executor_task: Optional[asyncio.Task] = None
+
+
+def sample_latency() -> float:
+    mean = PROCESSING_DELAY
+    if LATENCY_DISTRIBUTION == "normal":
+        value = rng.gauss(mean, LATENCY_STDDEV)
+    elif LATENCY_DISTRIBUTION == "lognormal" and mean > 0:
+        # parâmetros escolhidos para manter média e desvio informados
+        variance = LATENCY_STDDEV ** 2
+        sigma2 = math.log(1 + variance / mean ** 2)
+        mu = math.log(mean) - sigma2 / 2
+        value = rng.lognormvariate(mu, sigma2 ** 0.5)
+    else:
+        value = mean
+    return max(value, 0.0)
 
 
-async def process_job(prompt_id: str, client_id: str, image_path: str):
-    await asyncio.sleep(PROCESSING_DELAY)
+def is_cold() -> bool:
+    if last_finished_at is None:
+        return True
+    return IDLE_COLD_AFTER > 0 and time.time() - last_finished_at > IDLE_COLD_AFTER
 
+
+def render_output(image_path: Optional[str]) -> str:
     img_bytes = None
     if image_path:
         key = os.path.basename(image_path)
@@ -63,35 +114,243 @@ async def process_job(prompt_id: str, client_id: str, image_path: str):
 
     buf = io.BytesIO()
     img.save(buf, format="PNG")
-    data = buf.getvalue()
     out_name = f"{uuid4().hex}.png"
-    uploaded_images[out_name] = data
+    uploaded_images[out_name] = buf.getvalue()
+    return out_name
 
-    jobs[prompt_id] = {
-        "status": "complete",
-        "outputs": {
-            "0": {
-                "images": [
-                    {"filename": out_name, "subfolder": "", "type": "output"}
-                ]
-            }
-        },
-    }
 
-    global queue_running
-    queue_running = False
+def find_image_path(prompt: Dict[str, Any]) -> Optional[str]:
+    for node in prompt.values():
+        if isinstance(node, dict) and "inputs" in node and "image" in node["inputs"]:
+            return node["inputs"]["image"]
+    return None
+
 
-    ws = websockets.get(client_id)
+def find_outputs(prompt: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """
+    Mapeia cada nó SaveImage para a imagem de entrada que o alimenta (o
+    LoadImage acima dele cujo arquivo foi enviado por /upload/image). Num
+    prompt em lote, cada cópia do subgrafo tem a sua saída.
+    """
+    outputs = {}
+    for node_id, node in prompt.items():
+        if not isinstance(node, dict) or node.get("class_type") not in OUTPUT_CLASS_TYPES:
+            continue
+        image_path, seen, stack = None, set(), [node_id]
+        while stack:
+            current_id = stack.pop()
+            if current_id in seen or current_id not in prompt:
+                continue
+            seen.add(current_id)
+            inputs = prompt[current_id].get("inputs", {})
+            image = inputs.get("image")
+            if isinstance(image, str) and os.path.basename(image) in uploaded_images:
+                image_path = image
+                break
+            stack.extend(v[0] for v in inputs.values() if isinstance(v, list) and len(v) == 2)
+        outputs[node_id] = image_path
+    return outputs or {"0": find_image_path(prompt)}
+
+
+async def send(client_id: Optional[str], message: Dict[str, Any]):
+    ws = websockets.get(client_id) if client_id else None
     if ws:
         try:
-            await ws.send_json({"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+            await ws.send_json(message)
         except Exception:
             pass
 
 
+def queue_remaining() -> int:
+    return len(pending) + (1 if current else 0)
+
+
+async def broadcast_status():
+    message = {"type": "status", "data": {"status": {"exec_info": {"queue_remaining": queue_remaining()}}}}
+    for client_id in list(websockets):
+        await send(client_id, message)
+
+
+@app.on_event("startup")
+async def start_executor():
+    global executor_task
+    if SIMULATION_MODE == "realistic":
+        executor_task = asyncio.create_task(executor_loop())
+
+
+@app.post("/upload/image")
+async def upload_image(image: UploadFile = File(...), subfolder: str = Form(""), overwrite: str = Form("false")):
+    content = await image.read()
+    filename = f"{uuid4().hex}.png"
+    uploaded_images[filename] = content
+    return {"name": filename, "subfolder": subfolder}
+
+
+@app.post("/prompt")
+async def prompt_endpoint(request: Request):
+    # o cliente envia JSON sem Content-Type, como a ComfyUI aceita
+    payload = json.loads(await request.body())
+    prompt = payload.get("prompt", {})
+    client_id = payload.get("client_id")
+    prompt_id = uuid4().hex
+    outputs = find_outputs(prompt)
+    ws_nodes = {node_id for node_id in outputs
+                if isinstance(prompt.get(node_id), dict) and prompt[node_id].get("class_type") == "SaveImageWebsocket"}
+    if ws_nodes and not WEBSOCKET_OUTPUT:
+        return JSONResponse(status_code=400, content={
+            "error": {"type": "invalid_prompt", "message": "Cannot execute because node SaveImageWebsocket does not exist.",
+                      "details": "", "extra_info": {}},
+            "node_errors": {},
+        })
+
+    if SIMULATION_MODE == "realistic":
+        global prompt_counter
+        prompt_counter += 1
+        pending[prompt_id] = {
+            "number": prompt_counter,
+            "prompt_id": prompt_id,
+            "client_id": client_id,
+            "outputs": outputs,
+            "ws_nodes": ws_nodes,
+        }
+        jobs[prompt_id] = {"status": {"status_str": "pending", "completed": False}, "outputs": {}}
+        work_available.set()
+        await broadcast_status()
+        return {"prompt_id": prompt_id, "number": prompt_counter, "node_errors": {}}
+
+    jobs[prompt_id] = {"status": "processing", "outputs": {}}
+    global running_jobs
+    running_jobs += 1
+
+    asyncio.create_task(process_job(prompt_id, client_id, outputs, ws_nodes))
+    return {"prompt_id": prompt_id}
+
+
+def render_outputs(outputs: Dict[str, Optional[str]], ws_nodes=()) -> Dict[str, Any]:
+    # saídas SaveImageWebsocket não vão para o histórico, só para o WebSocket
+    return {
+        node: {"images": [{"filename": render_output(image_path), "subfolder": "", "type": "output"}]}
+        for node, image_path in outputs.items() if node not in ws_nodes
+    }
+
+
+async def send_websocket_outputs(client_id: Optional[str], prompt_id: str, outputs: Dict[str, Optional[str]], ws_nodes):
+    """
+    Como o SaveImageWebsocket: "executing" do nó seguido de um frame binário
+    com 4 bytes de tipo de evento (1), 4 de formato (2 = PNG) e a imagem.
+    """
+    ws = websockets.get(client_id) if client_id else None
+    for node in ws_nodes:
+        await send(client_id, {"type": "executing", "data": {"node": node, "display_node": node, "prompt_id": prompt_id}})
+        png = uploaded_images.pop(render_output(outputs[node]))
+        if ws:
+            try:
+                await ws.send_bytes(struct.pack(">II", 1, 2) + png)
+            except Exception:
+                pass
+
+
+async def process_job(prompt_id: str, client_id: str, outputs: Dict[str, Optional[str]], ws_nodes=()):
+    global running_jobs
+    try:
+        await asyncio.sleep(PROCESSING_DELAY * (1 + BATCH_MARGINAL * (len(outputs) - 1)))
+        await send_websocket_outputs(client_id, prompt_id, outputs, ws_nodes)
+        jobs[prompt_id] = {"status": "complete", "outputs": render_outputs(outputs, ws_nodes)}
+    finally:
+        running_jobs -= 1
+
+    await send(client_id, {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+
+
+async def run_one(item: Dict[str, Any]):
+    """
+    Executa um prompt no modo realistic, emitindo as mensagens que a ComfyUI
+    emite: execution_start, executing, progress, executed e o executing final.
+    """
+    global last_finished_at
+    prompt_id, client_id = item["prompt_id"], item["client_id"]
+    node = next(iter(item["outputs"]))
+
+    latency = sample_latency() * (1 + BATCH_MARGINAL * (len(item["outputs"]) - 1))
+    if is_cold():
+        latency += COLD_START_DELAY
+    roll = rng.random()
+    fails = roll < FAILURE_RATE
+    hangs = not fails and roll < FAILURE_RATE + TIMEOUT_RATE
+
+    await send(client_id, {"type": "execution_start", "data": {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)}})
+    await send(client_id, {"type": "executing", "data": {"node": node, "display_node": node, "prompt_id": prompt_id}})
+
+    interrupt_event.clear()
+    steps = max(PROGRESS_STEPS, 1)
+    step_delay = latency / steps
+    for step in range(1, steps + 1):
+        if fails and step > steps // 2:
+            jobs[prompt_id] = {"status": {"status_str": "error", "completed": False}, "outputs": {}}
+            await send(client_id, {"type": "execution_error", "data": {
+                "prompt_id": prompt_id, "node_id": node, "node_type": "KSampler",
+                "exception_message": "Simulated failure", "exception_type": "RuntimeError",
+            }})
+            return
+        try:
+            await asyncio.wait_for(interrupt_event.wait(), timeout=step_delay)
+            interrupted = True
+        except asyncio.TimeoutError:
+            interrupted = False
+        if interrupted:
+            jobs[prompt_id] = {"status": {"status_str": "error", "completed": False}, "outputs": {}}
+            await send(client_id, {"type": "execution_interrupted", "data": {"prompt_id": prompt_id, "node_id": node}})
+            return
+        await send(client_id, {"type": "progress", "data": {"value": step, "max": steps, "prompt_id": prompt_id, "node": node}})
+
+    if hangs:
+        # job travado: fica preso até /interrupt ou até o tempo configurado
+        try:
+            await asyncio.wait_for(interrupt_event.wait(), timeout=TIMEOUT_HANG or None)
+        except asyncio.TimeoutError:
+            pass
+        jobs[prompt_id] = {"status": {"status_str": "error", "completed": False}, "outputs": {}}
+        await send(client_id, {"type": "execution_interrupted", "data": {"prompt_id": prompt_id, "node_id": node}})
+        return
+
+    await send_websocket_outputs(client_id, prompt_id, item["outputs"], item["ws_nodes"])
+    outputs = render_outputs(item["outputs"], item["ws_nodes"])
+    jobs[prompt_id] = {
+        "status": {"status_str": "success", "completed": True},
+        "outputs": outputs,
+    }
+    last_finished_at = time.time()
+    for output_node, output in outputs.items():
+        await send(client_id, {"type": "executed", "data": {"node": output_node, "output": output, "prompt_id": prompt_id}})
+    await send(client_id, {"type": "execution_success", "data": {"prompt_id": prompt_id}})
+
+
+async def executor_loop():
+    global current
+    while True:
+        if not pending:
+            work_available.clear()
+            await work_available.wait()
+            continue
+        _, current = pending.popitem(last=False)
+        await broadcast_status()
+        try:
+            await run_one(current)
+        finally:
+            prompt_id, client_id = current["prompt_id"], current["client_id"]
+            current = None
+            await send(client_id, {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+            await broadcast_status()
+
+
 @app.get("/history/{prompt_id}")
 async def get_history(prompt_id: str):
-    job = jobs.get(prompt_id, {"status": "processing", "outputs": {}})
+    job = jobs.get(prompt_id)
+    if job is None:
+        # a ComfyUI devolve {} para prompts desconhecidos ou ainda não concluídos
+        return {} if SIMULATION_MODE == "realistic" else {prompt_id: {"status": "processing", "outputs": {}}}
+    if SIMULATION_MODE == "realistic" and job["status"]["status_str"] == "pending":
+        return {}
     return {prompt_id: job}
 
 
@@ -105,18 +364,41 @@ async def view_image(filename: str, subfolder: str = "", type: str = "output"):
 
 @app.get("/queue")
 async def queue_status():
-    return {"queue_running": queue_running}
+    if SIMULATION_MODE == "realistic":
+        running = [[current["number"], current["prompt_id"], {}, {}, []]] if current else []
+        waiting = [[item["number"], item["prompt_id"], {}, {}, []] for item in pending.values()]
+        return {"queue_running": running, "queue_pending": waiting}
+    return {"queue_running": running_jobs > 0}
+
+
+@app.post("/queue")
+async def queue_update(request: Request):
+    payload = json.loads(await request.body() or b"{}")
+    if payload.get("clear"):
+        pending.clear()
+    for prompt_id in payload.get("delete", []):
+        pending.pop(prompt_id, None)
+    await broadcast_status()
+    return Response(status_code=200)
+
+
+@app.post("/interrupt")
+async def interrupt():
+    interrupt_event.set()
+    return Response(status_code=200)
 
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, clientId: str):
+async def websocket_endpoint(websocket: WebSocket, clientId: str = None):
     await websocket.accept()
-    websockets[clientId] = websocket
+    client_id = clientId or uuid4().hex
+    websockets[client_id] = websocket
     try:
+        await websocket.send_json({"type": "status", "data": {
+            "status": {"exec_info": {"queue_remaining": queue_remaining()}}, "sid": client_id}})
         while True:
-            await asyncio.sleep(0.1)
+            await websocket.receive_text()
     except WebSocketDisconnect:
         pass
     finally:
-        websockets.pop(clientId, None)
-
+        websockets.pop(client_id, None)
@@ -1,3 +1,6 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -7,8 +10,13 @@ import logging
 # from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
 
 from core.config import settings
+from core.metrics import metrics
+from core.memory_store import MemoryRedis
+from core.redis import redis
+from core.tracing import tracer
 from utils.log_sender import LogSender
 from routes.routes import router as rest_router
+from routes.admin import router as admin_router
 
 
 logging.basicConfig(level=logging.INFO, format="%(message)s")
@@ -39,7 +47,55 @@ log_sender = LogSender(
     upload_delay=120
 )
 
-app = FastAPI()
+async def snapshot_periodically(store: MemoryRedis, path: str):
+    """
+    Grava o job store em memória no SQLite a cada JOB_STORE_SNAPSHOT_INTERVAL,
+    para o modo totem sobreviver a um restart.
+    """
+    while True:
+        await asyncio.sleep(settings.JOB_STORE_SNAPSHOT_INTERVAL)
+        try:
+            await asyncio.to_thread(MemoryRedis.write_snapshot, path, store.dump())
+        except Exception as e:
+            log.warning("job_store.snapshot_error", path=path, error=str(e))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # job store em memória: retoma o snapshot antes de o worker recuperar os jobs
+    in_memory = settings.JOB_STORE == "memory"
+    snapshot_path = settings.JOB_STORE_PATH if in_memory else None
+    snapshot_task = None
+    if snapshot_path:
+        keys = redis.load(snapshot_path)
+        log.info("job_store.snapshot_loaded", path=snapshot_path, keys=keys)
+        snapshot_task = asyncio.create_task(snapshot_periodically(redis, snapshot_path))
+
+    # modo totem: o worker roda no mesmo processo (obrigatório com JOB_STORE=memory)
+    worker = worker_task = None
+    if settings.EMBEDDED_WORKER or in_memory:
+        from worker import Worker, configured_servers
+        worker = Worker(configured_servers())
+        worker_task = asyncio.create_task(worker.worker_loop(handle_signals=False))
+        log.info("worker.embedded", job_store=settings.JOB_STORE)
+
+    # envia periodicamente ao Redis as métricas acumuladas por este processo
+    flush_task = asyncio.create_task(metrics.flush_periodically(redis))
+    trace_task = asyncio.create_task(tracer.flush_periodically())
+    yield
+    if worker is not None:
+        worker.stop()
+        await worker_task
+    flush_task.cancel()
+    trace_task.cancel()
+    await metrics.flush(redis)
+    await tracer.flush()
+    if snapshot_path:
+        snapshot_task.cancel()
+        redis.save(snapshot_path)
+
+
+app = FastAPI(lifespan=lifespan)
 # app.add_middleware(SentryAsgiMiddleware)
 
 app.add_middleware(
@@ -50,3 +106,4 @@ app.add_middleware(
 )
 
 app.include_router(rest_router)
+app.include_router(admin_router)
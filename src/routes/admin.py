@@ -0,0 +1,178 @@
+import json
+import structlog
+
+from typing import Optional
+
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query
+from fastapi.responses import JSONResponse
+
+from core.config import settings
+from core.redis import redis
+from core import failures, jobstore, servers, stats
+from core.tracing import build_waterfall, trace_key
+
+
+router = APIRouter(prefix="/admin")
+log = structlog.get_logger()
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    """
+    Protege as rotas administrativas quando ADMIN_TOKEN estiver configurado.
+    """
+    if settings.ADMIN_TOKEN and x_admin_token != settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="Token administrativo inválido")
+
+
+async def require_admin_write(x_admin_token: Optional[str] = Header(default=None)):
+    """
+    Rotas que alteram o sistema (pesos, replay, frota de servidores) falham
+    fechadas: sem ADMIN_TOKEN configurado ficam recusadas com 403.
+    """
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Defina ADMIN_TOKEN para usar as rotas administrativas de escrita")
+    await require_admin(x_admin_token)
+
+
+@router.get("/jobs/{request_id}/trace", dependencies=[Depends(require_admin)])
+async def get_job_trace(request_id: str):
+    """
+    Retorna o waterfall (API -> fila -> worker -> ComfyUI -> S3 -> SMS) de um job.
+    O trace_id vem do hash do job ou, se já saiu do Redis, do arquivo; os
+    spans ficam no Redis por TRACE_TTL_SECONDS.
+    """
+    job = await jobstore.get(redis, request_id)
+    trace_id = job.get("trace_id")
+    if not trace_id:
+        raise HTTPException(status_code=404, detail="Trace não encontrado para este Request ID")
+
+    raw = await redis.lrange(trace_key(trace_id), 0, -1)
+    spans = [json.loads(item) for item in raw]
+    waterfall = build_waterfall(spans)
+    waterfall["request_id"] = request_id
+    return JSONResponse(waterfall)
+
+
+@router.get("/stats", dependencies=[Depends(require_admin)])
+async def get_stats(window_minutes: int = Query(60, ge=5, le=24 * 60)):
+    """
+    Percentis (p50/p90/p95/p99) das etapas dos jobs, no agregado geral,
+    por servidor e por workflow, calculados a partir dos sketches por janela.
+    """
+    windows = max(window_minutes * 60 // stats.WINDOW_SECONDS, 1)
+    return JSONResponse({
+        "window_minutes": window_minutes,
+        "stages": await stats.summary(redis, windows),
+    })
+
+
+@router.get("/workflows", dependencies=[Depends(require_admin)])
+async def get_workflows():
+    """
+    Versões de workflow carregadas pelo worker e pesos de rollout em vigor
+    (os do Redis, se houver; senão, WORKFLOW_WEIGHTS).
+    """
+    versions = await redis.hgetall("workflow:versions") or {}
+    weights = await redis.hgetall("workflow:weights") or {}
+    return JSONResponse({
+        "versions": {name: json.loads(info) for name, info in versions.items()},
+        "weights": {name: float(w) for name, w in weights.items()},
+        "configured_weights": settings.WORKFLOW_WEIGHTS,
+    })
+
+
+@router.put("/workflows/weights", dependencies=[Depends(require_admin_write)])
+async def set_workflow_weights(weights: dict = Body(...)):
+    """
+    Troca os pesos do rollout A/B sem reiniciar o worker, ex.:
+    {"mamulengo_v21_api": 90, "mamulengo_v20_api": 10}. Um objeto vazio volta
+    aos pesos da configuração.
+    """
+    try:
+        parsed = {str(name): float(w) for name, w in weights.items()}
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Pesos devem ser numéricos")
+    if any(w < 0 for w in parsed.values()):
+        raise HTTPException(status_code=400, detail="Pesos não podem ser negativos")
+
+    pipe = redis.pipeline()
+    pipe.delete("workflow:weights")
+    if parsed:
+        pipe.hset("workflow:weights", mapping=parsed)
+    await pipe.execute()
+    log.info("admin.workflow_weights", weights=parsed)
+    return JSONResponse({"weights": parsed})
+
+
+@router.get("/dead-letter", dependencies=[Depends(require_admin)])
+async def get_dead_letter(limit: int = Query(100, ge=1, le=1000)):
+    """
+    Jobs que esgotaram as tentativas ou falharam por causa da entrada, do
+    mais recente para o mais antigo, com a culpa e o último erro.
+    """
+    entries = await failures.dead_letters(redis, limit)
+    return JSONResponse({"count": await redis.llen(failures.DEAD_LETTER_KEY), "entries": entries})
+
+
+@router.post("/dead-letter/{request_id}/replay", dependencies=[Depends(require_admin_write)])
+async def replay_dead_letter(request_id: str):
+    """
+    Devolve um job da dead-letter queue à fila, com as tentativas zeradas.
+    """
+    if not await failures.replay(redis, request_id):
+        raise HTTPException(status_code=404, detail="Request ID não está na dead-letter queue")
+    log.info("admin.dead_letter_replay", request_id=request_id)
+    return JSONResponse({"status": "queued", "request_id": request_id}, status_code=202)
+
+
+@router.get("/servers", dependencies=[Depends(require_admin)])
+async def get_servers():
+    """
+    Frota de servidores ComfyUI: capacidades, último heartbeat, drenagem e
+    jobs em andamento de cada um, e quais recebem jobs novos.
+    """
+    fleet = await servers.fleet(redis, settings.SERVER_HEARTBEAT_TTL)
+    return JSONResponse({"servers": fleet, "dispatchable": servers.dispatchable(fleet)})
+
+
+@router.post("/servers", dependencies=[Depends(require_admin_write)])
+async def register_server(url: str = Body(...), capabilities: dict = Body(default={})):
+    """
+    Registra um servidor (ou renova o registro e o heartbeat), ex.:
+    {"url": "http://gpu5:8188", "capabilities": {"max_batch": 4, "gpu": "L4"}}.
+    O worker passa a despachar para ele no próximo ciclo.
+    """
+    try:
+        info = await servers.register(redis, url, capabilities)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse({"url": servers.normalize(url), **info})
+
+
+@router.post("/servers/heartbeat", dependencies=[Depends(require_admin_write)])
+async def server_heartbeat(url: str = Body(..., embed=True)):
+    if not await servers.heartbeat(redis, url):
+        raise HTTPException(status_code=404, detail="Servidor não registrado")
+    return JSONResponse({"status": "ok"})
+
+
+@router.post("/servers/drain", dependencies=[Depends(require_admin_write)])
+async def drain_server(url: str = Body(...), draining: bool = Body(default=True)):
+    """
+    Tira o servidor do despacho ({"draining": false} devolve). Os jobs em
+    andamento terminam; quando `in_flight` chegar a 0 ele pode ser desligado.
+    """
+    if not await servers.set_draining(redis, url, draining):
+        raise HTTPException(status_code=404, detail="Servidor não registrado")
+    return JSONResponse({"url": servers.normalize(url), "draining": draining}, status_code=202)
+
+
+@router.delete("/servers", dependencies=[Depends(require_admin_write)])
+async def delete_server(url: str = Query(...)):
+    """
+    Remove o servidor do registro. Sai do despacho como na drenagem; jobs
+    que já estão nele terminam normalmente.
+    """
+    if not await servers.deregister(redis, url):
+        raise HTTPException(status_code=404, detail="Servidor não registrado")
+    return JSONResponse({"url": servers.normalize(url), "status": "removed"})
@@ -2,21 +2,26 @@ import structlog
 import uuid
 import os
 import json
+import time
 from io import BytesIO
 import asyncio
 from datetime import datetime
+from typing import Optional
 
 
-from fastapi import APIRouter, Request, UploadFile, File, Form, HTTPException, Query
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi import APIRouter, Request, UploadFile, File, Form, Header, HTTPException, Query
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 from fastapi import BackgroundTasks
 
 from core.config import settings
 
 from core.redis import redis
+from core.metrics import metrics, ADMISSION_REJECTED_TOTAL
+from core import admission, jobstore, lanes, stats
+from core.tracing import tracer, parse_traceparent
 from utils.sms import format_to_e164, send_sms_download_message
-from utils.s3 import upload_fileobj
+from utils.s3 import upload_fileobj, create_presigned_download
 
 
 router = APIRouter()
@@ -26,14 +31,14 @@ BASE_DIR = os.path.dirname(__file__)
 TEMPLATES_DIR = os.path.normpath(os.path.join(BASE_DIR, "..", "frontend", "templates"))
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
 
-async def enqueue_job(rid: str, input_key: str):
-    payload = {"id": rid, "input": input_key}
-    await redis.lpush("submissions_queue", json.dumps(payload))
+async def enqueue_job(rid: str, input_key: str, trace: dict = None):
+    await jobstore.enqueue(redis, rid, input_key, trace)
+    await tracer.flush()
 
 async def send_sms_task(request_id: str, image_url: str, phone: str):
     sent = await asyncio.to_thread(send_sms_download_message, image_url, phone)
     log.info("notify.immediate_sms", request_id=request_id, phone=phone, success=sent)
-    await redis.hset(f"job:{request_id}", "sms_status", "sent" if sent else "failed")
+    await jobstore.update(redis, request_id, {"sms_status": "sent" if sent else "failed"})
 
 @router.get("/")
 async def index():
@@ -46,49 +51,117 @@ async def alive():
 
 @router.post("/api/upload")
 async def upload(
+    request: Request,
     background_tasks: BackgroundTasks,
     image: UploadFile = File(...),
+    workflow: Optional[str] = Form(None),
+    lane: Optional[str] = Form(None),
+    x_lane_token: Optional[str] = Header(default=None),
 ):
     if not image.filename:
         raise HTTPException(400, "Nome de arquivo inválido")
 
+    # faixa do job: a pedida, senão o totem; o worker divide os servidores entre as faixas.
+    # Faixas de prioridade furam a fila, então só valem com o X-Lane-Token.
+    try:
+        lane = lanes.resolve(lane, admission.kiosk_id(request), lanes.authorized(x_lane_token))
+    except PermissionError as e:
+        raise HTTPException(403, str(e))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    # controle de admissão: recusa antes de gastar S3 e fila com quem não seria atendido a tempo
+    client = admission.client_key(request)
+    rejection = await admission.admit(redis, client, priority=lane in lanes.priority_lanes())
+    if rejection:
+        status_code, reason, retry_after, state = rejection
+        metrics.inc(ADMISSION_REJECTED_TOTAL, reason=reason)
+        log.info("api.upload_rejected", client=client, lane=lane, reason=reason, retry_after=retry_after,
+                 estimated_wait=state["estimated_wait_seconds"])
+        return JSONResponse({
+            "status": "BUSY" if reason == admission.OVERLOADED else "RATE_LIMITED",
+            "retry_after_seconds": retry_after,
+            "estimated_wait_seconds": state["estimated_wait_seconds"],
+        }, status_code=status_code, headers={"Retry-After": str(retry_after)})
+
+    # versão de workflow explícita; sem ela o worker sorteia conforme os pesos do rollout
+    if workflow:
+        versions = await redis.hgetall("workflow:versions")
+        if versions and workflow not in versions:
+            raise HTTPException(400, f"Workflow desconhecido: {workflow}")
+
+    start = time.time()
     rid = str(uuid.uuid4())
-    key = f"job:{rid}"
+
+    # inicia o trace do job (ou continua um trace vindo do frontend)
+    span = tracer.start_span("api.upload", parent=parse_traceparent(request.headers.get("traceparent")),
+                             request_id=rid)
 
     content = await image.read()
     bio = BytesIO(content)
-    input_key = upload_fileobj(bio, key_prefix=f"input/{rid}")
+    with tracer.start_span("s3.upload_input", span, bytes=len(content)):
+        input_key = upload_fileobj(bio, key_prefix=f"input/{rid}")
 
     now = datetime.utcnow().isoformat()
-    await redis.hset(key, mapping={
-        "status": "queued",
+    job = {
         "input": input_key,
         "output": "",
         "attempt": 1,
-        "enqueued_at": now
-    })
-
-    background_tasks.add_task(enqueue_job, rid, input_key)
-
-    pos = await redis.llen("submissions_queue")
-    avg = float(await redis.get("avg_processing_time") or 80)
-    eta = int(pos) * avg
-
+        "lane": lane,
+        "created_at": now,
+        "enqueued_at": now,
+        "trace_id": span.trace_id,
+        "trace_parent": span.span_id,
+    }
+    if workflow:
+        job["workflow"] = workflow
+    await jobstore.transition(redis, rid, "queued", job)
+
+    span.end()
+    background_tasks.add_task(enqueue_job, rid, input_key, span.context())
+
+    pos = await redis.llen(jobstore.SUBMISSIONS_QUEUE)
+    eta = await stats.estimate_wait(redis, int(pos))
+
+    metrics.observe_stage("api_upload", time.time() - start)
     return JSONResponse({
         "status": "QUEUED",
         "request_id": rid,
+        "lane": lane,
         "position_in_queue": pos,
         "estimated_wait_seconds": eta
     })
 
+@router.get("/api/admission")
+async def get_admission(request: Request, lane: Optional[str] = Query(None)):
+    """
+    Estado do controle de admissão, para o frontend avisar "volte mais
+    tarde" antes da foto. Não gasta ficha do cliente. Faixas de prioridade
+    estrita não são barradas pela fila.
+    """
+    try:
+        lane = lanes.resolve(lane, admission.kiosk_id(request))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    state = await admission.queue_state(redis)
+    state["lane"] = lane
+    if lane in lanes.priority_lanes():
+        state["accepting"], state["retry_after_seconds"] = True, 0
+    limit = await admission.bucket(redis, admission.client_key(request), consume=False)
+    state["client"] = {"allowed": limit["allowed"], "tokens": limit["tokens"],
+                       "retry_after_seconds": limit["retry_after_seconds"]}
+    if not limit["allowed"]:
+        state["retry_after_seconds"] = max(state["retry_after_seconds"], limit["retry_after_seconds"])
+    state["accepting"] = state["accepting"] and limit["allowed"]
+    return JSONResponse(state)
+
+
 @router.get("/api/result")
 async def get_result(request_id: str = Query(...)):
-    key = f"job:{request_id}"
-    exists = await redis.exists(key)
-    if not exists:
+    # jobs antigos saem do Redis e ficam no arquivo SQLite
+    data = await jobstore.get(redis, request_id)
+    if not data:
         raise HTTPException(status_code=404, detail="Request ID não encontrado")
-
-    data = await redis.hgetall(key)
     status = data.get("status")
 
     if status == "processing":
@@ -99,28 +172,56 @@ async def get_result(request_id: str = Query(...)):
 
     if status == "done":
         image_url = data.get("output")
+        if data.get("archived") and data.get("output_key"):
+            # a URL assinada gravada no job já venceu
+            image_url = create_presigned_download(data["output_key"], expires_in=86400)
         if not image_url:
             raise HTTPException(status_code=500, detail="Imagem processada mas arquivo não encontrado")
-        return JSONResponse({"status": "done", "image_url": image_url})
+        body = {"status": "done", "image_url": image_url}
+        if data.get("renditions"):
+            # URLs assinadas de cada rendição (full, web, thumb, share...), para o celular baixar a menor primeiro
+            keys = json.loads(data["renditions"])
+            body["renditions"] = {name: create_presigned_download(key, expires_in=86400) for name, key in keys.items()}
+        return JSONResponse(body)
+
+    if status == "cancelled":
+        return JSONResponse({"status": "cancelled"})
 
     # se ainda não marcou como "processing"/"done"/"error", considera em fila
     return JSONResponse({"status": "queued"})
 
 
+@router.post("/api/cancel")
+async def cancel_job(request_id: str = Form(...)):
+    """
+    Pede o cancelamento de um job. O worker tira o job da fila ou, se já
+    estiver rodando, interrompe o prompt na ComfyUI e libera o servidor.
+    """
+    job = await jobstore.get(redis, request_id)
+    if not job:
+        raise HTTPException(404, "Request ID não encontrado")
+    status = job.get("status")
+    if status in jobstore.TERMINAL_STATUSES:
+        return JSONResponse({"status": status}, status_code=409)
+
+    await jobstore.request_cancel(redis, request_id, datetime.now().isoformat())
+    log.info("api.cancel_requested", request_id=request_id, status=status)
+    return JSONResponse({"status": "CANCELLING", "request_id": request_id}, status_code=202)
+
+
 @router.post("/api/notify")
 async def register_notification(
     background_tasks: BackgroundTasks,
     request_id: str = Form(...),
     phone: str = Form(...),
 ):
-    key = f"job:{request_id}"
-    if not await redis.exists(key):
+    if not await jobstore.exists(redis, request_id):
         raise HTTPException(404, "Request ID não encontrado")
 
     formatted = format_to_e164(phone)
-    await redis.hset(key, "phone", formatted)
+    await jobstore.update(redis, request_id, {"phone": formatted})
 
-    # data = await redis.hgetall(key)
+    # data = await jobstore.get(redis, request_id)
     # if data.get("status") == "done":
     #     image_url = data["output"]
     #     # agenda o envio de SMS sem bloquear o request
@@ -128,6 +229,11 @@ async def register_notification(
 
     return JSONResponse({"status": "PHONE_REGISTERED"})
 
+@router.get("/metrics")
+async def get_metrics():
+    body = await metrics.render(redis)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
 @router.get("/error")
 async def error(request: Request):
     return templates.TemplateResponse("error.html", {"request": request})
@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import json
+import signal
+
+import structlog
+
+from core import servers
+from core.config import settings
+from core.multi_comfyui_api import MultiComfyUiAPI
+from core.redis import redis
+
+
+log = structlog.get_logger()
+
+
+async def run_agent(url: str, capabilities: dict, interval: float, keep: bool):
+    """
+    Agente do nó de GPU: registra o servidor e renova o heartbeat enquanto a
+    ComfyUI local responder. Parado, o heartbeat vence e o worker tira o
+    servidor do despacho. Ao sair (SIGTERM), desregistra o servidor, salvo
+    com `keep`.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    await servers.register(redis, url, capabilities)
+    while not stop.is_set():
+        status = await MultiComfyUiAPI.get_server_status(url)
+        if status == "down":
+            log.warning("server_agent.comfyui_down", server=url)
+        elif not await servers.heartbeat(redis, url):
+            # removido do registro (ex.: reaped): registra de novo
+            await servers.register(redis, url, capabilities)
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+    if not keep:
+        await servers.deregister(redis, url)
+
+
+async def list_servers():
+    fleet = await servers.fleet(redis, settings.SERVER_HEARTBEAT_TTL)
+    for url, info in sorted(fleet.items()):
+        print(json.dumps({"url": url, **info}, ensure_ascii=False))
+
+
+async def drain(url: str, resume: bool):
+    ok = await servers.set_draining(redis, url, not resume)
+    print(f"{url}: {('de volta ao despacho' if resume else 'em drenagem') if ok else 'não registrado'}")
+
+
+async def remove(url: str):
+    ok = await servers.deregister(redis, url)
+    print(f"{url}: {'removido' if ok else 'não registrado'}")
+
+
+def main():
+    """
+    Registro dinâmico dos servidores ComfyUI:
+
+        python server_registry.py run http://gpu5:8188 --capability max_batch=4 --capability gpu=L4
+        python server_registry.py list
+        python server_registry.py drain http://gpu5:8188 [--resume]
+        python server_registry.py remove http://gpu5:8188
+    """
+    parser = argparse.ArgumentParser(description="Registro dos servidores ComfyUI")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_cmd = commands.add_parser("run", help="registra o servidor e mantém o heartbeat")
+    run_cmd.add_argument("url")
+    run_cmd.add_argument("--capability", action="append", default=[], help="chave=valor, repetível")
+    run_cmd.add_argument("--interval", type=float, default=settings.SERVER_HEARTBEAT_TTL / 3)
+    run_cmd.add_argument("--keep", action="store_true", help="não desregistra ao sair")
+    commands.add_parser("list", help="lista a frota")
+    drain_cmd = commands.add_parser("drain", help="tira o servidor do despacho")
+    drain_cmd.add_argument("url")
+    drain_cmd.add_argument("--resume", action="store_true", help="devolve o servidor ao despacho")
+    remove_cmd = commands.add_parser("remove", help="remove o servidor do registro")
+    remove_cmd.add_argument("url")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        asyncio.run(run_agent(args.url, servers.parse_capabilities(args.capability), args.interval, args.keep))
+    elif args.command == "list":
+        asyncio.run(list_servers())
+    elif args.command == "drain":
+        asyncio.run(drain(args.url, args.resume))
+    else:
+        asyncio.run(remove(args.url))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
+import atexit
 import csv
+import io
 import time
 import requests
 import threading
@@ -11,38 +13,184 @@ from datetime import datetime, timezone
 log = structlog.get_logger()
 
 LOG_DIR = os.path.join(os.path.dirname(__file__), '..', 'logs')
+FIELDNAMES = ["status", "project", "additional", "timePlayed"]
+# o arquivo de rejeitadas guarda também o motivo
+DEAD_FIELDNAMES = FIELDNAMES + ["reason"]
 
 
 class LogSender:
+    """
+    Registra eventos em um log CSV append-only e envia as linhas novas em lote.
+
+    O arquivo `datalogs.csv` é o segmento ativo: as linhas só são anexadas ao
+    final e o deslocamento (em bytes) do que já foi enviado fica persistido em
+    `datalogs.offset`. Cada envio lê apenas o trecho a partir desse deslocamento,
+    então o custo cresce com as linhas novas e não com o tamanho do arquivo.
+    Quando o segmento ativo já foi todo enviado e passou de `segment_max_bytes`,
+    o conteúdo é movido para `datalogs_backup.csv` e o segmento recomeça.
+
+    Linhas recusadas pelo servidor, ou que falham `max_row_attempts` envios
+    seguidos, vão para `datalogs_rejected.csv` com o motivo, para não travar o
+    resto do segmento nem se perderem.
+    """
     csv_filename = os.path.join(LOG_DIR, 'datalogs.csv')
     backup_filename = os.path.join(LOG_DIR, 'datalogs_backup.csv')
+    offset_filename = os.path.join(LOG_DIR, 'datalogs.offset')
+    dead_filename = os.path.join(LOG_DIR, 'datalogs_rejected.csv')
 
-    def __init__(self, log_api, project_id, upload_delay=120):
+    def __init__(self, log_api, project_id, upload_delay=120, batch_size=200,
+                 flush_size=50, flush_interval=2.0, segment_max_bytes=1024 * 1024,
+                 max_row_attempts=5, log_dir=None, start=True):
         self.project_id = project_id
         self.log_api = log_api
         self.upload_delay = upload_delay
+        self.batch_size = batch_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.segment_max_bytes = segment_max_bytes
+        self.max_row_attempts = max_row_attempts
+
+        if log_dir:
+            self.csv_filename = os.path.join(log_dir, 'datalogs.csv')
+            self.backup_filename = os.path.join(log_dir, 'datalogs_backup.csv')
+            self.offset_filename = os.path.join(log_dir, 'datalogs.offset')
+            self.dead_filename = os.path.join(log_dir, 'datalogs_rejected.csv')
+
+        # sessão reaproveita conexões entre os envios
+        self.session = requests.Session()
+        self._bulk_supported = True
+        # envios seguidos em que a primeira linha pendente não saiu
+        self._head_failures = 0
+
+        self._buffer = []
+        self._buffer_since = None
+        self._write_lock = threading.Lock()
+        self._ship_lock = threading.Lock()
+        self._stop = threading.Event()
+
         self._init_csv(self.csv_filename)
         self._init_csv(self.backup_filename)
-        threading.Thread(target=self._process_csv_and_send_logs, daemon=True).start()
+        self._init_csv(self.dead_filename, DEAD_FIELDNAMES)
+        self._offset = self._load_offset()
+
+        atexit.register(self.flush)
+        if start:
+            threading.Thread(target=self._run, daemon=True).start()
 
     @staticmethod
-    def _init_csv(filename):
+    def _init_csv(filename, fieldnames=FIELDNAMES):
         try:
             with open(filename, mode='x', newline='') as f:
                 writer = csv.writer(f)
-                writer.writerow(['status', 'project', 'additional', 'timePlayed'])
+                writer.writerow(fieldnames)
             log.info("csv_initialized", file=filename)
         except FileExistsError:
             log.debug("csv_already_exists", file=filename)
 
+    @staticmethod
+    def _render_row(row) -> str:
+        out = io.StringIO()
+        csv.writer(out).writerow(row)
+        return out.getvalue()
+
     def log(self, status, additional=''):
         now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-        with open(self.csv_filename, mode='a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([status, self.project_id, additional, now])
+        line = self._render_row([status, self.project_id, additional, now])
+        with self._write_lock:
+            if not self._buffer:
+                self._buffer_since = time.monotonic()
+            self._buffer.append(line)
+            should_flush = len(self._buffer) >= self.flush_size
+        if should_flush:
+            self.flush()
         log.info("log_appended", status=status, project=self.project_id, timePlayed=now)
 
+    def flush(self):
+        """
+        Grava no segmento ativo as linhas acumuladas em memória, com um único write.
+        """
+        with self._write_lock:
+            if not self._buffer:
+                return
+            data = "".join(self._buffer)
+            self._buffer = []
+            self._buffer_since = None
+            with open(self.csv_filename, mode='a', newline='') as f:
+                f.write(data)
+
+    def _load_offset(self) -> int:
+        try:
+            with open(self.offset_filename, mode='r') as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _save_offset(self, offset: int):
+        tmp = f"{self.offset_filename}.tmp"
+        with open(tmp, mode='w') as f:
+            f.write(str(offset))
+        os.replace(tmp, self.offset_filename)
+        self._offset = offset
+
+    def _read_pending(self):
+        """
+        Lê as linhas ainda não enviadas a partir do deslocamento persistido.
+        Retorna uma lista de (linha, deslocamento ao final da linha).
+        """
+        size = os.path.getsize(self.csv_filename)
+        if self._offset > size:
+            # segmento foi truncado fora do LogSender: recomeça do início
+            log.warning("log_offset_reset", offset=self._offset, size=size)
+            self._save_offset(0)
+
+        with open(self.csv_filename, mode='rb') as f:
+            f.seek(self._offset)
+            raw = f.read()
+
+        # ignora um eventual registro incompleto no final do arquivo
+        end = raw.rfind(b"\n")
+        if end < 0:
+            return []
+        raw = raw[:end + 1]
+
+        position = self._offset
+
+        def lines():
+            nonlocal position
+            for chunk in raw.splitlines(keepends=True):
+                position += len(chunk)
+                yield chunk.decode("utf-8")
+
+        rows = []
+        # csv.reader consome as linhas sob demanda, então `position` aponta
+        # exatamente para o fim do registro recém-lido
+        for values in csv.reader(lines()):
+            if values == FIELDNAMES or not values:
+                continue
+            rows.append((dict(zip(FIELDNAMES, values)), position))
+        return rows
+
+    def _dead_letter(self, row, reason):
+        """
+        Guarda no arquivo de rejeitadas uma linha que não será mais reenviada.
+        """
+        line = self._render_row([row[f] for f in FIELDNAMES] + [reason])
+        with self._write_lock:
+            with open(self.dead_filename, mode='a', newline='') as f:
+                f.write(line)
+        log.error("log_dead_lettered", reason=reason, **row)
+
+    @staticmethod
+    def _rejected(status_code) -> bool:
+        # 4xx é recusa do conteúdo; 408 e 429 são temporários e valem nova tentativa
+        return 400 <= status_code < 500 and status_code not in (408, 429)
+
     def _send_log(self, status, project, additional, timePlayed):
+        """
+        Envia uma linha. Retorna True se a linha foi aceita ou recusada pelo
+        servidor (não adianta reenviar: vai para o arquivo de rejeitadas) e
+        False numa falha temporária, para tentar de novo no próximo envio.
+        """
         url = f"{self.log_api}/datalog/upload"
         payload = {
             'status': status,
@@ -51,37 +199,128 @@ class LogSender:
             'timePlayed': timePlayed
         }
         try:
-            r = requests.post(url, data=payload)
+            r = self.session.post(url, data=payload, timeout=10)
             if r.status_code == 200:
                 log.info("log_sent", **payload)
                 return True
-            else:
-                log.warning("log_send_failed", status_code=r.status_code, **payload)
-                return False
+            if self._rejected(r.status_code):
+                self._dead_letter(payload, f"http_{r.status_code}")
+                return True
+            log.warning("log_send_failed", status_code=r.status_code, **payload)
+            return False
         except Exception as e:
             log.error("log_send_error", error=str(e), **payload)
             return False
 
-    def _process_csv_and_send_logs(self):
-        while True:
-            keep, backup = [], []
-            with open(self.csv_filename, mode="r", newline="") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    if self._send_log(**row):
-                        backup.append(row)
-                    else:
-                        keep.append(row)
-
-            with open(self.csv_filename, mode="w", newline="") as f:
-                writer = csv.DictWriter(f, fieldnames=["status","project","additional","timePlayed"])
-                writer.writeheader()
-                writer.writerows(keep)
-
-            with open(self.backup_filename, mode="a", newline="") as f:
-                writer = csv.DictWriter(f, fieldnames=["status","project","additional","timePlayed"])
-                writer.writerows(backup)
-
-            log.info("batch_processed", sent=len(backup), kept=len(keep))
-
-            time.sleep(self.upload_delay)
\ No newline at end of file
+    def _send_batch(self, rows) -> int:
+        """
+        Envia várias linhas numa única requisição e retorna quantas, do início
+        do lote, já não precisam ser reenviadas. Se o servidor de logs não
+        oferecer o endpoint em lote, passa a enviar linha a linha pela mesma
+        sessão; se recusar o lote (ex.: 400, 413), envia esse lote linha a
+        linha para isolar a linha problemática.
+        """
+        if self._bulk_supported:
+            url = f"{self.log_api}/datalog/upload/batch"
+            try:
+                r = self.session.post(url, json={"logs": rows}, timeout=30)
+                if r.status_code == 200:
+                    log.info("log_batch_sent", count=len(rows))
+                    return len(rows)
+                if r.status_code in (404, 405):
+                    log.warning("log_batch_unsupported", status_code=r.status_code)
+                    self._bulk_supported = False
+                elif self._rejected(r.status_code):
+                    log.warning("log_batch_rejected", status_code=r.status_code, count=len(rows))
+                else:
+                    log.warning("log_batch_failed", status_code=r.status_code, count=len(rows))
+                    return 0
+            except Exception as e:
+                log.error("log_batch_error", error=str(e), count=len(rows))
+                return 0
+
+        # para na primeira falha: as linhas já aceitas não são reenviadas
+        for sent, row in enumerate(rows):
+            if not self._send_log(**row):
+                return sent
+        return len(rows)
+
+    def _rotate_segment(self):
+        """
+        Move o segmento ativo, já todo enviado, para o arquivo de backup.
+        """
+        with self._write_lock:
+            if os.path.getsize(self.csv_filename) != self._offset:
+                # chegaram linhas novas depois do envio; rotaciona no próximo ciclo
+                return
+            with open(self.csv_filename, mode='r', newline='') as src, \
+                    open(self.backup_filename, mode='a', newline='') as dst:
+                src.readline()  # cabeçalho
+                while True:
+                    chunk = src.read(64 * 1024)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+            with open(self.csv_filename, mode='w', newline='') as f:
+                csv.writer(f).writerow(FIELDNAMES)
+            self._save_offset(0)
+        log.info("log_segment_rotated", file=self.csv_filename)
+
+    def _give_up(self, row, end) -> bool:
+        """
+        Conta mais um envio em que `row` (a primeira pendente) não saiu. Ao
+        chegar em `max_row_attempts`, move a linha para o arquivo de rejeitadas
+        e avança o deslocamento, liberando o resto do segmento.
+        """
+        self._head_failures += 1
+        if self._head_failures < self.max_row_attempts:
+            return False
+        self._dead_letter(row, "retries_exhausted")
+        self._save_offset(end)
+        self._head_failures = 0
+        return True
+
+    def ship(self):
+        """
+        Envia em lotes as linhas pendentes e avança o deslocamento persistido
+        apenas até a última linha aceita (ou movida para as rejeitadas).
+        Retorna quantas linhas deixaram de estar pendentes.
+        """
+        with self._ship_lock:
+            self.flush()
+            rows = self._read_pending()
+            done = 0
+            while done < len(rows):
+                batch = rows[done:done + self.batch_size]
+                accepted = self._send_batch([row for row, _ in batch])
+                if accepted:
+                    done += accepted
+                    self._save_offset(batch[accepted - 1][1])
+                    self._head_failures = 0
+                if accepted < len(batch):
+                    if not self._give_up(*batch[accepted]):
+                        break
+                    done += 1
+
+            log.info("batch_processed", sent=done, kept=len(rows) - done)
+
+            if done == len(rows) and self._offset >= self.segment_max_bytes:
+                self._rotate_segment()
+            return done
+
+    def _run(self):
+        last_ship = 0.0
+        while not self._stop.wait(self.flush_interval):
+            since = self._buffer_since
+            if since is not None and time.monotonic() - since >= self.flush_interval:
+                self.flush()
+            if time.monotonic() - last_ship >= self.upload_delay:
+                try:
+                    self.ship()
+                except Exception as e:
+                    log.error("log_ship_error", error=str(e))
+                last_ship = time.monotonic()
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
@@ -3,21 +3,25 @@ import boto3
 from botocore.client import Config
 import uuid
 
-# Definimos o endpoint region-specific
-ENDPOINT = f"https://s3.{settings.AWS_REGION}.amazonaws.com"
+# Definimos o endpoint region-specific (ou um S3 compatível/local, se configurado)
+ENDPOINT = settings.S3_ENDPOINT_URL or f"https://s3.{settings.AWS_REGION}.amazonaws.com"
 
 s3_client = boto3.client(
     "s3",
     endpoint_url=ENDPOINT,
     region_name=settings.AWS_REGION,
-    config=Config(signature_version="s3v4")
+    config=Config(
+        signature_version="s3v4",
+        # endpoints locais não resolvem o bucket como subdomínio
+        s3={"addressing_style": "path"} if settings.S3_ENDPOINT_URL else None,
+    )
 )
 
 def public_url(key: str) -> str:
     return f"https://{settings.S3_BUCKET}.s3.{settings.AWS_REGION}.amazonaws.com/{key}"
 
 
-def upload_fileobj(file_obj, key_prefix: str, extension: str = "png") -> str:
+def upload_fileobj(file_obj, key_prefix: str, extension: str = "png", content_type: str = None) -> str:
     """
     Faz upload de um file-like object para S3, retornando o key gerado com extensão.
     """
@@ -27,7 +31,7 @@ def upload_fileobj(file_obj, key_prefix: str, extension: str = "png") -> str:
         settings.S3_BUCKET,
         key,
         ExtraArgs={
-            "ContentType": f"image/{extension}"
+            "ContentType": content_type or f"image/{extension}"
         }
     )
     return key
@@ -1,6 +1,8 @@
 import os
 import asyncio
+import signal
 import json
+import math
 import time
 import structlog
 import tempfile
@@ -8,14 +10,64 @@ from io import BytesIO
 from datetime import datetime
 
 from core.config import settings
+from core.metrics import (metrics, JOBS_TOTAL, SMS_TOTAL, QUEUE_DEPTH, JOBS_IN_FLIGHT, HEALTHY_SERVERS,
+                          WORKFLOW_SECONDS, COLD_STARTS_TOTAL, WARM_SERVERS, JOB_FAILURES_TOTAL,
+                          LANE_QUEUE_DEPTH, LANE_WAIT_SECONDS, series_key)
 from core.multi_comfyui_api import MultiComfyUiAPI
 from core.redis import redis
+from core import admission, archive, failures, jobstore, servers, stats
+from core.tracing import tracer
+from core.imaging import ImageEncoder, parse_renditions
+from core.lanes import DEFAULT_LANE, LaneScheduler
+from core.warmup import WarmupTracker
+from core.workflow import parse_weights
 from utils.sms import send_sms_download_message
 from utils.s3 import upload_fileobj, s3_client, create_presigned_download
 
 
 log = structlog.get_logger()
 
+WORKFLOW_WEIGHTS_KEY = "workflow:weights"
+WORKFLOW_VERSIONS_KEY = "workflow:versions"
+# zset request_id -> instante (epoch) em que o job em processamento vence
+DEADLINES_KEY = "jobs:deadlines"
+# intervalo máximo entre verificações do timer de prazos, em segundos
+DEADLINE_MAX_SLEEP = 5.0
+# pedidos do /api/cancel, consumidos a cada ciclo do worker
+TERMINAL_STATUSES = ("done", "error", "cancelled")
+# intervalo entre consultas à ComfyUI de um job retomado após o restart
+RECOVERY_POLL_SECONDS = 1.0
+
+
+class JobRun:
+    """
+    Estado de um job durante o processamento: span, tempos e a versão de
+    workflow resolvida. Compartilhado entre o caminho de um job e o de lote.
+    """
+
+    def __init__(self, span, job_data: dict, request_id: str, input_path: str, attempt, batch_size: int = 1):
+        self.span = span
+        self.job_data = job_data
+        self.request_id = request_id
+        self.input_path = input_path
+        self.attempt = attempt
+        self.batch_size = batch_size
+        self.durations = {}
+        self.timestamps = {"proc_start": time.time()}
+        self.stages = {}
+        self.workflow = None
+        self.cold = False
+        self.bio = None
+        self.server = None
+        self.prompt_id = None
+        # "timeout" (timer de prazos) ou "cancelled" (/api/cancel): o resultado, se ainda vier, é descartado
+        self.abandoned = None
+        # resultado já gravado: uma falha depois disso (ex.: SMS) não muda o status
+        self.done = False
+        # job retomado após um restart do worker: o resultado veio do /history
+        self.recovered = False
+
+
 class Worker:
 
     def __init__(self, server_list):
@@ -30,158 +82,708 @@ class Worker:
         )
         self.queued_jobs = {}
         self.servers_in_use = set()
+        self._workflows_published = False
+        self.warmup = WarmupTracker(settings.WARMUP_IDLE_SECONDS, settings.WARMUP_RETRY_SECONDS)
+        # servidores com job despachado por este worker e ainda não finalizado
+        self.active_servers = set()
+        self._last_idle_check = 0.0
+        self.batch_workflow_sizes = {k: int(v) for k, v in parse_weights(settings.BATCH_WORKFLOW_SIZES).items()}
+        self.batch_server_sizes = {k: int(v) for k, v in parse_weights(settings.BATCH_SERVER_SIZES).items()}
+        # jobs deste worker entre o processing e o fim, para o timer de prazos
+        self.running = {}
+        self._deadline_wakeup = asyncio.Event()
+        self.encoder = ImageEncoder(settings.OUTPUT_ENCODING, settings.OUTPUT_QUALITY, settings.IMAGE_WORKERS,
+                                    parse_renditions(settings.OUTPUT_RENDITIONS),
+                                    watermark=settings.POSTPROCESS_WATERMARK_PATH)
+        # tarefas disparadas pelo loop (jobs, lotes, aquecimento), aguardadas no desligamento
+        self.tasks = set()
+        self._stopping = asyncio.Event()
+        self._published_backlog = None
+        self.lanes = LaneScheduler.from_settings()
+        # faixas com gauge publicado, para zerar as que esvaziaram
+        self._lane_gauges = set()
+        self._last_archive = 0.0
+        # servidores da configuração, registrados como estáticos na subida
+        self.seed_servers = [s for s in server_list if s]
+        self.server_capabilities = {}
+        # fora do despacho (drenagem ou remoção) com jobs ainda rodando
+        self.draining_servers = set()
+        self._last_server_refresh = 0.0
 
-    def get_earliest_job(self, queued_jobs):
-        min_date = None
-        min_job_id = None
+    def get_earliest_job(self, queued_jobs, server_address=None):
+        """
+        Próximo job da fila: a faixa sai do LaneScheduler (prioridade estrita,
+        depois divisão por peso) e, dentro dela, o job mais antigo. Com
+        `server_address`, pula os jobs que falharam nesse servidor, a menos
+        que falharam em todos os saudáveis.
+        """
+        healthy = set(getattr(self.api, "healthy_servers", None) or ())
+        heads = {}
         for v in queued_jobs.values():
+            avoid = v.get("avoid") or ()
+            if server_address in avoid and not healthy <= set(avoid):
+                continue
+            lane = v.get("lane") or DEFAULT_LANE
             date = v["created_at"]
-            if not min_date or date < min_date:
-                min_date = date
-                min_job_id = v["job_id"]
+            if lane not in heads or date < heads[lane][0]:
+                heads[lane] = (date, v["job_id"])
+
+        lane = self.lanes.pick({lane: head[0] for lane, head in heads.items()})
+        return heads[lane][1] if lane else None
 
-        return min_job_id
+    @staticmethod
+    def _queue_entry(request_id, job_data: dict) -> dict:
+        return {"job_id": request_id,
+                "created_at": job_data.get("created_at") or job_data.get("enqueued_at", ""),
+                "input": job_data.get("input", ""),
+                "lane": job_data.get("lane") or DEFAULT_LANE,
+                "avoid": _split(job_data.get("avoid_servers"))}
 
     async def process_one_job(self, server_address, request_id, input_path):
         log.info("worker.job_popped", server_address=server_address, request_id=request_id, input_path=input_path)
 
-        attempt = await redis.hget(f"job:{request_id}", "attempt")
-        if not attempt:
-            attempt = 1
+        run = None
+        try:
+            job_data = await redis.hgetall(jobstore.job_key(request_id))
+            attempt = job_data.get("attempt") or 1
+            trace_ctx = {"trace_id": job_data.get("trace_id"), "span_id": job_data.get("trace_parent")}
 
-        # marca como processing
-        now = datetime.now().isoformat()
-        await redis.hset(f"job:{request_id}",
-                         mapping={"status": "processing",
-                                  "input": input_path,
-                                  "attempt": attempt,
-                                  "proc_start_at": now})
+            span = tracer.start_span("worker.process_job", parent=trace_ctx,
+                                     request_id=request_id, server=server_address, attempt=attempt)
+            run = JobRun(span, job_data, request_id, input_path, attempt)
+            with span:
+                await self._run_job(run, server_address)
+        finally:
+            await self._release([run] if run else [], server_address)
+            await tracer.flush()
 
-        # faz download da imagem de entrada do S3
-        obj = s3_client.get_object(Bucket=settings.S3_BUCKET, Key=input_path)
-        body = obj["Body"].read()
-        bio = BytesIO(body)
+    async def _run_job(self, run, server_address):
+        try:
+            prepared = await self._prepare_job(run, server_address)
+        except Exception as e:
+            await self._fail_job(run, e)
+            return
+        if not prepared or run.abandoned:
+            return
 
         start = time.time()
         try:
-            await redis.hset(f"job:{request_id}", mapping={"server": server_address})
             # Run generate_image_buffer in a background thread
-            out = await asyncio.to_thread(self.api.generate_image_buffer, server_address, bio)
+            with tracer.start_span("comfyui.generate", run.span, server=server_address) as gen_span:
+                out = await asyncio.to_thread(self.api.generate_image_buffer, server_address, run.bio, run.stages,
+                                              gen_span.context(), run.timestamps, run.workflow,
+                                              self._on_prompt_queued([run]))
+        except Exception as e:
+            await self._fail_job(run, e)
+            return
+
+        try:
+            await self._complete_job(run, server_address, out, start)
+        except Exception as e:
+            await self._fail_job(run, e)
+
+    def batch_size(self, server_address: str = None, workflow: str = None) -> int:
+        """
+        Quantos jobs cabem num prompt: BATCH_SIZE, limitado pelos valores de
+        BATCH_SERVER_SIZES e BATCH_WORKFLOW_SIZES quando configurados.
+        """
+        size = settings.BATCH_SIZE
+        max_batch = self.server_capabilities.get(server_address, {}).get("max_batch")
+        if max_batch:
+            size = min(size, int(max_batch))
+        if server_address in self.batch_server_sizes:
+            size = min(size, self.batch_server_sizes[server_address])
+        if workflow in self.batch_workflow_sizes:
+            size = min(size, self.batch_workflow_sizes[workflow])
+        return max(size, 1)
+
+    async def process_batch(self, server_address, jobs: list):
+        """
+        Processa vários jobs num único prompt da ComfyUI. `jobs` é uma lista
+        de (request_id, input_path). Só entram no lote os jobs da mesma versão
+        de workflow do primeiro; os demais voltam para a fila em memória.
+        """
+        log.info("worker.batch_popped", server_address=server_address, size=len(jobs))
+        runs, started = [], []
+        try:
+            entries = []
+            for request_id, input_path in jobs:
+                job_data = await redis.hgetall(jobstore.job_key(request_id))
+                job_data["workflow"] = self.resolve_workflow(job_data)
+                entries.append((request_id, input_path, job_data))
+
+            leader = entries[0][2]["workflow"]
+            limit = self.batch_size(server_address, leader)
+            selected = [e for e in entries if e[2]["workflow"] == leader][:limit]
+            for request_id, input_path, job_data in entries:
+                if (request_id, input_path, job_data) not in selected:
+                    # a versão sorteada fica gravada para o job não trocar de grupo na próxima vez
+                    await jobstore.update(redis, request_id, {"workflow": job_data["workflow"]})
+                    self.queued_jobs[request_id] = self._queue_entry(request_id, {**job_data, "input": input_path})
+
+            for request_id, input_path, job_data in selected:
+                attempt = job_data.get("attempt") or 1
+                trace_ctx = {"trace_id": job_data.get("trace_id"), "span_id": job_data.get("trace_parent")}
+                span = tracer.start_span("worker.process_job", parent=trace_ctx, request_id=request_id,
+                                         server=server_address, attempt=attempt, batch_size=len(selected))
+                run = JobRun(span, job_data, request_id, input_path, attempt, batch_size=len(selected))
+                started.append(run)
+                try:
+                    if await self._prepare_job(run, server_address):
+                        runs.append(run)
+                    else:
+                        span.end()
+                except Exception as e:
+                    await self._fail_job(run, e)
+                    span.end()
+
+            if not runs:
+                return
+
+            start = time.time()
+            stages, timestamps = {}, {}
+            gen_spans = [tracer.start_span("comfyui.generate", run.span, server=server_address,
+                                           batch_size=len(runs)) for run in runs]
+            try:
+                outputs = await asyncio.to_thread(self.api.generate_image_batch, server_address,
+                                                  [run.bio for run in runs], stages,
+                                                  [gen_span.context() for gen_span in gen_spans], timestamps,
+                                                  leader, self._on_prompt_queued(runs))
+            except Exception as e:
+                outputs = [e] * len(runs)
+            finally:
+                for gen_span in gen_spans:
+                    gen_span.end()
+
+            for run, out in zip(runs, outputs):
+                if isinstance(out, Exception):
+                    await self._fail_job(run, out)
+                    continue
+                run.stages.update(stages)
+                run.timestamps.update(timestamps)
+                try:
+                    await self._complete_job(run, server_address, out, start)
+                except Exception as e:
+                    await self._fail_job(run, e)
+        finally:
+            for run in runs:
+                run.span.end()
+            await self._release(started, server_address)
+            await tracer.flush()
+
+    def spawn(self, coro) -> asyncio.Task:
+        """
+        Cria a tarefa guardando a referência até ela terminar: o event loop só
+        mantém referências fracas, e o desligamento precisa esperar por elas.
+        """
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def stop(self):
+        """
+        Pedido de desligamento (SIGTERM/SIGINT): o loop para de despachar jobs
+        e espera os em andamento por até SHUTDOWN_GRACE_SECONDS.
+        """
+        if not self._stopping.is_set():
+            log.info("worker.draining", in_flight=len(self.tasks), grace=settings.SHUTDOWN_GRACE_SECONDS)
+            self._stopping.set()
+
+    async def recover_jobs(self):
+        """
+        Na subida, retoma os jobs que ficaram em processing quando o worker
+        anterior caiu: cada um é acompanhado no servidor dono pelo prompt_id
+        gravado no hash, e a imagem de quem já terminou é coletada do
+        /history em vez de gerada de novo. Há um único worker por fila, então
+        todo job em processing na subida é órfão.
+        """
+        async for request_id, job in jobstore.query(redis, ("processing",)):
+            self.spawn(self._recover_job(request_id, job))
+
+    async def _recover_job(self, request_id, job: dict):
+        server, prompt_id = job.get("server"), job.get("prompt_id")
+        if not server or not prompt_id:
+            # o worker caiu antes de o prompt chegar à ComfyUI
+            await self._requeue(request_id, "not_submitted")
+            return
+
+        trace_ctx = {"trace_id": job.get("trace_id"), "span_id": job.get("trace_parent")}
+        span = tracer.start_span("worker.recover_job", parent=trace_ctx, request_id=request_id, server=server,
+                                 prompt_id=prompt_id)
+        run = JobRun(span, job, request_id, job.get("input", ""), job.get("attempt") or 1,
+                     batch_size=int(job.get("batch_size") or 1))
+        run.server, run.prompt_id, run.recovered = server, prompt_id, True
+        run.workflow = self.resolve_workflow(job)
+        self.running[request_id] = run
+        self.active_servers.add(server)
+        # o prazo continua o do worker anterior
+        await redis.zadd(DEADLINES_KEY, {request_id: float(job.get("deadline_at") or 0)
+                                         or time.time() + settings.JOB_TIMEOUT})
+        self._deadline_wakeup.set()
+        try:
+            with span:
+                out = await self._await_recovered(run)
+                if out is not None and not run.abandoned:
+                    proc_start = job.get("proc_start_at")
+                    start = datetime.fromisoformat(proc_start).timestamp() if proc_start else time.time()
+                    await self._complete_job(run, server, out, start)
+        except Exception as e:
+            await self._fail_job(run, e)
+        finally:
+            await self._release([run], server)
+            await tracer.flush()
+
+    async def _await_recovered(self, run):
+        """
+        Espera o prompt do job retomado terminar e devolve a imagem, ou None
+        se o job voltou para a fila ou falhou.
+        """
+        while True:
+            state, entry = await asyncio.to_thread(self.api.prompt_state, run.server, run.prompt_id)
+            if run.abandoned:
+                return None
+            if state not in ("running", "pending"):
+                break
+            await asyncio.sleep(RECOVERY_POLL_SECONDS)
+
+        log.info("worker.job_recovering", request_id=run.request_id, server=run.server, prompt_id=run.prompt_id,
+                 state=state)
+        if state == "lost":
+            await self._requeue(run.request_id, "prompt_lost")
+            return None
+        if state == "error":
+            await self._fail_job(run, failures.ServerError("Execução falhou na ComfyUI durante o restart do worker"))
+            return None
+        try:
+            return await asyncio.to_thread(self.api.collect_outputs, run.server, entry, run.workflow,
+                                           int(run.job_data.get("batch_index") or 0), run.batch_size)
+        except Exception as e:
+            # saída só pelo WebSocket (fora do /history) ou imagem já removida: gera de novo
+            log.warning("worker.recovery_collect_failed", request_id=run.request_id, error=str(e))
+            await self._requeue(run.request_id, "output_unavailable")
+            return None
+
+    async def _requeue(self, request_id, reason: str):
+        """
+        Devolve à fila, sem gastar tentativa, um job interrompido pelo restart.
+        """
+        await jobstore.transition(redis, request_id, "queued", {"enqueued_at": datetime.utcnow().isoformat()})
+        log.info("worker.job_requeued", request_id=request_id, reason=reason)
+
+    def _on_prompt_queued(self, runs: list):
+        """
+        Callback chamado pela thread da ComfyUI quando o prompt é aceito:
+        guarda o prompt_id nos jobs, para o timer de prazos poder cancelá-lo.
+        """
+        loop = asyncio.get_running_loop()
+
+        def callback(prompt_id):
+            for run in runs:
+                run.prompt_id = prompt_id
+            asyncio.run_coroutine_threadsafe(self._store_prompt_id(runs, prompt_id), loop)
+        return callback
+
+    async def _store_prompt_id(self, runs: list, prompt_id: str):
+        for index, run in enumerate(runs):
+            # posição no lote: um worker reiniciado usa para achar a saída do job no /history
+            await jobstore.update(redis, run.request_id,
+                                  {"prompt_id": prompt_id, "batch_index": index, "batch_size": len(runs)})
+        if all(run.abandoned for run in runs):
+            # venceram ou foram cancelados antes de o prompt chegar à ComfyUI
+            await self.cancel_on_server(runs[0].server, prompt_id)
+
+    async def _release(self, runs: list, server_address):
+        """
+        Tira os jobs do índice de prazos e libera o servidor. Se todos já
+        foram abandonados (prazo ou cancelamento), o servidor já foi liberado
+        e pode estar com outro job.
+        """
+        for run in runs:
+            if self.running.get(run.request_id) is run:
+                del self.running[run.request_id]
+                await redis.zrem(DEADLINES_KEY, run.request_id)
+        if not runs or not all(run.abandoned for run in runs):
+            self.active_servers.discard(server_address)
+
+    async def cancel_on_server(self, server_address, prompt_id) -> str:
+        try:
+            outcome = await asyncio.to_thread(self.api.cancel_prompt, server_address, prompt_id)
+            log.info("worker.prompt_cancelled", server=server_address, prompt_id=prompt_id, outcome=outcome)
+            return outcome
         except Exception as e:
-            err = str(e)
-            log.error("worker.generate_error", request_id=request_id, error=err)
-            await redis.hset(f"job:{request_id}", mapping={"status": "failed", "error": err})
+            log.warning("worker.prompt_cancel_failed", server=server_address, prompt_id=prompt_id, error=str(e))
+            return "error"
+
+    async def _abandon(self, request_id, job: dict, reason: str):
+        """
+        Desiste de um job em processamento: tira do índice de prazos, remove
+        ou interrompe o prompt no servidor dono e libera o servidor. No lote,
+        o prompt só é removido quando nenhum outro job depende dele; até lá o
+        job só fica marcado e a saída dele é descartada.
+        """
+        await redis.zrem(DEADLINES_KEY, request_id)
+        run = self.running.pop(request_id, None)
+        server = (run.server if run else None) or job.get("server")
+        prompt_id = (run.prompt_id if run else None) or job.get("prompt_id")
+        if run is not None:
+            run.abandoned = reason
+            run.span.set_attribute("abandoned", reason)
+
+        if server and prompt_id:
+            if any(r.prompt_id == prompt_id for r in self.running.values()):
+                log.info("worker.batch_member_abandoned", request_id=request_id, server=server,
+                         prompt_id=prompt_id, reason=reason)
+            else:
+                await self.cancel_on_server(server, prompt_id)
+        # no lote, o servidor só fica livre quando todos os jobs do prompt forem abandonados
+        if server and not any(r.server == server for r in self.running.values()):
+            self.active_servers.discard(server)
+        return server, prompt_id
+
+    async def expire_job(self, request_id):
+        """
+        Job que passou do prazo: interrompe/remove o prompt no servidor dono,
+        libera o servidor e trata o prazo vencido como falha do servidor
+        (nova tentativa em outro servidor, ou dead-letter).
+        """
+        await redis.zrem(DEADLINES_KEY, request_id)
+        job = await redis.hgetall(jobstore.job_key(request_id))
+        if job.get("status") != "processing":
+            return
+        server, prompt_id = await self._abandon(request_id, job, "timeout")
+        log.warning("worker.job_expired", request_id=request_id, server=server, prompt_id=prompt_id,
+                    timeout=settings.JOB_TIMEOUT)
+        metrics.inc(JOBS_TOTAL, status="timeout")
+        await self.handle_failure(request_id, job.get("attempt"), server,
+                                  failures.ServerError("Timeout while processing"))
+
+    async def check_for_cancellations(self):
+        while True:
+            request_id = await jobstore.claim_cancel(redis)
+            if request_id is None:
+                break
+            await self.cancel_job(request_id)
+
+    async def cancel_job(self, request_id):
+        """
+        Cancelamento pedido pelo /api/cancel: tira o job da fila em memória
+        ou, se já estiver rodando, interrompe o prompt e devolve o servidor
+        para o próximo job. O job termina com status "cancelled".
+        """
+        job = await redis.hgetall(jobstore.job_key(request_id))
+        if not job or job.get("status") in TERMINAL_STATUSES:
+            return
+        self.queued_jobs.pop(request_id, None)
+        await redis.zrem(failures.RETRIES_KEY, request_id)
+        server = None
+        if job.get("status") == "processing" or request_id in self.running:
+            server, _ = await self._abandon(request_id, job, "cancelled")
+        await jobstore.transition(redis, request_id, "cancelled", {"cancelled_at": datetime.now().isoformat()})
+        metrics.inc(JOBS_TOTAL, status="cancelled")
+        log.info("worker.job_cancelled", request_id=request_id, previous_status=job.get("status"), server=server)
+
+    async def enforce_deadlines(self) -> float:
+        """
+        Expira os jobs vencidos e retorna quantos segundos faltam para o
+        próximo prazo (no máximo DEADLINE_MAX_SLEEP).
+        """
+        for request_id in await redis.zrangebyscore(DEADLINES_KEY, "-inf", time.time()):
+            await self.expire_job(request_id)
+        earliest = await redis.zrange(DEADLINES_KEY, 0, 0, withscores=True)
+        if not earliest:
+            return DEADLINE_MAX_SLEEP
+        return min(max(earliest[0][1] - time.time(), 0.05), DEADLINE_MAX_SLEEP)
+
+    async def deadline_timer(self):
+        """
+        Dorme até o próximo prazo do índice (ou até um prazo novo ser
+        registrado) e expira os jobs vencidos, sem varrer os hashes de job.
+        """
+        while True:
+            self._deadline_wakeup.clear()
+            try:
+                timeout = await self.enforce_deadlines()
+            except Exception as e:
+                log.warning("worker.deadline_error", error=str(e))
+                timeout = DEADLINE_MAX_SLEEP
+            try:
+                await asyncio.wait_for(self._deadline_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def resolve_workflow(self, job_data) -> str:
+        # versão do workflow: a pedida no upload, a sorteada numa tentativa anterior ou um novo sorteio
+        return job_data.get("workflow") or self.api.workflows.choose()
+
+    async def _prepare_job(self, run, server_address) -> bool:
+        """
+        Marca o job como processing, resolve a versão do workflow e baixa a
+        imagem de entrada. Retorna False se o job foi encerrado aqui.
+        """
+        span, request_id = run.span, run.request_id
+        if run.job_data.get("status") == "cancelled":
+            # cancelado entre o despacho e o início
+            log.info("worker.cancelled_job_skipped", request_id=request_id)
+            return False
+        enqueued_at = run.job_data.get("enqueued_at")
+        if enqueued_at:
+            enqueued = datetime.fromisoformat(enqueued_at)
+            wait = max((datetime.utcnow() - enqueued).total_seconds(), 0.0)
+            metrics.observe_stage("queue_wait", wait)
+            metrics.observe(LANE_WAIT_SECONDS, wait, lane=run.job_data.get("lane") or DEFAULT_LANE)
+            run.durations["queue_wait"] = wait
+            now_ts = time.time()
+            tracer.record_span("queue.wait", span, start=now_ts - wait, end=now_ts)
+
+        # marca como processing e registra o prazo do job
+        now = datetime.now().isoformat()
+        deadline = time.time() + settings.JOB_TIMEOUT
+        run.server = server_address
+        self.running[request_id] = run
+        await jobstore.transition(redis, request_id, "processing",
+                                  {"input": run.input_path,
+                                   "attempt": run.attempt,
+                                   "proc_start_at": now,
+                                   "deadline_at": round(deadline, 3)})
+        await redis.zadd(DEADLINES_KEY, {request_id: deadline})
+        self._deadline_wakeup.set()
+
+        run.workflow = self.resolve_workflow(run.job_data)
+        if run.workflow not in self.api.workflows.versions:
+            log.error("worker.unknown_workflow", request_id=request_id, workflow=run.workflow)
+            await jobstore.transition(redis, request_id, "error", {"error": f"Workflow desconhecido: {run.workflow}"})
+            metrics.inc(JOBS_TOTAL, status="error")
+            return False
+        span.set_attribute("workflow", run.workflow)
+
+        # job em servidor frio inclui a carga dos modelos; não entra no modelo de ETA
+        run.cold = not self.warmup.is_warm(server_address)
+        if run.cold:
+            span.set_attribute("cold_start", True)
+            metrics.inc(COLD_STARTS_TOTAL, server=server_address)
+
+        # faz download da imagem de entrada do S3
+        with tracer.start_span("s3.download_input", span, key=run.input_path):
+            obj = s3_client.get_object(Bucket=settings.S3_BUCKET, Key=run.input_path)
+            body = obj["Body"].read()
+            run.bio = BytesIO(body)
+
+        await jobstore.update(redis, request_id, {"server": server_address, "workflow": run.workflow})
+        return True
+
+    async def _fail_job(self, run, error: Exception):
+        if run.abandoned:
+            # o timer de prazos ou o cancelamento já gravaram o status final
+            return
+        err = str(error)
+        run.span.record_error(error)
+        if run.done:
+            log.error("worker.post_done_error", request_id=run.request_id, error=err)
+            return
+        log.error("worker.generate_error", request_id=run.request_id, error=err)
+        metrics.inc(JOBS_TOTAL, status="failed")
+        await self.handle_failure(run.request_id, run.attempt, run.server, error)
+
+    async def handle_failure(self, request_id, attempt, server, error: Exception):
+        """
+        Classifica a falha (core.failures) e decide o destino do job: nova
+        tentativa agendada com backoff e jitter, evitando o servidor que
+        falhou, ou status error e dead-letter queue quando não adianta repetir
+        ou as tentativas acabaram.
+        """
+        attempt = int(attempt or 1)
+        fault, retryable = failures.classify(error)
+        metrics.inc(JOB_FAILURES_TOTAL, fault=fault, retryable=str(retryable).lower())
+
+        if retryable and attempt < settings.RETRY_MAX_ATTEMPTS:
+            delay = failures.retry_delay(attempt, settings.RETRY_BASE_DELAY, settings.RETRY_MAX_DELAY)
+            retry_at = time.time() + delay
+            mapping = {"attempt": attempt + 1, "error": str(error), "fault": fault, "retry_at": round(retry_at, 3)}
+            if fault == failures.SERVER and server:
+                avoid = _split(await jobstore.field(redis, request_id, "avoid_servers"))
+                if server not in avoid:
+                    mapping["avoid_servers"] = ",".join(avoid + [server])
+            await jobstore.transition(redis, request_id, "retrying", mapping)
+            await redis.zadd(failures.RETRIES_KEY, {request_id: retry_at})
+            log.warning("worker.job_retry_scheduled", request_id=request_id, attempt=attempt, fault=fault,
+                        server=server, delay=round(delay, 2), error=str(error))
+            return
+
+        await jobstore.transition(redis, request_id, "error", {"error": str(error), "fault": fault})
+        await failures.dead_letter(redis, request_id, error=str(error), fault=fault, retryable=retryable,
+                                   attempt=attempt, server=server or "")
+        metrics.inc(JOBS_TOTAL, status="error")
+        log.error("worker.job_dead_lettered", request_id=request_id, attempt=attempt, fault=fault,
+                  server=server, error=str(error))
+
+    async def release_retries(self):
+        """
+        Devolve à fila os jobs cuja espera de nova tentativa já passou.
+        """
+        for request_id in await redis.zrangebyscore(failures.RETRIES_KEY, "-inf", time.time()):
+            await redis.zrem(failures.RETRIES_KEY, request_id)
+            if await jobstore.field(redis, request_id, "status") != "retrying":
+                # cancelado ou reprocessado enquanto esperava
+                continue
+            await jobstore.transition(redis, request_id, "queued", {"enqueued_at": datetime.utcnow().isoformat()})
+
+    async def _complete_job(self, run, server_address, out, start):
+        """
+        Envia a imagem gerada ao S3, registra métricas e estatísticas, marca o
+        job como done e manda o SMS, se houver telefone.
+        """
+        request_id, span, timestamps, durations = run.request_id, run.span, run.timestamps, run.durations
+        if run.abandoned:
+            log.warning("worker.abandoned_result_dropped", request_id=request_id, server=server_address,
+                        reason=run.abandoned)
             return
 
-        # volta o ponteiro pra leitura
-        out.seek(0)
+        self.warmup.mark_used(server_address)
+        for stage, seconds in run.stages.items():
+            metrics.observe_stage(stage, seconds)
+
+        # moldura, versão completa e rendições, geradas fora do event loop
+        version = self.api.workflows.versions.get(run.workflow)
+        frame = version.frame if version else None
+        encode_start = time.time()
+        with tracer.start_span("image.renditions", span, format=self.encoder.format,
+                               renditions=",".join(self.encoder.renditions), frame=bool(frame)):
+            renditions = await self.encoder.render(out.getvalue(), frame)
+        durations["encode"] = time.time() - encode_start
+        metrics.observe_stage("encode", durations["encode"])
 
-        # envia a saída pra S3
-        s3_key = upload_fileobj(out, key_prefix=f"output/{request_id}")
-        image_url = create_presigned_download(s3_key, expires_in=86400)
+        # envia todas as rendições pra S3 em paralelo
+        s3_start = time.time()
+        with tracer.start_span("s3.upload_output", span, count=len(renditions)):
+            keys = await asyncio.gather(*(
+                asyncio.to_thread(upload_fileobj, BytesIO(body), f"output/{request_id}", extension, content_type)
+                for body, extension, content_type in renditions.values()))
+            rendition_keys = dict(zip(renditions, keys))
+            s3_key = rendition_keys["full"]
+            image_url = create_presigned_download(s3_key, expires_in=86400)
+        timestamps["s3_uploaded"] = time.time()
+        metrics.observe_stage("s3_upload", timestamps["s3_uploaded"] - s3_start)
         log.info("worker.uploaded_s3", request_id=request_id, s3_key=s3_key)
 
         duration = time.time() - start
         log.info("worker.job_done", request_id=request_id, duration=duration)
 
+        durations.update(run.stages)
+        durations["s3_upload"] = timestamps["s3_uploaded"] - s3_start
+        durations["total"] = duration
+        if run.recovered or run.cold or run.batch_size > 1:
+            # amostras retomadas, frias e de lote ficam em métricas próprias (cold_total, batch_total, ...)
+            prefix = "recovered" if run.recovered else "cold" if run.cold else "batch"
+            for name in ("execution", "total"):
+                if name in durations:
+                    durations[f"{prefix}_{name}"] = durations.pop(name)
+        else:
+            metrics.observe(WORKFLOW_SECONDS, duration, workflow=run.workflow)
+        await stats.record(redis, durations, server=server_address, workflow=run.workflow)
+
         # atualiza média móvel
-        prev_avg = float(await redis.get("avg_processing_time") or duration)
-        new_avg = prev_avg * 0.8 + duration * 0.2
-        await redis.set("avg_processing_time", new_avg)
-        log.info("worker.avg_updated", new_avg=new_avg)
+        if not (run.recovered or run.cold) and run.batch_size == 1:
+            prev_avg = float(await redis.get("avg_processing_time") or duration)
+            new_avg = prev_avg * 0.8 + duration * 0.2
+            await redis.set("avg_processing_time", new_avg)
+            log.info("worker.avg_updated", new_avg=new_avg)
 
-        # grava resultado final
-        await redis.hset(f"job:{request_id}", mapping={"status": "done", "output": image_url})
+        # grava resultado final, junto com o instante de fim de cada etapa
+        timestamps["done"] = time.time()
+        result = {"output": image_url, "output_key": s3_key,
+                  "renditions": json.dumps(rendition_keys), "workflow": run.workflow, "cold_start": int(run.cold),
+                  "batch_size": run.batch_size}
+        result.update({f"ts_{name}": round(ts, 3) for name, ts in timestamps.items()})
+        await jobstore.transition(redis, request_id, "done", result, ts=timestamps["done"])
+        run.done = True
+        metrics.inc(JOBS_TOTAL, status="done")
         log.info("worker.job_finished", request_id=request_id, image_url=image_url)
 
         # se tiver telefone, manda SMS síncrono
-        phone = await redis.hget(f"job:{request_id}", "phone")
+        phone = await jobstore.field(redis, request_id, "phone")
         if phone:
-            sent = send_sms_download_message(f"https://apostenaquinadesaojoao.com.br/meumamulengo.html?image_id={request_id}", phone)
-            await redis.hset(f"job:{request_id}", "sms_status", "sent" if sent else "failed")
+            sms_start = time.time()
+            with tracer.start_span("sms.send", span):
+                sent = send_sms_download_message(f"https://apostenaquinadesaojoao.com.br/meumamulengo.html?image_id={request_id}", phone)
+            metrics.observe_stage("sms", time.time() - sms_start)
+            metrics.inc(SMS_TOTAL, result="sent" if sent else "failed")
+            await jobstore.update(redis, request_id, {"sms_status": "sent" if sent else "failed"})
             log.info("worker.sms_sent", request_id=request_id, phone=phone, success=sent)
         else:
             log.info("worker.no_phone", request_id=request_id)
 
     async def check_for_new_jobs(self):
         while True:
-            raw = await redis.rpop("submissions_queue")
-            if raw is None:
+            job = await jobstore.claim(redis)
+            if job is None:
                 break
-            job = json.loads(raw)
             request_id = job["id"]
             input_path = job["input"]
             now = datetime.utcnow().isoformat()
-            await redis.hset(f"job:{request_id}",
-                             mapping={"status": "queued", "input": input_path,
-                                      "attempt": 1, "enqueued_at": now})
+            mapping = {"input": input_path, "attempt": 1, "enqueued_at": now}
+            trace = job.get("trace") or {}
+            if trace.get("trace_id"):
+                mapping["trace_id"] = trace["trace_id"]
+                mapping["trace_parent"] = trace.get("span_id", "")
+            await jobstore.transition(redis, request_id, "queued", mapping)
 
     async def process_jobs(self):
         matching_statuses = {"processing", "queued", "failed"}
         self.servers_in_use.clear()
 
-        async for key in redis.scan_iter("job:*"):
-            job_data = await redis.hgetall(key)
-            status = job_data.get("status", b"")
-            request_id = key[4:]
-
-            if status in matching_statuses:
-                log.debug(f"Job ID: {key}")
-                for k, v in job_data.items():
-                    log.debug(f"  {k}: {v}")
-
-                if status == "queued":
-                    if request_id not in self.queued_jobs:
-                        created_at = job_data.get("created_at", "")
-                        input = job_data.get("input", "")
-                        self.queued_jobs[request_id] = ({
-                            "job_id": request_id,
-                            "created_at": created_at,
-                            "input": input
-                        })
-
-                elif status == "failed":
-                    attempt = int(job_data["attempt"]) + 1
-                    if attempt <= 3:
-                        await redis.hset(f"job:{request_id}",
-                                         mapping={"status": "queued", "attempt": attempt})
-                    else:
-                        await redis.hset(f"job:{request_id}", mapping={"status": "error"})
-
-                elif status == "processing":
-                    server = job_data.get("server", "")
-                    self.servers_in_use.add(server)
-                    proc_start_at = job_data.get("proc_start_at", "")
-                    # se estiver vazio, usa agora para que duration seja zero
-                    dt_proc_start_at = (
-                        datetime.fromisoformat(proc_start_at)
-                        if proc_start_at
-                        else datetime.utcnow()
-                    )
-                    duration = datetime.now() - dt_proc_start_at
-                    if duration.total_seconds() > 300:
-                        await redis.hset(
-                            f"job:{request_id}",
-                            mapping={"status": "failed", "error": "Timeout while processing"},
-                        )
-
-                log.debug("-" * 40)
+        async for request_id, job_data in jobstore.query(redis, matching_statuses):
+            status = job_data.get("status")
+            log.debug(f"Job ID: {request_id}")
+            for k, v in job_data.items():
+                log.debug(f"  {k}: {v}")
+
+            if status == "queued":
+                if request_id not in self.queued_jobs:
+                    self.queued_jobs[request_id] = self._queue_entry(request_id, job_data)
+
+            elif status == "failed":
+                # gravado por um worker anterior às novas tentativas com backoff
+                await self.handle_failure(request_id, job_data.get("attempt"), job_data.get("server"),
+                                          failures.ServerError(job_data.get("error", "")))
+
+            elif status == "processing":
+                # o prazo de cada job é vigiado pelo deadline_timer
+                server = job_data.get("server", "")
+                self.servers_in_use.add(server)
+
+            log.debug("-" * 40)
 
     async def activate_queued_jobs(self):
         # check if there are available servers to process the jobs
 
         earliest_job_id = self.get_earliest_job(self.queued_jobs)
         if not earliest_job_id:
-            return
+            # fila vazia: só consulta os servidores de tempos em tempos, para aquecer os frios
+            if not settings.WARMUP_ENABLED or time.monotonic() - self._last_idle_check < settings.WARMUP_CHECK_INTERVAL:
+                return
+            self._last_idle_check = time.monotonic()
 
         available_servers = await self.api.get_available_server_addresses()
+        for server_address, status in self.api.server_status.items():
+            self.warmup.observe(server_address, status)
 
-        for available_server in available_servers:
-            if available_server in self.servers_in_use:
-                continue
+        # servidores quentes primeiro; os que estão aquecendo ficam de fora
+        idle_servers = [s for s in self.warmup.order(available_servers)
+                        if s not in self.servers_in_use and s not in self.active_servers
+                        and s not in self.warmup.warming]
+        used = set()
+
+        for index, available_server in enumerate(idle_servers):
+            # com lote, divide a fila entre os servidores livres em vez de lotar o primeiro
+            remaining = len(idle_servers) - index
+            take = min(self.batch_size(available_server), max(1, math.ceil(len(self.queued_jobs) / remaining)))
 
-            earliest_job_id = self.get_earliest_job(self.queued_jobs)
-            if earliest_job_id:
+            jobs = []
+            while len(jobs) < take:
+                earliest_job_id = self.get_earliest_job(self.queued_jobs, available_server)
+                if not earliest_job_id:
+                    break
                 earliest = self.queued_jobs[earliest_job_id]
                 request_id = earliest["job_id"]
                 input_path = earliest["input"]
@@ -190,49 +792,254 @@ class Worker:
                 if not input_path or len(input_path) == 0:
                     log.warn(f"Input path is empty - request_id:'{request_id}'")
                     self.queued_jobs.pop(request_id)
-                    await redis.hset(f"job:{request_id}", mapping={"status": "error", "error": "No input path"})
+                    await jobstore.transition(redis, request_id, "error", {"error": "No input path"})
                     continue
 
                 log.debug(f"Process Job: {request_id} - {input_path}")
                 self.queued_jobs.pop(request_id)
+                self.lanes.charge(earliest.get("lane") or DEFAULT_LANE)
+                jobs.append((request_id, input_path))
 
+            if not jobs:
+                # o que restou na fila falhou neste servidor; tenta o próximo
+                continue
+
+            self.active_servers.add(available_server)
+            used.add(available_server)
+            if len(jobs) == 1:
                 # Run process_one_job in a thread
-                asyncio.create_task(self.process_one_job(available_server, request_id, input_path))
+                self.spawn(self.process_one_job(available_server, *jobs[0]))
             else:
-                break
+                self.spawn(self.process_batch(available_server, jobs))
+
+        # o que sobrou livre e está frio recebe um prompt de aquecimento
+        if settings.WARMUP_ENABLED:
+            for server_address in idle_servers:
+                if server_address not in used and self.warmup.needs_warmup(server_address):
+                    self.spawn(self.warm_up_server(server_address))
+
+    async def warm_up_server(self, server_address):
+        """
+        Envia o prompt de aquecimento para um servidor frio, fora do fluxo de
+        jobs, e o marca como quente se a execução terminar.
+        """
+        self.warmup.start_warming(server_address)
+        ok = False
+        log.info("worker.warmup_start", server=server_address)
+        try:
+            image_path = settings.WARMUP_IMAGE_PATH or os.path.join(settings.STATIC_DIR, "sample.jpg")
+            # servidor que aceita o prompt e não responde não pode prender o aquecimento
+            seconds = await asyncio.wait_for(asyncio.to_thread(self.api.warm_up, server_address, image_path),
+                                             settings.JOB_TIMEOUT)
+            metrics.observe_stage("warmup", seconds)
+            log.info("worker.warmup_done", server=server_address, seconds=seconds)
+            ok = True
+        except asyncio.TimeoutError:
+            log.warning("worker.warmup_timeout", server=server_address, timeout=settings.JOB_TIMEOUT)
+        except Exception as e:
+            log.warning("worker.warmup_failed", server=server_address, error=str(e))
+        finally:
+            self.warmup.finish_warming(server_address, ok)
+
+    async def publish_backlog(self):
+        """
+        Grava o tamanho da fila em memória para o controle de admissão da
+        API, só quando muda.
+        """
+        backlog = len(self.queued_jobs)
+        if backlog != self._published_backlog:
+            await redis.set(admission.BACKLOG_KEY, backlog)
+            self._published_backlog = backlog
+
+    async def archive_jobs(self):
+        """
+        A cada ARCHIVE_INTERVAL, arquiva os jobs finalizados há mais de
+        JOB_RETENTION_SECONDS e põe TTL nos hashes, para o Redis e a
+        varredura do process_jobs não crescerem durante a campanha.
+        """
+        if archive.job_archive is None or time.monotonic() - self._last_archive < settings.ARCHIVE_INTERVAL:
+            return
+        self._last_archive = time.monotonic()
+        try:
+            await archive.archive_finished(redis, archive.job_archive, settings.JOB_RETENTION_SECONDS,
+                                           settings.ARCHIVED_JOB_TTL)
+        except Exception as e:
+            log.warning("worker.archive_error", error=str(e))
+
+    async def refresh_servers(self, force: bool = False):
+        """
+        A cada SERVER_REFRESH_INTERVAL, lê o registro de servidores e troca a
+        lista de despacho pelos vivos e fora de drenagem. Quem sai da lista
+        (drenagem, remoção ou heartbeat vencido) não recebe jobs novos, mas
+        os que já estão nele terminam normalmente.
+        """
+        if not force and time.monotonic() - self._last_server_refresh < settings.SERVER_REFRESH_INTERVAL:
+            return
+        self._last_server_refresh = time.monotonic()
+        try:
+            fleet = await servers.fleet(redis, settings.SERVER_HEARTBEAT_TTL)
+            await servers.reap(redis, fleet, settings.SERVER_REAP_SECONDS)
+        except Exception as e:
+            log.warning("worker.server_refresh_error", error=str(e))
+            return
+
+        active = servers.dispatchable(fleet)
+        previous = {s for s in self.api.server_address_list if s}
+        for server in sorted(set(active) - previous):
+            log.info("worker.server_added", server=server, capabilities=fleet[server]["capabilities"])
+        for server in sorted(previous - set(active)):
+            info = fleet.get(server)
+            reason = "removed" if info is None else "draining" if info["draining"] else "heartbeat_expired"
+            log.info("worker.server_removed", server=server, reason=reason)
+            self.draining_servers.add(server)
+        self.api.server_address_list = active
+        self.server_capabilities = {url: info["capabilities"] for url, info in fleet.items()}
+        for server, caps in self.server_capabilities.items():
+            if caps.get("output") == "http":
+                self.api.http_only_servers.add(server)
+
+        in_flight = {}
+        for run in self.running.values():
+            if run.server:
+                in_flight[run.server] = in_flight.get(run.server, 0) + 1
+        for server in sorted(self.draining_servers - set(in_flight)):
+            log.info("worker.server_drained", server=server)
+        self.draining_servers = {s for s in self.draining_servers if s in in_flight and s not in active}
+        # jobs por servidor, para quem drena saber quando pode desligar
+        pipe = redis.pipeline()
+        pipe.delete(servers.IN_FLIGHT_KEY)
+        if in_flight:
+            pipe.hset(servers.IN_FLIGHT_KEY, mapping=in_flight)
+        await pipe.execute()
+
+    async def report_metrics(self):
+        """
+        Atualiza os gauges da fila/servidores e envia ao Redis as métricas
+        acumuladas pelo worker.
+        """
+        if not metrics.flush_due():
+            return
+        try:
+            depths = {lane: 0 for lane in self._lane_gauges}
+            for job in self.queued_jobs.values():
+                lane = job.get("lane") or DEFAULT_LANE
+                depths[lane] = depths.get(lane, 0) + 1
+            gauges = {
+                QUEUE_DEPTH: len(self.queued_jobs),
+                JOBS_IN_FLIGHT: len(self.running),
+                HEALTHY_SERVERS: len(self.api.healthy_servers),
+                WARM_SERVERS: sum(1 for s in self.api.healthy_servers if self.warmup.is_warm(s)),
+            }
+            gauges.update({series_key(LANE_QUEUE_DEPTH, {"lane": lane}): n for lane, n in depths.items()})
+            await metrics.set_gauges(redis, gauges)
+            # faixa zerada já publicada sai da lista; volta a ser publicada se receber jobs
+            self._lane_gauges = {lane for lane, n in depths.items() if n}
+            await metrics.flush(redis)
+        except Exception as e:
+            log.warning("worker.metrics_error", error=str(e))
+
+    async def reload_workflows(self):
+        """
+        Recarrega as versões de workflow alteradas no disco, aplica os pesos de
+        rollout gravados em `workflow:weights` (se houver) e publica no Redis
+        as versões carregadas, para a API validar o campo `workflow` do upload.
+        """
+        registry = self.api.workflows
+        if not registry.reload_due():
+            return
+        try:
+            changes = registry.reload()
+            weights = await redis.hgetall(WORKFLOW_WEIGHTS_KEY)
+            registry.set_weights({name: float(w) for name, w in weights.items()})
+            if changes["loaded"] or changes["removed"] or not self._workflows_published:
+                pipe = redis.pipeline()
+                pipe.delete(WORKFLOW_VERSIONS_KEY)
+                pipe.hset(WORKFLOW_VERSIONS_KEY, mapping={
+                    name: json.dumps(version.describe()) for name, version in registry.versions.items()
+                })
+                await pipe.execute()
+                self._workflows_published = True
+        except Exception as e:
+            log.warning("worker.workflow_reload_error", error=str(e))
 
-    async def worker_loop(self):
+    async def worker_loop(self, handle_signals: bool = True):
         """
         Loop infinito que consome jobs da fila 'submissions_queue' no Redis,
         processa cada um sequencialmente, atualiza métricas e envia SMS quando
-        o usuário tiver registrado um telefone.
+        o usuário tiver registrado um telefone. Na subida retoma os jobs
+        órfãos; com SIGTERM para de despachar e espera os jobs em andamento.
+        Embutido na API (`handle_signals=False`), quem chama `stop` é o
+        lifespan do FastAPI.
         """
 
-        while True:
-            log.debug("sleep")
-            await asyncio.sleep(0.5)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT) if handle_signals else ():
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                # Windows ou fora da thread principal
+                pass
 
-            # checks if there are new jobs
-            log.debug("check_for_new_jobs")
-            await self.check_for_new_jobs()
+        deadline_task = asyncio.create_task(self.deadline_timer())
+        drain_deadline = None
+        try:
+            await servers.seed(redis, self.seed_servers)
+            await self.refresh_servers(force=True)
+            await self.recover_jobs()
+            while True:
+                log.debug("sleep")
+                await asyncio.sleep(0.5)
+
+                # checks if there are new jobs
+                log.debug("check_for_new_jobs")
+                await self.check_for_new_jobs()
+                await self.check_for_cancellations()
+                await self.release_retries()
+
+                log.debug("process_jobs")
+                await self.process_jobs()
+
+                if self._stopping.is_set():
+                    drain_deadline = drain_deadline or time.monotonic() + settings.SHUTDOWN_GRACE_SECONDS
+                    if not self.tasks or time.monotonic() >= drain_deadline:
+                        break
+                else:
+                    await self.refresh_servers()
+                    log.debug("activate_queued_jobs")
+                    await self.activate_queued_jobs()
+                await self.publish_backlog()
+
+                await self.report_metrics()
+                await self.archive_jobs()
+
+                await self.reload_workflows()
 
-            log.debug("process_jobs")
-            await self.process_jobs()
+                log.debug("=" * 40)
+            # os que não terminaram seguem em processing e são retomados pelo próximo worker
+            log.info("worker.stopped", unfinished=len(self.tasks))
+        finally:
+            deadline_task.cancel()
+            self.encoder.shutdown()
+            await tracer.flush()
 
-            log.debug("activate_queued_jobs")
-            await self.activate_queued_jobs()
 
-            log.debug("=" * 40)
+def _split(value) -> list:
+    return [item for item in (value or "").split(",") if item]
+
+
+def configured_servers() -> list:
+    """
+    Servidores fixos da configuração, semente do registro dinâmico.
+    """
+    return [settings.COMFYUI_API_SERVER1, settings.COMFYUI_API_SERVER2,
+            settings.COMFYUI_API_SERVER3, settings.COMFYUI_API_SERVER4] + _split(settings.COMFYUI_API_SERVERS)
 
 
 if __name__ == "__main__":
     """
     Inicia o worker_loop em paralelo ao servidor.
     """
-    server_list = [settings.COMFYUI_API_SERVER1, settings.COMFYUI_API_SERVER2,
-                   settings.COMFYUI_API_SERVER3, settings.COMFYUI_API_SERVER4]
-
-    worker = Worker(server_list)
+    worker = Worker(configured_servers())
 
     log.info("worker.startup")
     asyncio.run(worker.worker_loop())
\ No newline at end of file
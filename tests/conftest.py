@@ -0,0 +1,17 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+# Set minimal environment variables required by the settings module before
+# any test module imports code from src/.
+os.environ.setdefault("BASE_URL", "http://testserver")
+os.environ.setdefault("STATIC_DIR", "static")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+os.environ.setdefault("AWS_REGION", "us-east-1")
+os.environ.setdefault("S3_BUCKET", "dummy-bucket")
+os.environ.setdefault("COMFYUI_API_SERVER1", "http://localhost")
+os.environ.setdefault("COMFYUI_API_SERVER2", "http://localhost")
+os.environ.setdefault("COMFYUI_API_SERVER3", "http://localhost")
+os.environ.setdefault("COMFYUI_API_SERVER4", "http://localhost")
+os.environ.setdefault("TIMER_TERMS", "20")
+os.environ.setdefault("CONFIG_INDEX", "6")
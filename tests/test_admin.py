@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from core import archive
+from core.config import settings
+from core.memory_store import MemoryRedis
+from core.tracing import trace_key
+from routes import admin
+
+
+WRITE_ROUTES = {("PUT", "/admin/workflows/weights"), ("POST", "/admin/dead-letter/{request_id}/replay"),
+                ("POST", "/admin/servers"), ("POST", "/admin/servers/heartbeat"), ("POST", "/admin/servers/drain"),
+                ("DELETE", "/admin/servers")}
+
+
+def status_of(dependency, token):
+    try:
+        asyncio.run(dependency(token))
+    except HTTPException as e:
+        return e.status_code
+    return 200
+
+
+def test_write_routes_fail_closed_without_token(monkeypatch):
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", None)
+    assert status_of(admin.require_admin_write, None) == 403
+    assert status_of(admin.require_admin_write, "qualquer") == 403
+
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", "segredo")
+    assert status_of(admin.require_admin_write, None) == 401
+    assert status_of(admin.require_admin_write, "segredo") == 200
+
+
+@pytest.mark.parametrize("method,path", sorted(WRITE_ROUTES))
+def test_mutating_routes_use_write_guard(method, path):
+    route = next(r for r in admin.router.routes if r.path == path and method in r.methods)
+    assert admin.require_admin_write in [d.dependency for d in route.dependencies]
+
+
+def test_trace_of_archived_job(tmp_path, monkeypatch):
+    store = MemoryRedis()
+    job_archive = archive.JobArchive(str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(admin, "redis", store)
+    monkeypatch.setattr(archive, "job_archive", job_archive)
+    # o hash do job expirou do Redis; os spans ainda estão lá
+    job_archive.write({"old": {"status": "done", "trace_id": "t1", "finished_at": "10"}})
+    span = {"trace_id": "t1", "span_id": "s1", "parent_id": None, "name": "api.upload", "start": 1.0,
+            "end": 1.5, "duration": 0.5, "status": "ok", "attributes": {}}
+
+    async def run_test():
+        await store.rpush(trace_key("t1"), json.dumps(span))
+        return await admin.get_job_trace("old")
+
+    waterfall = json.loads(asyncio.run(run_test()).body)
+    assert waterfall["request_id"] == "old"
+    assert [s["name"] for s in waterfall["spans"]] == ["api.upload"]
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(admin.get_job_trace("missing"))
+    assert e.value.status_code == 404
@@ -0,0 +1,83 @@
+import asyncio
+from types import SimpleNamespace
+
+from core import admission
+from core.config import settings
+from core.memory_store import MemoryRedis
+from core.metrics import GAUGES_KEY, HEALTHY_SERVERS
+
+
+def test_overload_is_rejected_before_spending_tokens(monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_MAX_WAIT", 300.0)
+    monkeypatch.setattr(settings, "ADMISSION_CLIENT_RATE", 6.0)
+    redis = MemoryRedis()
+    asyncio.run(redis.set("avg_processing_time", 60))
+    asyncio.run(redis.hset(GAUGES_KEY, HEALTHY_SERVERS, 4))
+    asyncio.run(redis.set(admission.BACKLOG_KEY, 18))
+    asyncio.run(redis.rpush(admission.SUBMISSIONS_QUEUE, "a", "b"))
+
+    # 20 na frente + o próprio, 4 servidores: 6 rodadas de 60 s
+    status, reason, retry_after, state = asyncio.run(admission.admit(redis, "kiosk:1"))
+    assert (status, reason, retry_after) == (503, admission.OVERLOADED, 60)
+    assert state["estimated_wait_seconds"] == 360
+    assert not any(key.startswith(admission.BUCKET_PREFIX) for key in redis.data)
+
+    asyncio.run(redis.set(admission.BACKLOG_KEY, 2))
+    assert asyncio.run(admission.admit(redis, "kiosk:1")) is None
+
+
+def test_client_bucket_refills_over_time(monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_CLIENT_RATE", 6.0)
+    monkeypatch.setattr(settings, "ADMISSION_CLIENT_BURST", 2)
+    redis = MemoryRedis()
+
+    async def run_test():
+        results = [await admission.bucket(redis, "kiosk:1", now=100.0) for _ in range(3)]
+        peek = await admission.bucket(redis, "kiosk:1", consume=False, now=105.0)
+        later = await admission.bucket(redis, "kiosk:1", now=110.0)
+        other = await admission.bucket(redis, "kiosk:2", now=100.0)
+        return results, peek, later, other
+
+    results, peek, later, other = asyncio.run(run_test())
+    assert [r["allowed"] for r in results] == [True, True, False]
+    assert results[2]["retry_after_seconds"] == 10
+    assert (peek["allowed"], peek["retry_after_seconds"]) == (False, 5)
+    assert later["allowed"] and other["allowed"]
+
+
+def test_concurrent_uploads_do_not_share_a_token(monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_CLIENT_RATE", 6.0)
+    monkeypatch.setattr(settings, "ADMISSION_CLIENT_BURST", 2)
+    redis = MemoryRedis()
+
+    async def run_test():
+        return await asyncio.gather(*(admission.bucket(redis, "kiosk:1", now=100.0) for _ in range(5)))
+
+    assert [r["allowed"] for r in asyncio.run(run_test())].count(True) == 2
+
+
+def request(headers, host="10.0.0.9"):
+    return SimpleNamespace(headers=headers, client=SimpleNamespace(host=host))
+
+
+def test_client_key_needs_kiosk_token(monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_KIOSK_TOKENS", "totem-3=abc")
+    assert admission.client_key(request({"X-Kiosk-Id": "totem-3", "X-Kiosk-Token": "abc"})) == "kiosk:totem-3"
+    # id sem token (ou com o token de outro totem) conta pelo IP
+    assert admission.client_key(request({"X-Kiosk-Id": "totem-3"})) == "ip:10.0.0.9"
+    assert admission.client_key(request({"X-Kiosk-Id": "totem-4", "X-Kiosk-Token": "abc"})) == "ip:10.0.0.9"
+
+    monkeypatch.setattr(settings, "ADMISSION_KIOSK_TOKENS", None)
+    assert admission.kiosk_id(request({"X-Kiosk-Id": "totem-3", "X-Kiosk-Token": "abc"})) is None
+
+
+def test_forwarded_for_only_from_trusted_proxy(monkeypatch):
+    headers = {"x-forwarded-for": "1.1.1.1, 200.1.2.3, 10.0.0.1"}
+    monkeypatch.setattr(settings, "ADMISSION_TRUSTED_PROXIES", None)
+    assert admission.client_key(request(headers)) == "ip:10.0.0.9"
+
+    monkeypatch.setattr(settings, "ADMISSION_TRUSTED_PROXIES", "10.0.0.0/8")
+    # o 1.1.1.1 veio do cliente; quem o balanceador viu foi o 200.1.2.3
+    assert admission.client_key(request(headers)) == "ip:200.1.2.3"
+    assert admission.client_key(request(headers, host="200.9.9.9")) == "ip:200.9.9.9"
+    assert admission.client_key(request({})) == "ip:10.0.0.9"
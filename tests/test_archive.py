@@ -0,0 +1,88 @@
+import asyncio
+
+from core import archive
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((getattr(self.redis, name), args, kwargs))
+        return queue
+
+    async def execute(self):
+        return [await fn(*args, **kwargs) for fn, args, kwargs in self.calls]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+        self.ttls = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def hgetall(self, key):
+        return dict(self.store.get(key, {}))
+
+    async def hset(self, key, field=None, value=None, mapping=None):
+        data = self.store.setdefault(key, {})
+        if field is not None:
+            data[field] = str(value)
+        data.update({k: str(v) for k, v in (mapping or {}).items()})
+
+    async def expire(self, key, ttl):
+        self.ttls[key] = ttl
+
+    async def zadd(self, key, mapping):
+        self.store.setdefault(key, {}).update(mapping)
+
+    async def zrangebyscore(self, key, low, high):
+        items = self.store.get(key, {})
+        return [m for m, score in sorted(items.items(), key=lambda kv: kv[1]) if score <= high]
+
+    async def zrem(self, key, *members):
+        for member in members:
+            self.store.get(key, {}).pop(member, None)
+
+
+def test_archives_old_finished_jobs(tmp_path):
+    redis = FakeRedis()
+    job_archive = archive.JobArchive(str(tmp_path / "archive" / "jobs.sqlite3"))
+
+    async def run_test():
+        await redis.hset("job:old", mapping={"status": "done", "lane": "booth", "workflow": "clay",
+                                             "output_key": "outputs/old.png", "deadline_at": "1"})
+        await archive.mark_finished(redis, "old", ts=100.0)
+        await redis.hset("job:new", mapping={"status": "error", "error": "boom"})
+        await archive.mark_finished(redis, "new", ts=190.0)
+        # replay da dead-letter: voltou para a fila depois de finalizado
+        await redis.hset("job:replayed", mapping={"status": "queued"})
+        await archive.mark_finished(redis, "replayed", ts=50.0)
+        return await archive.archive_finished(redis, job_archive, grace=60, ttl=3600, now=200.0)
+
+    assert asyncio.run(run_test()) == 1
+    assert redis.ttls == {"job:old": 3600}
+    assert list(redis.store[archive.FINISHED_KEY]) == ["new"]
+
+    stored = job_archive.get("old")
+    assert stored["output_key"] == "outputs/old.png"
+    assert "deadline_at" not in stored
+    assert job_archive.get("replayed") is None
+
+
+def test_load_job_falls_back_to_archive(tmp_path):
+    redis = FakeRedis()
+    job_archive = archive.JobArchive(str(tmp_path / "jobs.sqlite3"))
+    assert asyncio.run(archive.load_job(redis, job_archive, "gone")) == {}
+
+    job_archive.write({"gone": {"status": "done", "output_key": "outputs/gone.png", "finished_at": "10"}})
+    redis.store["job:live"] = {"status": "processing"}
+
+    assert asyncio.run(archive.load_job(redis, job_archive, "live")) == {"status": "processing"}
+    job = asyncio.run(archive.load_job(redis, job_archive, "gone"))
+    assert job["archived"] and job["status"] == "done"
+    assert asyncio.run(archive.load_job(redis, None, "gone")) == {}
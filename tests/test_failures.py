@@ -0,0 +1,87 @@
+import asyncio
+import json
+import random
+import urllib.error
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from core import archive, failures, jobstore
+from core.memory_store import MemoryRedis
+
+
+def s3_error(code):
+    return ClientError({"Error": {"Code": code, "Message": ""}}, "GetObject")
+
+
+@pytest.mark.parametrize("error,expected", [
+    (failures.ServerError("interrompido"), (failures.SERVER, True)),
+    (failures.InputError("foto inválida"), (failures.INPUT, False)),
+    (urllib.error.HTTPError("http://srv/prompt", 400, "Bad Request", {}, None), (failures.SERVER, True)),
+    (urllib.error.HTTPError("http://srv/prompt", 502, "Bad Gateway", {}, None), (failures.SERVER, True)),
+    (s3_error("NoSuchKey"), (failures.INPUT, False)),
+    (s3_error("AccessDenied"), (failures.STORAGE, False)),
+    (s3_error("SlowDown"), (failures.STORAGE, True)),
+    (EndpointConnectionError(endpoint_url="https://s3"), (failures.STORAGE, True)),
+    (ConnectionResetError("reset"), (failures.SERVER, True)),
+])
+def test_classify(error, expected):
+    assert failures.classify(error) == expected
+
+
+def test_execution_error_blames_input_nodes():
+    error = failures.execution_error({"node_type": "LoadImage", "exception_message": "cannot identify image"})
+    assert isinstance(error, failures.InputError)
+    error = failures.execution_error({"node_type": "KSampler", "exception_message": "CUDA out of memory"})
+    assert isinstance(error, failures.ServerError)
+
+
+def test_retry_delay_grows_with_jitter_and_cap():
+    rng = random.Random(1)
+    for attempt, ceiling in ((1, 2.0), (2, 4.0), (3, 8.0), (10, 30.0)):
+        delay = failures.retry_delay(attempt, 2.0, 30.0, rng)
+        assert ceiling / 2 <= delay <= ceiling
+
+
+def test_replay_requeues_dead_letter(monkeypatch):
+    redis = MemoryRedis()
+    monkeypatch.setattr(archive, "job_archive", None)
+
+    async def run_test():
+        await redis.hset("job:x", mapping={"status": "error", "attempt": 3, "error": "boom", "fault": "server",
+                                           "avoid_servers": "srv"})
+        await failures.dead_letter(redis, "x", error="boom", fault="server")
+        await failures.dead_letter(redis, "y", error="foto", fault="input")
+        assert [e["request_id"] for e in await failures.dead_letters(redis)] == ["y", "x"]
+        assert await failures.replay(redis, "x")
+        assert not await failures.replay(redis, "missing")
+        return await failures.dead_letters(redis)
+
+    remaining = asyncio.run(run_test())
+    assert [e["request_id"] for e in remaining] == ["y"]
+    job = redis.data["job:x"]
+    assert (job["status"], job["attempt"]) == ("queued", "1")
+    assert "error" not in job and "avoid_servers" not in job
+    assert json.loads(redis.data[failures.DEAD_LETTER_KEY][0])["fault"] == "input"
+
+
+def test_replay_of_archived_job_keeps_it_alive(tmp_path, monkeypatch):
+    redis = MemoryRedis()
+    job_archive = archive.JobArchive(str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(archive, "job_archive", job_archive)
+
+    async def run_test():
+        await jobstore.transition(redis, "x", "error", {"error": "boom", "fault": "server"}, ts=100.0)
+        await failures.dead_letter(redis, "x", error="boom", fault="server")
+        await archive.archive_finished(redis, job_archive, grace=0, ttl=3600, now=200.0)
+        assert "job:x" in redis.expires
+
+        assert await failures.replay(redis, "x")
+        return await jobstore.get(redis, "x")
+
+    job = asyncio.run(run_test())
+    assert job["status"] == "queued" and "archived" not in job and "finished_at" not in job
+    # o hash não expira mais e o arquivo não guarda o status antigo
+    assert "job:x" not in redis.expires
+    assert job_archive.get("x") is None
+    assert redis.data[archive.FINISHED_KEY] == {}
@@ -0,0 +1,105 @@
+import asyncio
+import io
+
+import pytest
+from PIL import Image
+
+from core.imaging import ImageEncoder, encode_image, overlay_for, parse_renditions, postprocess
+
+
+def png_bytes(mode="RGB", size=(64, 48)) -> bytes:
+    buf = io.BytesIO()
+    Image.new(mode, size, (200, 100, 50, 255)[:len(mode)]).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_passthrough_keeps_comfyui_bytes():
+    encoder = ImageEncoder("passthrough")
+    data = png_bytes()
+    assert asyncio.run(encoder.encode(data)) is data
+    assert (encoder.extension, encoder.content_type) == ("png", "image/png")
+
+
+@pytest.mark.parametrize("fmt,pil_format", [("webp", "WEBP"), ("jpeg", "JPEG"), ("png", "PNG")])
+def test_encoder_emits_configured_format(fmt, pil_format):
+    encoder = ImageEncoder(fmt, quality=70, workers=0)
+    out = asyncio.run(encoder.encode(png_bytes("RGBA")))
+    img = Image.open(io.BytesIO(out))
+    assert img.format == pil_format
+    assert img.size == (64, 48)
+
+
+def test_encoder_runs_in_process_pool():
+    encoder = ImageEncoder("webp", quality=80, workers=1)
+    try:
+        out = asyncio.run(encoder.encode(png_bytes()))
+    finally:
+        encoder.shutdown()
+    assert out == encode_image(png_bytes(), "webp", 80)
+    assert (encoder.extension, encoder.content_type) == ("webp", "image/webp")
+
+
+def test_unknown_encoding_is_rejected():
+    with pytest.raises(ValueError):
+        ImageEncoder("bmp")
+
+
+def test_parse_renditions():
+    assert parse_renditions("web=1080:webp, share=1200x630:jpeg,thumb=320") == {
+        "web": (1080, "webp"), "share": ((1200, 630), "jpeg"), "thumb": (320, "webp")}
+    assert parse_renditions("") == {}
+    with pytest.raises(ValueError):
+        parse_renditions("web=1080:gif")
+
+
+def test_render_builds_every_rendition():
+    encoder = ImageEncoder("passthrough", quality=80, workers=0,
+                           renditions=parse_renditions("web=32:webp,share=120x63:jpeg"))
+    data = png_bytes(size=(64, 96))
+    out = asyncio.run(encoder.render(data))
+
+    assert list(out) == ["full", "web", "share"]
+    assert out["full"] == (data, "png", "image/png")
+    web = Image.open(io.BytesIO(out["web"][0]))
+    assert (web.format, web.size) == ("WEBP", (21, 32))
+    share = Image.open(io.BytesIO(out["share"][0]))
+    assert (share.format, share.size) == ("JPEG", (120, 63))
+    assert out["share"][1:] == ("jpg", "image/jpeg")
+
+
+def test_postprocess_applies_cached_frame_and_watermark(tmp_path):
+    frame = Image.new("RGBA", (40, 60), (255, 0, 0, 255))
+    frame.paste((0, 0, 0, 0), (5, 5, 35, 55))
+    frame.save(tmp_path / "frame.png")
+    Image.new("RGBA", (10, 4), (0, 0, 255, 255)).save(tmp_path / "mark.png")
+    frame_path, mark_path = str(tmp_path / "frame.png"), str(tmp_path / "mark.png")
+
+    img = postprocess(Image.new("RGB", (20, 30), (0, 255, 0)), frame_path, mark_path)
+    assert img.size == (40, 60)
+    assert img.getpixel((1, 1)) == (255, 0, 0)
+    assert img.getpixel((20, 20)) == (0, 255, 0)
+    assert img.getpixel((20, 47)) == (0, 0, 255)
+    assert overlay_for((40, 60), frame_path, mark_path) is overlay_for((40, 60), frame_path, mark_path)
+
+
+def test_render_postprocesses_every_rendition(tmp_path):
+    Image.new("RGBA", (64, 96), (255, 0, 0, 255)).save(tmp_path / "frame.png")
+    encoder = ImageEncoder("passthrough", workers=0, renditions=parse_renditions("web=32:png"))
+    out = asyncio.run(encoder.render(png_bytes(size=(32, 48)), str(tmp_path / "frame.png")))
+
+    for name in ("full", "web"):
+        img = Image.open(io.BytesIO(out[name][0]))
+        assert img.getpixel((10, 10))[:3] == (255, 0, 0)
+    assert Image.open(io.BytesIO(out["full"][0])).size == (64, 96)
+
+
+def test_render_decodes_and_postprocesses_once(tmp_path, monkeypatch):
+    Image.new("RGBA", (64, 96), (255, 0, 0, 255)).save(tmp_path / "frame.png")
+    calls = []
+    original = postprocess
+    monkeypatch.setattr("core.imaging.postprocess", lambda *args: calls.append(args) or original(*args))
+    encoder = ImageEncoder("webp", workers=0, renditions=parse_renditions("web=32:png,share=60x30:jpeg"))
+    out = asyncio.run(encoder.render(png_bytes(size=(32, 48)), str(tmp_path / "frame.png")))
+
+    assert list(out) == ["full", "web", "share"]
+    assert len(calls) == 1
@@ -0,0 +1,86 @@
+import asyncio
+
+from core import archive, jobstore
+from core.memory_store import MemoryRedis
+
+
+def test_job_lifecycle_in_memory():
+    redis = MemoryRedis()
+
+    async def run_test():
+        await jobstore.transition(redis, "a", "queued", {"input": "input/a.png", "lane": "booth"})
+        await jobstore.enqueue(redis, "a", "input/a.png", {"trace_id": "t1"})
+        await jobstore.enqueue(redis, "b", "input/b.png")
+        claimed = [await jobstore.claim(redis) for _ in range(3)]
+
+        await jobstore.transition(redis, "b", "processing")
+        queued = [rid async for rid, _ in jobstore.query(redis, ("queued",))]
+        await jobstore.transition(redis, "b", "done", {"output_key": "outputs/b.png"}, ts=100.0)
+        return claimed, queued, await jobstore.get(redis, "b")
+
+    claimed, queued, job = asyncio.run(run_test())
+    assert [c and c["id"] for c in claimed] == ["a", "b", None]
+    assert claimed[0]["trace"] == {"trace_id": "t1"}
+    assert queued == ["a"]
+    assert (job["status"], job["finished_at"]) == ("done", "100.0")
+    assert redis.data[archive.FINISHED_KEY] == {"b": 100.0}
+
+
+def test_memory_store_expires_keys(monkeypatch):
+    redis = MemoryRedis()
+    now = [1000.0]
+    monkeypatch.setattr("core.memory_store.time.time", lambda: now[0])
+
+    async def run_test():
+        await redis.hset("job:a", mapping={"status": "done"})
+        await redis.expire("job:a", 60)
+        before = await redis.hgetall("job:a")
+        now[0] += 61
+        return before, await redis.hgetall("job:a"), [k async for k in redis.scan_iter("job:*")]
+
+    before, after, keys = asyncio.run(run_test())
+    assert before == {"status": "done"}
+    assert after == {} and keys == []
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "store.sqlite3")
+    redis = MemoryRedis()
+
+    async def fill():
+        await redis.hset("job:a", mapping={"status": "processing", "attempt": 1})
+        await redis.lpush(jobstore.SUBMISSIONS_QUEUE, "x", "y")
+        await redis.zadd("jobs:deadlines", {"a": 123.5})
+        await redis.sadd("stats:metrics", "total")
+        await redis.set("avg_processing_time", 42)
+
+    asyncio.run(fill())
+    redis.save(path)
+
+    restored = MemoryRedis()
+    assert restored.load(path) == 5
+
+    async def read():
+        return (await restored.hgetall("job:a"), await restored.lrange(jobstore.SUBMISSIONS_QUEUE, 0, -1),
+                await restored.zrangebyscore("jobs:deadlines", "-inf", "+inf", withscores=True),
+                await restored.smembers("stats:metrics"), await restored.get("avg_processing_time"))
+
+    assert asyncio.run(read()) == ({"status": "processing", "attempt": "1"}, ["y", "x"], [("a", 123.5)],
+                                   {"total"}, "42")
+
+
+def test_cancel_requests_and_field_clears_go_through_jobstore():
+    redis = MemoryRedis()
+
+    async def run_test():
+        await jobstore.transition(redis, "a", "failed", {"error": "boom", "retry_at": "1"})
+        await jobstore.transition(redis, "a", "queued", clear=("error", "retry_at"))
+        await jobstore.request_cancel(redis, "a", "2026-01-01T00:00:00")
+        claimed = [await jobstore.claim_cancel(redis) for _ in range(2)]
+        return claimed, await jobstore.get(redis, "a"), await jobstore.exists(redis, "b")
+
+    claimed, job, missing = asyncio.run(run_test())
+    assert claimed == ["a", None]
+    assert job["status"] == "queued" and "error" not in job and "retry_at" not in job
+    assert job["cancel_requested_at"] == "2026-01-01T00:00:00"
+    assert missing is False
@@ -0,0 +1,78 @@
+from collections import Counter
+
+import pytest
+
+from core.config import settings
+from core.lanes import DEFAULT_LANE, LaneScheduler, authorized, resolve
+
+
+def dispatch(scheduler, heads, count):
+    served = []
+    for _ in range(count):
+        lane = scheduler.pick(heads)
+        scheduler.charge(lane)
+        served.append(lane)
+    return served
+
+
+def test_weighted_lanes_share_by_weight():
+    scheduler = LaneScheduler({"a": 3})
+    served = dispatch(scheduler, {"a": "2", "b": "1"}, 40)
+    assert Counter(served) == {"a": 30, "b": 10}
+    # a intercala em vez de esgotar uma faixa antes da outra
+    assert "b" in served[:4]
+
+
+def test_priority_lane_preempts_fair_share():
+    scheduler = LaneScheduler({"a": 3}, priority=["staff", "vip"])
+    assert scheduler.pick({"a": "1", "vip": "3", "staff": "4"}) == "staff"
+    assert scheduler.pick({"a": "1", "vip": "3"}) == "vip"
+    scheduler.charge("vip")
+    assert scheduler.passes == {}
+
+
+def test_idle_lane_does_not_bank_credit():
+    scheduler = LaneScheduler()
+    dispatch(scheduler, {"busy": "1"}, 50)
+    # a faixa que chega agora alterna com a ocupada em vez de monopolizar 50 jobs
+    served = dispatch(scheduler, {"busy": "1", "new": "2"}, 6)
+    assert Counter(served) == {"busy": 3, "new": 3}
+
+
+def test_resolve_lane(monkeypatch):
+    monkeypatch.setattr(settings, "LANE_WEIGHTS", "booth=2")
+    assert resolve(None, None) == DEFAULT_LANE
+    assert resolve(None, "totem-3") == "totem-3"
+    assert resolve("booth", "totem-3") == "booth"
+    with pytest.raises(ValueError):
+        resolve("vip lane; drop")
+
+
+def test_unconfigured_lane_names_are_ignored(monkeypatch):
+    monkeypatch.setattr(settings, "LANE_WEIGHTS", "booth=2")
+    # um nome por upload não multiplica a fatia do cliente
+    assert {resolve(f"x{i}", "totem-3") for i in range(5)} == {"totem-3"}
+    assert resolve("x1") == DEFAULT_LANE
+
+
+def test_kiosk_ids_become_valid_lanes():
+    assert resolve(None, "Totem 1") == "Totem-1"
+    assert resolve(None, "Praça") == "Praca"
+    assert resolve(None, "😀").startswith("kiosk-")
+    assert resolve(None, "😀") == resolve(None, "😀")
+
+
+def test_priority_lane_requires_token(monkeypatch):
+    monkeypatch.setattr(settings, "LANE_PRIORITY", "vip")
+    monkeypatch.setattr(settings, "LANE_PRIORITY_TOKEN", None)
+    # sem token configurado ninguém pede prioridade
+    assert not authorized(None) and not authorized("")
+    with pytest.raises(PermissionError):
+        resolve("vip", "totem-3")
+    # nem pelo nome do totem
+    assert resolve(None, "vip") == DEFAULT_LANE
+
+    monkeypatch.setattr(settings, "LANE_PRIORITY_TOKEN", "segredo")
+    assert not authorized("errado")
+    assert authorized("segredo")
+    assert resolve("vip", "totem-3", authorized("segredo")) == "vip"
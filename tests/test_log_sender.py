@@ -0,0 +1,131 @@
+import csv
+
+from utils.log_sender import LogSender, FIELDNAMES
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeSession:
+    def __init__(self, bulk_status=200):
+        self.bulk_status = bulk_status
+        # status -> código da resposta no envio linha a linha
+        self.row_status = {}
+        self.calls = []
+
+    def post(self, url, data=None, json=None, timeout=None):
+        self.calls.append((url, data, json))
+        if url.endswith("/batch"):
+            return FakeResponse(self.bulk_status)
+        return FakeResponse(self.row_status.get(data["status"], 200))
+
+
+def make_sender(tmp_path, **kwargs):
+    sender = LogSender("http://logs", "proj", log_dir=str(tmp_path), start=False, **kwargs)
+    sender.session = FakeSession()
+    return sender
+
+
+def test_ship_sends_only_new_rows_in_batches(tmp_path):
+    sender = make_sender(tmp_path, batch_size=2, flush_size=100)
+    for i in range(3):
+        sender.log("start", additional=f"row {i}")
+
+    assert sender.ship() == 3
+    batches = [json["logs"] for _, _, json in sender.session.calls]
+    assert [len(b) for b in batches] == [2, 1]
+    assert batches[0][0]["additional"] == "row 0"
+
+    sender.session.calls.clear()
+    sender.log("end", additional="linha com, vírgula\ne quebra")
+    assert sender.ship() == 1
+    (_, _, payload), = sender.session.calls
+    assert payload["logs"][0]["additional"] == "linha com, vírgula\ne quebra"
+
+    # deslocamento persistido: uma nova instância não reenvia nada
+    other = make_sender(tmp_path)
+    assert other.ship() == 0
+
+
+def test_failed_batch_keeps_offset(tmp_path):
+    sender = make_sender(tmp_path)
+    sender.session.bulk_status = 500
+    sender.log("start")
+    assert sender.ship() == 0
+
+    sender.session.bulk_status = 200
+    assert sender.ship() == 1
+
+
+def test_falls_back_to_single_rows_without_bulk_endpoint(tmp_path):
+    sender = make_sender(tmp_path)
+    sender.session.bulk_status = 404
+    sender.log("a")
+    sender.log("b")
+    assert sender.ship() == 2
+    single = [data for url, data, _ in sender.session.calls if url.endswith("/datalog/upload")]
+    assert [d["status"] for d in single] == ["a", "b"]
+
+
+def test_partial_single_row_failure_does_not_resend_accepted_rows(tmp_path):
+    sender = make_sender(tmp_path)
+    sender.session.bulk_status = 404
+    for status in ("a", "b", "c"):
+        sender.log(status)
+    sender.session.row_status = {"b": 503}
+    assert sender.ship() == 1
+
+    sender.session.calls.clear()
+    sender.session.row_status = {}
+    assert sender.ship() == 2
+    assert [data["status"] for _, data, _ in sender.session.calls] == ["b", "c"]
+
+
+def test_rejected_batch_is_sent_row_by_row_skipping_bad_rows(tmp_path):
+    sender = make_sender(tmp_path)
+    sender.session.bulk_status = 413
+    sender.session.row_status = {"ruim": 400}
+    for status in ("a", "ruim", "c"):
+        sender.log(status)
+    assert sender.ship() == 3
+    assert sender._bulk_supported
+    with open(sender.dead_filename, newline="") as f:
+        assert [(r["status"], r["reason"]) for r in csv.DictReader(f)] == [("ruim", "http_400")]
+
+    # nada fica preso: o próximo envio volta ao endpoint em lote
+    sender.session.bulk_status = 200
+    sender.session.calls.clear()
+    sender.log("d")
+    assert sender.ship() == 1
+    assert [url for url, _, _ in sender.session.calls] == ["http://logs/datalog/upload/batch"]
+
+
+def test_row_that_keeps_failing_is_moved_aside_after_max_attempts(tmp_path):
+    sender = make_sender(tmp_path, max_row_attempts=3)
+    sender.session.bulk_status = 404
+    sender.session.row_status = {"b": 503}
+    for status in ("a", "b", "c"):
+        sender.log(status)
+
+    assert sender.ship() == 1
+    assert sender.ship() == 0
+    # terceira tentativa: "b" vai para as rejeitadas e "c" segue
+    assert sender.ship() == 2
+    with open(sender.dead_filename, newline="") as f:
+        assert [(r["status"], r["reason"]) for r in csv.DictReader(f)] == [("b", "retries_exhausted")]
+    assert make_sender(tmp_path).ship() == 0
+
+
+def test_rotates_shipped_segment_into_backup(tmp_path):
+    sender = make_sender(tmp_path, segment_max_bytes=1)
+    sender.log("a")
+    sender.ship()
+
+    with open(sender.csv_filename, newline="") as f:
+        assert list(csv.reader(f)) == [FIELDNAMES]
+    with open(sender.backup_filename, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [r["status"] for r in rows] == ["a"]
+    assert sender._offset == 0
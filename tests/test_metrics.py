@@ -0,0 +1,58 @@
+import asyncio
+
+from core.metrics import MetricsRegistry, STAGE_SECONDS, JOBS_TOTAL, QUEUE_DEPTH
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.ops = []
+
+    def hincrbyfloat(self, key, field, amount):
+        self.ops.append((key, field, amount))
+
+    async def execute(self):
+        for key, field, amount in self.ops:
+            data = self.redis.store.setdefault(key, {})
+            data[field] = str(float(data.get(field, 0)) + amount)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def hset(self, key, mapping=None, **kwargs):
+        self.store.setdefault(key, {}).update(mapping or {})
+
+    async def hgetall(self, key):
+        return dict(self.store.get(key, {}))
+
+
+def test_render_aggregates_processes():
+    fake = FakeRedis()
+    api, worker = MetricsRegistry(buckets=(1, 10)), MetricsRegistry(buckets=(1, 10))
+
+    async def run():
+        api.observe_stage("execution", 0.5)
+        worker.observe_stage("execution", 5)
+        worker.inc(JOBS_TOTAL, status="done")
+        await api.flush(fake)
+        await worker.flush(fake)
+        await MetricsRegistry.set_gauges(fake, {QUEUE_DEPTH: 3})
+        return await api.render(fake)
+
+    text = asyncio.run(run())
+    lines = text.splitlines()
+    assert f"# TYPE {STAGE_SECONDS} histogram" in lines
+    buckets = [l for l in lines if l.startswith(f"{STAGE_SECONDS}_bucket")]
+    assert buckets == [
+        f'{STAGE_SECONDS}_bucket{{stage="execution",le="1"}} 1',
+        f'{STAGE_SECONDS}_bucket{{stage="execution",le="10"}} 2',
+        f'{STAGE_SECONDS}_bucket{{stage="execution",le="+Inf"}} 2',
+    ]
+    assert f'{STAGE_SECONDS}_count{{stage="execution"}} 2' in lines
+    assert f'{JOBS_TOTAL}{{status="done"}} 1' in lines
+    assert f"{QUEUE_DEPTH} 3" in lines
@@ -0,0 +1,185 @@
+import io
+import json
+import os
+import struct
+import urllib.error
+import urllib.request
+
+import pytest
+import websocket
+
+from core.multi_comfyui_api import MultiComfyUiAPI
+from core.workflow import use_websocket_output
+
+
+WORKFLOW = os.path.join(os.path.dirname(__file__), "..", "src", "workflows", "comfyui_basic_input.json")
+
+
+class FakeWebSocket:
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.timeout = None
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def recv(self):
+        if not self.messages:
+            raise websocket.WebSocketTimeoutException("timed out")
+        return self.messages.pop(0)
+
+
+def executing(node, prompt_id="p1"):
+    return json.dumps({"type": "executing", "data": {"node": node, "prompt_id": prompt_id}})
+
+
+def frame(payload: bytes, event: int = 1) -> bytes:
+    return struct.pack(">II", event, 2) + payload
+
+
+def make_api():
+    return MultiComfyUiAPI([], "", WORKFLOW, "-1", "8", "-1")
+
+
+def test_websocket_output_swaps_save_image():
+    with open(WORKFLOW, "r", encoding="utf-8") as f:
+        workflow = json.load(f)
+    swapped = use_websocket_output(workflow)
+    assert swapped["19"]["class_type"] == "SaveImageWebsocket"
+    assert swapped["19"]["inputs"] == {"images": workflow["19"]["inputs"]["images"]}
+    assert workflow["19"]["class_type"] == "SaveImage"
+
+
+def test_get_images_reads_binary_frames_of_output_nodes(monkeypatch):
+    api = make_api()
+    monkeypatch.setattr(api, "queue_prompt", lambda *args: {"prompt_id": "p1"})
+    monkeypatch.setattr(api, "get_history", lambda *args: (_ for _ in ()).throw(AssertionError("sem /history")))
+
+    ws = FakeWebSocket([
+        executing("10"),
+        frame(b"preview"),          # preview do KSampler: ignorado
+        executing("19"),
+        frame(b"png-bytes"),
+        executing(None, prompt_id="outro"),
+        executing(None),
+    ])
+    images = api.get_images(ws, "http://srv", b"{}", "c", websocket_nodes={"19"})
+    assert images == {"19": [b"png-bytes"]}
+
+
+def test_get_images_falls_back_to_http_when_prompt_rejected(monkeypatch):
+    api = make_api()
+    sent = []
+
+    def queue_prompt(server, prompt, client_id):
+        sent.append(prompt)
+        if prompt == b"ws":
+            raise urllib.error.HTTPError("http://srv/prompt", 400, "Bad Request", {}, io.BytesIO(
+                b'{"error": {"type": "invalid_prompt", "message": "Cannot execute because node '
+                b'SaveImageWebsocket does not exist."}}'))
+        return {"prompt_id": "p1"}
+
+    monkeypatch.setattr(api, "queue_prompt", queue_prompt)
+    monkeypatch.setattr(api, "get_history", lambda *args: {"p1": {"outputs": {
+        "19": {"images": [{"filename": "a.png", "subfolder": "", "type": "output"}]}}}})
+    monkeypatch.setattr(api, "get_image", lambda *args: b"via-http")
+
+    api.output_mode = "websocket"
+    ws = FakeWebSocket([executing("19"), executing(None)])
+    images = api.get_images(ws, "http://srv", b"ws", "c", websocket_nodes={"19"}, fallback_prompt=b"http")
+    assert sent == [b"ws", b"http"]
+    assert images == {"19": [b"via-http"]}
+    assert not api.use_websocket_output("http://srv")
+
+
+def test_get_images_keeps_websocket_output_on_unrelated_400(monkeypatch):
+    api = make_api()
+
+    def queue_prompt(server, prompt, client_id):
+        raise urllib.error.HTTPError("http://srv/prompt", 400, "Bad Request", {}, io.BytesIO(
+            b'{"error": {"type": "prompt_outputs_failed_validation"}}'))
+
+    monkeypatch.setattr(api, "queue_prompt", queue_prompt)
+    api.output_mode = "websocket"
+    with pytest.raises(urllib.error.HTTPError):
+        api.get_images(FakeWebSocket([]), "http://srv", b"ws", "c", websocket_nodes={"19"}, fallback_prompt=b"http")
+    assert api.use_websocket_output("http://srv")
+
+
+def test_get_images_reports_prompt_id_and_raises_on_interrupt(monkeypatch):
+    api = make_api()
+    monkeypatch.setattr(api, "queue_prompt", lambda *args: {"prompt_id": "p1"})
+    queued = []
+
+    ws = FakeWebSocket([
+        executing("10"),
+        json.dumps({"type": "execution_interrupted", "data": {"prompt_id": "p1", "node_id": "10"}}),
+    ])
+    with pytest.raises(RuntimeError, match="interrompida"):
+        api.get_images(ws, "http://srv", b"{}", "c", on_queued=queued.append)
+    assert queued == ["p1"]
+
+
+def test_get_images_gives_up_on_prompt_deleted_from_queue(monkeypatch):
+    api = make_api()
+    monkeypatch.setattr(api, "queue_prompt", lambda *args: {"prompt_id": "p1"})
+    states = iter([("pending", None), ("lost", None)])
+    monkeypatch.setattr(api, "prompt_state", lambda server, prompt_id: next(states))
+
+    # o prompt pendente foi removido do /queue: o "executing" final não vem
+    ws = FakeWebSocket([])
+    with pytest.raises(RuntimeError, match="lost"):
+        api.get_images(ws, "http://srv", b"{}", "c")
+    assert ws.timeout is not None
+
+
+class FakeResponse(io.BytesIO):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+@pytest.mark.parametrize("queue,outcome,paths", [
+    ({"queue_running": [[1, "p1", {}, {}, []]], "queue_pending": []}, "interrupted", ["/queue", "/interrupt"]),
+    ({"queue_running": [[1, "p0", {}, {}, []]], "queue_pending": [[2, "p1", {}, {}, []]]}, "deleted", ["/queue"]),
+    ({"queue_running": [], "queue_pending": []}, "not_found", ["/queue"]),
+])
+def test_cancel_prompt_only_interrupts_its_own_prompt(monkeypatch, queue, outcome, paths):
+    posted = []
+
+    def urlopen(req):
+        if isinstance(req, str):
+            return FakeResponse(json.dumps(queue).encode())
+        posted.append((req.full_url[len("http://srv"):], json.loads(req.data)))
+        return FakeResponse(b"")
+
+    monkeypatch.setattr(urllib.request, "urlopen", urlopen)
+    assert make_api().cancel_prompt("http://srv", "p1") == outcome
+    assert [path for path, _ in posted] == paths
+    assert posted[0][1] == {"delete": ["p1"]}
+
+
+@pytest.mark.parametrize("history,queue,state", [
+    ({"p1": {"status": {"status_str": "success", "completed": True}, "outputs": {"9": {}}}}, {}, "done"),
+    ({"p1": {"status": {"status_str": "error", "completed": False}, "outputs": {}}}, {}, "error"),
+    ({}, {"queue_running": [[1, "p1", {}, {}, []]], "queue_pending": []}, "running"),
+    ({}, {"queue_running": [], "queue_pending": [[2, "p1", {}, {}, []]]}, "pending"),
+    ({}, {"queue_running": [], "queue_pending": []}, "lost"),
+])
+def test_prompt_state_after_worker_restart(monkeypatch, history, queue, state):
+    def urlopen(url):
+        return FakeResponse(json.dumps(history if "/history/" in url else queue).encode())
+
+    monkeypatch.setattr(urllib.request, "urlopen", urlopen)
+    assert make_api().prompt_state("http://srv", "p1")[0] == state
+
+
+def test_collect_outputs_reads_history_images(monkeypatch):
+    api = make_api()
+    monkeypatch.setattr(api, "get_image", lambda server, filename, subfolder, kind: filename.encode())
+    entry = {"outputs": {"9": {"images": [{"filename": "out.png", "subfolder": "", "type": "output"}]}}}
+    assert api.collect_outputs("http://srv", entry).getvalue() == b"out.png"
+    with pytest.raises(RuntimeError):
+        api.collect_outputs("http://srv", {"outputs": {}})
@@ -0,0 +1,66 @@
+import asyncio
+
+from core import servers
+from core.memory_store import MemoryRedis
+
+
+def test_fleet_tracks_heartbeats_and_draining():
+    redis = MemoryRedis()
+
+    async def run_test():
+        await servers.seed(redis, ["http://static:8188/", "", "http://static:8188"])
+        await servers.register(redis, "http://gpu5:8188", {"max_batch": 4}, ts=100.0)
+        await servers.register(redis, "http://gpu6:8188", ts=100.0)
+        assert await servers.heartbeat(redis, "http://gpu6:8188", ts=125.0)
+        assert not await servers.heartbeat(redis, "http://unknown:8188")
+        await servers.set_draining(redis, "http://gpu6:8188")
+        # o agente renova o registro, mas a drenagem continua
+        await servers.register(redis, "http://gpu6:8188", {"gpu": "L4"}, ts=126.0)
+        return await servers.fleet(redis, ttl=30, now=140.0)
+
+    fleet = asyncio.run(run_test())
+    assert set(fleet) == {"http://static:8188", "http://gpu5:8188", "http://gpu6:8188"}
+    assert fleet["http://static:8188"]["alive"] and fleet["http://static:8188"]["static"]
+    assert not fleet["http://gpu5:8188"]["alive"]
+    assert fleet["http://gpu5:8188"]["capabilities"] == {"max_batch": 4}
+    assert fleet["http://gpu6:8188"]["draining"] and fleet["http://gpu6:8188"]["capabilities"] == {"gpu": "L4"}
+    assert servers.dispatchable(fleet) == ["http://static:8188"]
+
+
+def test_reap_removes_only_stale_dynamic_servers():
+    redis = MemoryRedis()
+
+    async def run_test():
+        await servers.seed(redis, ["http://static:8188"])
+        await servers.register(redis, "http://old:8188", ts=0.0)
+        await servers.register(redis, "http://busy:8188", ts=0.0)
+        await servers.register(redis, "http://fresh:8188", ts=4000.0)
+        await redis.hset(servers.IN_FLIGHT_KEY, mapping={"http://busy:8188": 1})
+        fleet = await servers.fleet(redis, ttl=30, now=4000.0)
+        reaped = await servers.reap(redis, fleet, max_age=3600, now=4000.0)
+        return reaped, await servers.fleet(redis, ttl=30, now=4000.0)
+
+    reaped, fleet = asyncio.run(run_test())
+    assert reaped == ["http://old:8188"]
+    assert set(fleet) == {"http://static:8188", "http://busy:8188", "http://fresh:8188"}
+
+
+def test_parse_capabilities():
+    assert servers.parse_capabilities(["max_batch=4", "gpu=L4", "bad"]) == {"max_batch": 4, "gpu": "L4", "bad": True}
+
+
+def test_seed_demotes_servers_dropped_from_config():
+    redis = MemoryRedis()
+
+    async def run_test():
+        await servers.seed(redis, ["http://a:8188", "http://b:8188"])
+        await servers.register(redis, "http://b:8188", ts=0.0)
+        await servers.seed(redis, ["http://a:8188"])
+        fleet = await servers.fleet(redis, ttl=30, now=4000.0)
+        reaped = await servers.reap(redis, fleet, max_age=3600, now=4000.0)
+        return fleet, reaped
+
+    fleet, reaped = asyncio.run(run_test())
+    assert fleet["http://a:8188"]["static"] and fleet["http://a:8188"]["alive"]
+    assert not fleet["http://b:8188"]["static"] and not fleet["http://b:8188"]["alive"]
+    assert reaped == ["http://b:8188"]
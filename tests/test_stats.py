@@ -0,0 +1,80 @@
+import asyncio
+
+from core import stats
+from core.metrics import GAUGES_KEY, HEALTHY_SERVERS
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((getattr(self.redis, name), args, kwargs))
+        return queue
+
+    async def execute(self):
+        return [await fn(*args, **kwargs) for fn, args, kwargs in self.calls]
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def hincrby(self, key, field, amount):
+        data = self.store.setdefault(key, {})
+        data[str(field)] = str(int(data.get(str(field), 0)) + amount)
+
+    async def hgetall(self, key):
+        return dict(self.store.get(key, {}))
+
+    async def hget(self, key, field):
+        return self.store.get(key, {}).get(field)
+
+    async def hset(self, key, mapping=None, **kwargs):
+        self.store.setdefault(key, {}).update(mapping or {})
+
+    async def expire(self, key, ttl):
+        return True
+
+    async def sadd(self, key, *values):
+        self.store.setdefault(key, set()).update(values)
+
+    async def smembers(self, key):
+        return set(self.store.get(key, set()))
+
+    async def get(self, key):
+        return self.store.get(key)
+
+
+def test_percentiles_per_dimension_and_eta():
+    fake = FakeRedis()
+
+    async def run():
+        for total in range(1, 101):
+            server = "http://gpu1" if total <= 50 else "http://gpu2"
+            await stats.record(fake, {"total": float(total)}, server=server, workflow="mamulengo_v21_api")
+        await fake.hset(GAUGES_KEY, mapping={HEALTHY_SERVERS: "2.0"})
+        return await stats.summary(fake), await stats.estimate_wait(fake, 4)
+
+    summary, eta = asyncio.run(run())
+
+    overall = summary["all"]["total"]
+    assert overall["count"] == 100
+    # erro relativo limitado pelo crescimento dos buckets
+    assert abs(overall["p50"] - 50) / 50 < 0.05
+    assert abs(overall["p99"] - 99) / 99 < 0.05
+    assert summary["server:http://gpu1"]["total"]["p95"] < summary["server:http://gpu2"]["total"]["p50"]
+    assert summary["workflow:mamulengo_v21_api"]["total"]["count"] == 100
+    # 4 posições divididas entre 2 servidores saudáveis
+    assert eta == 2 * overall["p50"]
+
+
+def test_eta_falls_back_to_moving_average():
+    fake = FakeRedis()
+    fake.store["avg_processing_time"] = "30"
+    assert asyncio.run(stats.estimate_wait(fake, 3)) == 90
@@ -0,0 +1,38 @@
+import asyncio
+import json
+
+from core.tracing import Tracer, FileExporter, build_waterfall, parse_traceparent
+
+
+def test_child_spans_continue_queue_context(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer([FileExporter(str(path))])
+
+    root = tracer.start_span("api.upload", start=100.0)
+    root.end(100.5)
+    # contexto serializado no payload da fila / hash do job
+    queued = json.loads(json.dumps(root.context()))
+
+    job = tracer.start_span("worker.process_job", parent=queued, start=102.0)
+    tracer.record_span("comfyui.execution", job, start=103.0, end=110.0)
+    with job:
+        pass
+    job.end_time = 111.0
+
+    asyncio.run(tracer.flush())
+    spans = [json.loads(line) for line in path.read_text().splitlines()]
+    assert {s["trace_id"] for s in spans} == {root.trace_id}
+
+    waterfall = build_waterfall(spans)
+    names = [(row["name"], row["depth"], row["offset_ms"]) for row in waterfall["spans"]]
+    assert names == [
+        ("api.upload", 0, 0.0),
+        ("worker.process_job", 1, 2000.0),
+        ("comfyui.execution", 2, 3000.0),
+    ]
+
+
+def test_parse_traceparent():
+    ctx = parse_traceparent("00-" + "a" * 32 + "-" + "b" * 16 + "-01")
+    assert ctx == {"trace_id": "a" * 32, "span_id": "b" * 16}
+    assert parse_traceparent("garbage") is None
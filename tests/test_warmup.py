@@ -0,0 +1,41 @@
+from core.warmup import COLD, WARM, WARMING, WarmupTracker
+
+
+def test_new_server_is_cold_until_used():
+    tracker = WarmupTracker(idle_after=100, retry_after=30)
+    assert tracker.state("a", now=0) == COLD
+    assert tracker.needs_warmup("a", now=0)
+
+    tracker.start_warming("a", now=0)
+    assert tracker.state("a", now=1) == WARMING
+    assert not tracker.needs_warmup("a", now=1)
+
+    tracker.finish_warming("a", ok=True, now=10)
+    assert tracker.state("a", now=50) == WARM
+    assert tracker.state("a", now=111) == COLD
+
+
+def test_failed_warmup_waits_before_retrying():
+    tracker = WarmupTracker(idle_after=100, retry_after=30)
+    tracker.start_warming("a", now=0)
+    tracker.finish_warming("a", ok=False, now=5)
+    assert tracker.state("a", now=6) == COLD
+    assert not tracker.needs_warmup("a", now=20)
+    assert tracker.needs_warmup("a", now=31)
+
+
+def test_recovery_from_down_makes_server_cold():
+    tracker = WarmupTracker(idle_after=100)
+    tracker.mark_used("a", now=0)
+    tracker.observe("a", "idle")
+    tracker.observe("a", "down")
+    assert tracker.is_warm("a", now=1)
+    tracker.observe("a", "idle")
+    assert not tracker.is_warm("a", now=1)
+
+
+def test_order_prefers_warm_servers():
+    tracker = WarmupTracker(idle_after=100)
+    tracker.mark_used("b", now=0)
+    tracker.mark_used("d", now=0)
+    assert tracker.order(["a", "b", "c", "d"], now=1) == ["b", "d", "a", "c"]
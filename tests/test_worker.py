@@ -1,79 +1,354 @@
 import asyncio
+import json
 from datetime import datetime, timedelta
-import os
-import sys
+import threading
+import time
+import urllib.error
+from io import BytesIO
 
 import pytest
 
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
-# Set minimal environment variables required by the settings module before
-# importing the worker module.
-os.environ.setdefault("BASE_URL", "http://testserver")
-os.environ.setdefault("STATIC_DIR", "static")
-os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
-os.environ.setdefault("AWS_REGION", "us-east-1")
-os.environ.setdefault("S3_BUCKET", "dummy-bucket")
-os.environ.setdefault("COMFYUI_API_SERVER1", "http://localhost")
-os.environ.setdefault("COMFYUI_API_SERVER2", "http://localhost")
-os.environ.setdefault("COMFYUI_API_SERVER3", "http://localhost")
-os.environ.setdefault("COMFYUI_API_SERVER4", "http://localhost")
-os.environ.setdefault("TIMER_TERMS", "20")
-os.environ.setdefault("CONFIG_INDEX", "6")
-
 import worker as worker_module
+from core import jobstore, servers
+from core.memory_store import MemoryRedis
+from core.metrics import GAUGES_KEY
 
 
 class DummyAPI:
+    def __init__(self):
+        self.cancelled = []
+        self.healthy_servers = set()
+
     async def get_available_server_addresses(self):
         return []
 
+    def cancel_prompt(self, server_address, prompt_id):
+        self.cancelled.append((server_address, prompt_id))
+        return "interrupted"
 
-class FakeRedis:
-    def __init__(self):
-        self.store = {}
 
-    async def hset(self, key, mapping=None, **kwargs):
-        data = self.store.setdefault(key, {})
-        if mapping:
-            data.update(mapping)
-        if kwargs:
-            data.update(kwargs)
+@pytest.fixture
+def worker(monkeypatch):
+    store = MemoryRedis()
+    monkeypatch.setattr(worker_module, "redis", store)
+    monkeypatch.setattr(worker_module, "MultiComfyUiAPI", lambda *args, **kwargs: DummyAPI())
+    w = worker_module.Worker(server_list=[])
+    w.store = store
+    return w
 
-    async def hget(self, key, field):
-        return self.store.get(key, {}).get(field)
 
-    async def hgetall(self, key):
-        return self.store.get(key, {}).copy()
+def test_expired_deadline_cancels_prompt_and_frees_server(worker):
+    store = worker.store
 
-    async def scan_iter(self, pattern):
-        prefix = pattern.rstrip("*")
-        for k in list(self.store.keys()):
-            if k.startswith(prefix):
-                yield k
+    async def run_test():
+        await store.hset("job:test", mapping={"status": "processing", "server": "srv", "prompt_id": "p1",
+                                             "attempt": "1"})
+        await store.zadd(worker_module.DEADLINES_KEY, {"test": time.time() - 1})
+        await store.zadd(worker_module.DEADLINES_KEY, {"later": time.time() + 60})
+        worker.active_servers.add("srv")
+        return await worker.enforce_deadlines()
 
-    async def rpop(self, key):
-        return None
+    wait = asyncio.run(run_test())
+    # prazo vencido é falha do servidor: nova tentativa, longe dele
+    assert store.data["job:test"]["status"] == "retrying"
+    assert store.data["job:test"]["avoid_servers"] == "srv"
+    assert worker.api.cancelled == [("srv", "p1")]
+    assert "srv" not in worker.active_servers
+    assert list(store.data[worker_module.DEADLINES_KEY]) == ["later"]
+    assert 0 < wait <= worker_module.DEADLINE_MAX_SLEEP
 
-    async def set(self, key, value):
-        self.store[key] = value
 
-    async def get(self, key):
-        return self.store.get(key)
+def test_processing_scan_does_not_expire_jobs(worker):
+    # o prazo é do deadline_timer; a varredura só marca o servidor como ocupado
+    async def run_test():
+        start_time = (datetime.utcnow() - timedelta(seconds=301)).isoformat()
+        await worker.store.hset("job:test", mapping={"status": "processing", "proc_start_at": start_time,
+                                                    "server": "srv", "attempt": "1"})
+        await worker.process_jobs()
 
+    asyncio.run(run_test())
+    assert worker.store.data["job:test"]["status"] == "processing"
+    assert worker.servers_in_use == {"srv"}
 
-@pytest.mark.usefixtures("monkeypatch")
-def test_timeout_sets_failed_status(monkeypatch):
-    fake = FakeRedis()
-    monkeypatch.setattr(worker_module, "redis", fake)
-    monkeypatch.setattr(worker_module, "MultiComfyUiAPI", lambda *args, **kwargs: DummyAPI())
 
-    worker = worker_module.Worker(server_list=[])
+def test_late_result_of_expired_job_is_dropped(worker):
+    run = worker_module.JobRun(None, {}, "test", "in.png", 1)
+    run.abandoned = "timeout"
+    asyncio.run(worker._fail_job(run, RuntimeError("interrompido")))
+    asyncio.run(worker._complete_job(run, "srv", None, time.time()))
+    assert "job:test" not in worker.store.data
+
+
+def test_server_failure_is_retried_on_another_server(worker):
+    store = worker.store
+    worker.api.healthy_servers = {"srv", "other"}
 
     async def run_test():
-        start_time = (datetime.utcnow() - timedelta(seconds=301)).isoformat()
-        await fake.hset("job:test", mapping={"status": "processing", "proc_start_at": start_time, "server": "srv", "attempt": "1"})
+        await store.hset("job:j", mapping={"status": "processing", "input": "in.png", "created_at": "1"})
+        await worker.handle_failure("j", "1", "srv", worker_module.failures.ServerError("OOM"))
+        assert store.data["job:j"]["status"] == "retrying"
+        # ainda em backoff: nada volta para a fila
+        await worker.release_retries()
+        assert store.data["job:j"]["status"] == "retrying"
+        await store.zadd(worker_module.failures.RETRIES_KEY, {"j": time.time() - 1})
+        await worker.release_retries()
         await worker.process_jobs()
-        return await fake.hget("job:test", "status")
 
-    status = asyncio.run(run_test())
-    assert status == "failed"
+    asyncio.run(run_test())
+    job = store.data["job:j"]
+    assert (job["status"], job["attempt"], job["fault"]) == ("queued", "2", "server")
+    assert worker.queued_jobs["j"]["avoid"] == ["srv"]
+    assert worker.get_earliest_job(worker.queued_jobs, "srv") is None
+    assert worker.get_earliest_job(worker.queued_jobs, "other") == "j"
+    # se falhou em todos os saudáveis, qualquer um serve
+    worker.api.healthy_servers = {"srv"}
+    assert worker.get_earliest_job(worker.queued_jobs, "srv") == "j"
+
+
+def test_prompt_rejected_by_server_is_retried_elsewhere(worker):
+    error = urllib.error.HTTPError("http://srv/prompt", 400, "Bad Request", {}, None)
+    asyncio.run(worker.handle_failure("j", 1, "srv", error))
+    job = worker.store.data["job:j"]
+    assert (job["status"], job["fault"], job["avoid_servers"]) == ("retrying", "server", "srv")
+    assert "j" in worker.store.data[worker_module.failures.RETRIES_KEY]
+
+
+@pytest.mark.parametrize("error,attempt", [
+    (worker_module.failures.InputError("sem rosto"), 1),
+    (worker_module.failures.ServerError("OOM"), 3),
+])
+def test_permanent_failure_goes_to_dead_letter(worker, error, attempt):
+    asyncio.run(worker.handle_failure("j", attempt, "srv", error))
+    assert worker.store.data["job:j"]["status"] == "error"
+    entry = json.loads(worker.store.data[worker_module.failures.DEAD_LETTER_KEY][0])
+    assert (entry["request_id"], entry["attempt"], entry["error"]) == ("j", attempt, str(error))
+    assert worker.store.data.get(worker_module.failures.RETRIES_KEY, {}) == {}
+
+
+def test_cancel_removes_queued_job(worker):
+    worker.queued_jobs["q"] = {"job_id": "q", "created_at": "", "input": "in.png"}
+
+    async def run_test():
+        await worker.store.hset("job:q", mapping={"status": "queued", "input": "in.png"})
+        await worker.cancel_job("q")
+
+    asyncio.run(run_test())
+    assert "q" not in worker.queued_jobs
+    assert worker.store.data["job:q"]["status"] == "cancelled"
+    assert worker.api.cancelled == []
+
+
+def test_cancel_interrupts_running_job_and_frees_server(worker):
+    run = worker_module.JobRun(None, {}, "r", "in.png", 1)
+    run.server, run.prompt_id = "srv", "p9"
+    worker.running["r"] = run
+    worker.active_servers.add("srv")
+
+    class Span:
+        def set_attribute(self, *args):
+            pass
+    run.span = Span()
+
+    async def run_test():
+        await worker.store.hset("job:r", mapping={"status": "processing", "server": "srv"})
+        await worker.store.zadd(worker_module.DEADLINES_KEY, {"r": time.time() + 60})
+        await worker.cancel_job("r")
+
+    asyncio.run(run_test())
+    assert worker.store.data["job:r"]["status"] == "cancelled"
+    assert worker.api.cancelled == [("srv", "p9")]
+    assert run.abandoned == "cancelled"
+    assert "srv" not in worker.active_servers and "r" not in worker.running
+    assert worker.store.data[worker_module.DEADLINES_KEY] == {}
+
+
+def test_cancelling_one_batch_job_keeps_the_shared_prompt(worker, monkeypatch):
+    store, api = worker.store, worker.api
+    queued, release = threading.Event(), threading.Event()
+    completed = []
+
+    class Workflows:
+        versions = {"v1": None}
+
+        def choose(self):
+            return "v1"
+    api.workflows = Workflows()
+
+    def generate_image_batch(server, bios, stages, contexts, timestamps, workflow, on_queued):
+        on_queued("p1")
+        queued.set()
+        release.wait(5)
+        return [BytesIO(b"a"), BytesIO(b"b")]
+    api.generate_image_batch = generate_image_batch
+
+    class S3:
+        def get_object(self, Bucket, Key):
+            return {"Body": BytesIO(b"in")}
+    monkeypatch.setattr(worker_module, "s3_client", S3())
+
+    async def fake_complete(run, server, out, start):
+        if not run.abandoned:
+            completed.append((run.request_id, out.getvalue()))
+    monkeypatch.setattr(worker, "_complete_job", fake_complete)
+    monkeypatch.setattr(worker_module.settings, "BATCH_SIZE", 2)
+
+    async def run_test():
+        for rid in ("a", "b"):
+            await store.hset(f"job:{rid}", mapping={"status": "queued", "input": f"{rid}.png", "workflow": "v1"})
+        worker.active_servers.add("srv")
+        batch = asyncio.create_task(worker.process_batch("srv", [("a", "a.png"), ("b", "b.png")]))
+        await asyncio.to_thread(queued.wait, 5)
+        await asyncio.sleep(0)
+        await worker.cancel_job("a")
+        cancelled_while_running = list(api.cancelled)
+        release.set()
+        await batch
+        return cancelled_while_running
+
+    assert asyncio.run(run_test()) == []
+    assert completed == [("b", b"b")]
+    assert store.data["job:a"]["status"] == "cancelled"
+    assert worker.running == {} and "srv" not in worker.active_servers
+
+
+def test_recover_collects_finished_prompt_and_requeues_unsent(worker, monkeypatch):
+    store = worker.store
+    completed = []
+    worker.api.prompt_state = lambda server, prompt_id: ("done", {"outputs": {}})
+    worker.api.collect_outputs = lambda server, entry, workflow, index, size: ("img", index, size)
+
+    async def fake_complete(run, server, out, start):
+        completed.append((run.request_id, server, out, run.recovered))
+    monkeypatch.setattr(worker, "_complete_job", fake_complete)
+
+    async def run_test():
+        await store.hset("job:a", mapping={"status": "processing", "server": "srv", "prompt_id": "p1",
+                                          "workflow": "v1", "batch_index": "1", "batch_size": "2",
+                                          "deadline_at": str(time.time() + 60)})
+        await store.hset("job:b", mapping={"status": "processing", "server": "srv", "workflow": "v1"})
+        await worker.recover_jobs()
+        await asyncio.gather(*worker.tasks)
+
+    asyncio.run(run_test())
+    assert completed == [("a", "srv", ("img", 1, 2), True)]
+    assert store.data["job:b"]["status"] == "queued"
+    assert worker.running == {} and "srv" not in worker.active_servers
+    assert store.data[worker_module.DEADLINES_KEY] == {}
+
+
+def test_recover_requeues_prompt_lost_by_server(worker):
+    worker.api.prompt_state = lambda server, prompt_id: ("lost", None)
+
+    async def run_test():
+        await worker.store.hset("job:a", mapping={"status": "processing", "server": "srv", "prompt_id": "p1",
+                                                 "workflow": "v1", "attempt": "2"})
+        await worker.recover_jobs()
+        await asyncio.gather(*worker.tasks)
+
+    asyncio.run(run_test())
+    job = worker.store.data["job:a"]
+    assert (job["status"], job["attempt"]) == ("queued", "2")
+
+
+def test_stuck_warmup_times_out_and_leaves_server_cold(worker, monkeypatch):
+    worker.api.warm_up = lambda server, image_path: time.sleep(0.3)
+    monkeypatch.setattr(worker_module.settings, "JOB_TIMEOUT", 0.05)
+
+    asyncio.run(worker.warm_up_server("srv"))
+    assert not worker.warmup.is_warm("srv")
+    assert "srv" not in worker.warmup.warming
+
+
+def test_jobs_in_flight_counts_every_batch_member(worker, monkeypatch):
+    for rid in ("a", "b"):
+        run = worker_module.JobRun(None, {}, rid, "in.png", 1, batch_size=2)
+        run.server = "srv"
+        worker.running[rid] = run
+    worker.servers_in_use = {"srv"}
+    monkeypatch.setattr(worker_module.metrics, "flush_due", lambda: True)
+
+    asyncio.run(worker.report_metrics())
+    gauges = worker.store.data[GAUGES_KEY]
+    assert float(gauges[worker_module.JOBS_IN_FLIGHT]) == 2
+
+
+def test_spawned_tasks_are_tracked_until_done(worker):
+    async def run_test():
+        gate = asyncio.Event()
+        task = worker.spawn(gate.wait())
+        assert worker.tasks == {task}
+        gate.set()
+        await task
+        return worker.tasks
+
+    assert asyncio.run(run_test()) == set()
+
+
+def test_scheduler_serves_priority_lane_then_shares_by_lane(worker):
+    worker.lanes = worker_module.LaneScheduler(priority=["vip"])
+    for i in range(4):
+        worker.queued_jobs[f"busy{i}"] = {"job_id": f"busy{i}", "created_at": f"0{i}", "input": "in.png",
+                                          "lane": "booth-1"}
+    worker.queued_jobs["quiet"] = {"job_id": "quiet", "created_at": "10", "input": "in.png", "lane": "booth-2"}
+    worker.queued_jobs["vip"] = {"job_id": "vip", "created_at": "20", "input": "in.png", "lane": "vip"}
+
+    order = []
+    while worker.queued_jobs:
+        job_id = worker.get_earliest_job(worker.queued_jobs, "srv")
+        worker.lanes.charge(worker.queued_jobs.pop(job_id)["lane"])
+        order.append(job_id)
+    assert order[:3] == ["vip", "busy0", "quiet"]
+
+
+def test_worker_lifecycle_goes_through_jobstore(worker):
+    store, w = worker.store, worker
+
+    async def run_test():
+        for rid in ("a", "b"):
+            await jobstore.transition(store, rid, "queued", {"input": f"{rid}.png", "created_at": rid})
+            await jobstore.enqueue(store, rid, f"{rid}.png")
+        await w.check_for_new_jobs()
+        await w.process_jobs()
+        queued = sorted(w.queued_jobs)
+        await w.cancel_job("a")
+        return queued, await jobstore.get(store, "a")
+
+    queued, job = asyncio.run(run_test())
+    assert queued == ["a", "b"]
+    assert "a" not in w.queued_jobs and job["status"] == "cancelled"
+    assert list(store.data[worker_module.archive.FINISHED_KEY]) == ["a"]
+
+
+def test_worker_follows_server_registry(monkeypatch):
+    store = MemoryRedis()
+    api = DummyAPI()
+    api.server_address_list, api.http_only_servers = [], set()
+    monkeypatch.setattr(worker_module, "redis", store)
+    monkeypatch.setattr(worker_module, "MultiComfyUiAPI", lambda *args, **kwargs: api)
+    w = worker_module.Worker(server_list=["http://seed:8188"])
+
+    async def run_test():
+        await servers.seed(store, w.seed_servers)
+        await servers.register(store, "http://gpu5:8188", {"max_batch": 2, "output": "http"})
+        await w.refresh_servers(force=True)
+        added = list(api.server_address_list)
+
+        # job rodando no servidor que vai ser drenado
+        run = worker_module.JobRun(None, {}, "j", "in.png", 1)
+        run.server = "http://gpu5:8188"
+        w.running["j"] = run
+        await servers.set_draining(store, "http://gpu5:8188")
+        await w.refresh_servers(force=True)
+        draining = (list(api.server_address_list), set(w.draining_servers),
+                    await store.hgetall(servers.IN_FLIGHT_KEY))
+
+        w.running.clear()
+        await w.refresh_servers(force=True)
+        return added, draining
+
+    monkeypatch.setattr(worker_module.settings, "BATCH_SIZE", 4)
+    added, draining = asyncio.run(run_test())
+    assert added == ["http://gpu5:8188", "http://seed:8188"]
+    assert w.batch_size("http://gpu5:8188") == 2 and "http://gpu5:8188" in api.http_only_servers
+    assert draining == (["http://seed:8188"], {"http://gpu5:8188"}, {"http://gpu5:8188": "1"})
+    assert w.draining_servers == set()
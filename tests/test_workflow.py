@@ -0,0 +1,176 @@
+import json
+import os
+import random
+import time
+from collections import Counter
+
+import pytest
+
+from core.workflow import (BatchWorkflow, CompiledWorkflow, WorkflowRegistry, downstream_nodes, is_link,
+                           offload_frame_composite, parse_weights, prune_workflow, reachable_nodes)
+
+
+WORKFLOWS_DIR = os.path.join(os.path.dirname(__file__), "..", "src", "workflows")
+
+
+def load(name):
+    with open(os.path.join(WORKFLOWS_DIR, name), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_render_matches_deepcopy_and_dumps():
+    template = load("mamulengo_v21_api.json")
+    compiled = CompiledWorkflow(template, {"image": ("3023", "image")})
+
+    path = 'uploads/foto "1"\\ção.png'
+    body = json.loads(compiled.render("abc-123", image=path))
+
+    expected = json.loads(json.dumps(template))
+    expected["3023"]["inputs"]["image"] = path
+    assert body == {"prompt": expected, "client_id": "abc-123"}
+    # o template original não é alterado
+    assert template["3023"]["inputs"]["image"] != path
+
+
+def test_omitted_patch_point_keeps_template_value():
+    template = load("comfyui_basic_input.json")
+    compiled = CompiledWorkflow(template, {"image": ("8", "image")})
+    assert compiled.build() == template
+
+
+def test_multiple_patch_points():
+    template = load("comfyui_basic_input.json")
+    compiled = CompiledWorkflow(template, {"image": ("8", "image"), "seed": ("10", "noise_seed")})
+    prompt = compiled.build(image="x.png", seed=42)
+    assert prompt["8"]["inputs"]["image"] == "x.png"
+    assert prompt["10"]["inputs"]["noise_seed"] == 42
+
+
+@pytest.mark.parametrize("point", [("999", "image"), ("8", "nao_existe")])
+def test_invalid_patch_point_fails_at_load(point):
+    with pytest.raises(ValueError):
+        CompiledWorkflow(load("comfyui_basic_input.json"), {"image": point})
+
+
+def test_prune_keeps_only_nodes_reaching_output():
+    template = load("mamulengo_v18_api.json")
+    pruned, report = prune_workflow(template)
+
+    assert report["outputs"] == ["3040"]
+    assert set(pruned) == reachable_nodes(template, ["3040"])
+    assert report["pruned_nodes"]["3073"] == "PreviewImage"
+    assert report["pruned_nodes"]["3064"] == "PreviewTextNode"
+    assert "3023" in pruned
+    assert len(pruned) + len(report["pruned_nodes"]) == len(template)
+    for node in pruned.values():
+        for value in node["inputs"].values():
+            if is_link(value):
+                assert value[0] in pruned
+
+
+def test_prune_reports_models_only_used_by_dead_nodes():
+    workflow = {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "base.safetensors"}},
+        "2": {"class_type": "LoraLoader", "inputs": {"lora_name": "orfa.safetensors", "model": ["1", 0]}},
+        "3": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "base.safetensors"}},
+        "9": {"class_type": "SaveImage", "inputs": {"images": ["1", 0]}},
+    }
+    pruned, report = prune_workflow(workflow)
+    assert set(pruned) == {"1", "9"}
+    assert report["pruned_models"] == ["orfa.safetensors"]
+
+
+def test_prune_rejects_unknown_output():
+    with pytest.raises(ValueError):
+        prune_workflow(load("comfyui_basic_input.json"), ["404"])
+
+
+def write_version(directory, name, workflow):
+    path = directory / f"{name}.json"
+    path.write_text(json.dumps(workflow), encoding="utf-8")
+    return path
+
+
+def test_registry_loads_versions_and_skips_invalid(tmp_path):
+    base = load("comfyui_basic_input.json")
+    write_version(tmp_path, "v1", base)
+    write_version(tmp_path, "v2", base)
+    write_version(tmp_path, "sem_load_image", load("comfyui_basic.json"))
+
+    registry = WorkflowRegistry(str(tmp_path), str(tmp_path / "v1.json"), {"image": ("8", "image")})
+    assert registry.names() == ["v1", "v2"]
+    assert registry.get().name == "v1"
+    assert json.loads(registry.get("v2").compiled.render("c", image="a.png"))["prompt"]["8"]["inputs"]["image"] == "a.png"
+
+
+def test_registry_weighted_choice():
+    registry = WorkflowRegistry(WORKFLOWS_DIR, os.path.join(WORKFLOWS_DIR, "mamulengo_v21_api.json"),
+                                {"image": ("3023", "image")}, pattern="mamulengo_*.json",
+                                weights=parse_weights("mamulengo_v21_api=3,mamulengo_v20_api=1,inexistente=5"))
+    rng = random.Random(1)
+    picks = Counter(registry.choose(rng) for _ in range(2000))
+    assert set(picks) == {"mamulengo_v21_api", "mamulengo_v20_api"}
+    assert 2.5 < picks["mamulengo_v21_api"] / picks["mamulengo_v20_api"] < 3.5
+
+    registry.set_weights({"mamulengo_v16_api": 1})
+    assert registry.choose(rng) == "mamulengo_v16_api"
+    registry.set_weights({})
+    assert registry.weights == registry.configured_weights
+
+
+def test_registry_hot_reload(tmp_path):
+    base = load("comfyui_basic_input.json")
+    v1 = write_version(tmp_path, "v1", base)
+    registry = WorkflowRegistry(str(tmp_path), str(v1), {"image": ("8", "image")})
+
+    changed = dict(base, **{"8": {"class_type": "LoadImage", "inputs": {"image": "novo.png"}}})
+    write_version(tmp_path, "v1", changed)
+    os.utime(v1, (time.time() + 10, time.time() + 10))
+    write_version(tmp_path, "v2", base)
+    assert registry.reload() == {"loaded": ["v1", "v2"], "removed": []}
+    assert registry.get("v1").template["8"]["inputs"]["image"] == "novo.png"
+
+    # arquivo alterado para algo inválido: a versão anterior continua valendo
+    broken = write_version(tmp_path, "v2", {"1": {"class_type": "SaveImage", "inputs": {}}})
+    os.utime(broken, (time.time() + 20, time.time() + 20))
+    assert registry.reload() == {"loaded": [], "removed": []}
+    assert "8" in registry.get("v2").template
+
+    broken.unlink()
+    assert registry.reload() == {"loaded": [], "removed": ["v2"]}
+
+
+def test_batch_clones_per_image_subgraph_and_shares_loaders():
+    template = load("comfyui_basic_input.json")
+    batch = BatchWorkflow(template, {"image": ("8", "image")}, 3)
+    graph = batch.compiled.workflow
+
+    per_image = downstream_nodes(template, ["8"])
+    shared = set(template) - per_image
+    assert len(graph) == len(shared) + 3 * len(per_image)
+    assert batch.outputs == {"19": 0, "119": 1, "219": 2}
+
+    prompt = json.loads(batch.render("c", image=["a.png", "b.png", "c.png"]))["prompt"]
+    assert [prompt[n]["inputs"]["image"] for n in ("8", "108", "208")] == ["a.png", "b.png", "c.png"]
+    for node_id, node in prompt.items():
+        for value in node["inputs"].values():
+            if is_link(value):
+                assert value[0] in prompt
+                # cópias só apontam para a própria cópia ou para nós compartilhados
+                if node_id.startswith("2") and len(node_id) == 3:
+                    assert value[0] in shared or value[0].startswith("2")
+
+
+def test_frame_composite_moves_to_worker(tmp_path):
+    template = load("mamulengo_v21_api.json")
+
+    # sem o arquivo da moldura local, o composite continua na GPU
+    unchanged, frame = offload_frame_composite(template, str(tmp_path))
+    assert frame is None and unchanged is template
+
+    (tmp_path / "mamulengo_frame_1080px_v01.png").write_bytes(b"")
+    graph, frame = offload_frame_composite(template, str(tmp_path))
+    assert frame == str(tmp_path / "mamulengo_frame_1080px_v01.png")
+    assert "3101" not in graph and "3102" not in graph
+    assert graph["3040"]["inputs"]["images"] == ["3121", 5]
+    assert template["3040"]["inputs"]["images"] == ["3102", 0]